@@ -0,0 +1,57 @@
+"""Benchmark the file size & load time of :class:`fs_algo.compact_models.CompactForest`
+against the joblib dump written by :meth:`fs_algo.fs_algo_train_eval.AlgoTrainEval.save_algos`
+
+Trains a random forest on synthetic data, saves it as the uncompressed joblib
+pipeline and as float64 & float32 compact forests, then reports each file's size,
+the time to load it, & the largest prediction difference from the original forest.
+
+:note python bench_compact_forest.py --n_rows 20000 --n_attrs 30 --n_estimators 400
+
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import make_pipeline
+
+import fs_algo.fs_algo_train_eval as fsate
+
+
+def bench_load(load, path: Path, X: np.ndarray, y_ref: np.ndarray, n_repeat: int = 3) -> dict:
+    t_load = list()
+    for _ in range(n_repeat):
+        t_start = time.perf_counter()
+        model = load(path)
+        t_load.append(time.perf_counter() - t_start)
+    return {'MB': round(path.stat().st_size/1e6, 2),
+            'load_seconds': round(min(t_load), 4),
+            'max_abs_diff': float(np.max(np.abs(model.predict(X) - y_ref)))}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmark compact forest serialization')
+    parser.add_argument('--n_rows', type=int, default=20000, help='Total training rows')
+    parser.add_argument('--n_attrs', type=int, default=30, help='Total attributes')
+    parser.add_argument('--n_estimators', type=int, default=400, help='Total trees')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(32)
+    X = rng.random((args.n_rows, args.n_attrs))
+    y = X[:, 0] + np.sin(X[:, 1]*6) + rng.random(args.n_rows)/5
+    pipe = make_pipeline(RandomForestRegressor(n_estimators=args.n_estimators, n_jobs=-1, random_state=32)).fit(X, y)
+    y_ref = pipe.predict(X)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path_joblib = Path(tmpdir)/'algo_rf.joblib'
+        joblib.dump({'model': pipe, 'confidence_intervals': None}, path_joblib)
+        rslt = {'joblib': bench_load(lambda p: joblib.load(p)['model'], path_joblib, X, y_ref)}
+        for dtype in ['float64', 'float32']:
+            path_compact = fsate.CompactForest.from_forest(pipe, dtype=dtype).save(Path(tmpdir)/f'algo_rf_{dtype}.fsforest')
+            rslt[f'compact {dtype} (mmap)'] = bench_load(fsate.CompactForest.load, path_compact, X, y_ref)
+            rslt[f'compact {dtype} (in memory)'] = bench_load(lambda p: fsate.CompactForest.load(p, mmap_mode=None),
+                                                              path_compact, X, y_ref)
+        print(pd.DataFrame(rslt).transpose())
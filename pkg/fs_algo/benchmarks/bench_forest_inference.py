@@ -0,0 +1,61 @@
+"""Benchmark random forest inference with :class:`fs_algo.compact_models.CompactForest`
+against :meth:`sklearn.ensemble.RandomForestRegressor.predict`
+
+Trains a random forest on synthetic data, then reports the seconds per call, rows per
+second, & peak memory allocated per call (via tracemalloc) across batch sizes, for both
+point predictions and the per-tree predictions used by the uncertainty estimates.
+
+:note python bench_forest_inference.py --n_rows 20000 --n_attrs 30 --n_estimators 100
+
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+import fs_algo.fs_algo_train_eval as fsate
+
+
+def bench(func, X: np.ndarray, min_seconds: float = 1.0) -> dict:
+    func(X) # warm up
+    tracemalloc.start()
+    func(X)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    n_calls = 0
+    t_start = time.perf_counter()
+    while time.perf_counter() - t_start < min_seconds:
+        func(X)
+        n_calls += 1
+    sec_call = (time.perf_counter() - t_start)/n_calls
+    return {'ms_per_call': round(sec_call*1e3, 3), 'rows_per_sec': int(X.shape[0]/sec_call),
+            'peak_MB_per_call': round(peak/1e6, 3)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmark random forest inference')
+    parser.add_argument('--n_rows', type=int, default=20000, help='Total training rows')
+    parser.add_argument('--n_attrs', type=int, default=30, help='Total attributes')
+    parser.add_argument('--n_estimators', type=int, default=100, help='Total trees')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 10, 100, 1000, 10000, 50000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(32)
+    X = rng.random((args.n_rows, args.n_attrs))
+    y = X[:, 0] + np.sin(X[:, 1]*6) + rng.random(args.n_rows)/5
+    rf = RandomForestRegressor(n_estimators=args.n_estimators, n_jobs=-1, random_state=32).fit(X, y)
+    rf.n_jobs = None
+    forest = fsate.CompactForest.from_forest(rf)
+
+    sk_trees = lambda X: np.stack([tree.predict(X) for tree in rf.estimators_])
+    rslt = dict()
+    for n in args.batch_sizes:
+        X_batch = rng.random((n, args.n_attrs)).astype(np.float32)
+        np.testing.assert_allclose(forest.predict(X_batch), rf.predict(X_batch))
+        rslt[(n, 'predict', 'sklearn')] = bench(rf.predict, X_batch)
+        rslt[(n, 'predict', 'CompactForest')] = bench(forest.predict, X_batch)
+        rslt[(n, 'per-tree', 'sklearn')] = bench(sk_trees, X_batch)
+        rslt[(n, 'per-tree', 'CompactForest')] = bench(forest.predict_trees, X_batch)
+    print(pd.DataFrame(rslt).transpose())
@@ -0,0 +1,100 @@
+"""Benchmark the parquet I/O performed by :func:`fs_algo.fs_algo_train_eval.fs_read_attr_comid`
+
+Generates a synthetic attribute database laid out like proc.attr.hydfab output
+(one `comid_<COMID>_attrs.parquet` file per COMID) and reports the bytes read &
+wall time per call for the legacy approach (regex subsetting & three separate
+dask graph executions) and for the current :func:`fs_read_attr_comid`.
+
+:note python bench_fs_read_attr_comid.py --n_comids 2000 --n_attrs 100 --n_sel 50
+
+"""
+import argparse
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import dask.dataframe as dd
+import fsspec
+import numpy as np
+import pandas as pd
+from fsspec.implementations.local import LocalFileOpener, LocalFileSystem
+
+import fs_algo.fs_algo_train_eval as fsate
+
+
+class _CountingFileOpener(LocalFileOpener):
+    def read(self, *args, **kwargs):
+        out = super().read(*args, **kwargs)
+        CountingFileSystem.bytes_read += len(out)
+        return out
+
+    def readinto(self, b):
+        n = super().readinto(b)
+        CountingFileSystem.bytes_read += n
+        return n
+
+class CountingFileSystem(LocalFileSystem):
+    """Local filesystem that tallies every byte read, addressed as 'countfile://'"""
+    protocol = 'countfile'
+    bytes_read = 0
+
+    def _open(self, path, mode='rb', block_size=None, **kwargs):
+        path = self._strip_protocol(path)
+        if 'r' in mode:
+            return _CountingFileOpener(path, mode, fs=self, **kwargs)
+        return super()._open(path, mode, block_size=block_size, **kwargs)
+
+fsspec.register_implementation('countfile', CountingFileSystem, clobber=True)
+
+def _legacy_read_attr_comid(dir_db_attrs, comids_resp, attrs_sel='all') -> pd.DataFrame:
+    # The previous implementation: regex subsetting & three graph executions
+    all_attr_ddf = dd.read_parquet(dir_db_attrs)
+    attr_ddf_subloc = all_attr_ddf[all_attr_ddf['featureID'].str.contains('|'.join(comids_resp))]
+    attr_ddf_subloc.shape[0].compute()
+    if attrs_sel == 'all':
+        attrs_sel = attr_ddf_subloc['attribute'].unique().compute()
+    attr_ddf_sub = attr_ddf_subloc[attr_ddf_subloc['attribute'].str.contains('|'.join(attrs_sel))]
+    return attr_ddf_sub.compute()
+
+def gen_attr_db(dir_db_attrs: Path, n_comids: int, n_attrs: int, seed: int = 32) -> list:
+    rng = np.random.default_rng(seed)
+    comids = [str(x) for x in rng.choice(np.arange(1000000, 9999999), n_comids, replace=False)]
+    attrs = [f'attr_{i:04d}' for i in range(n_attrs)]
+    for comid in comids:
+        pd.DataFrame({'data_source': 'synthetic',
+                      'dl_timestamp': '2024-07-26 08:59:36',
+                      'attribute': attrs,
+                      'value': rng.random(n_attrs),
+                      'featureID': comid,
+                      'featureSource': 'COMID'}
+                     ).to_parquet(Path(dir_db_attrs/Path(f'comid_{comid}_attrs.parquet')))
+    return comids
+
+def bench(func, dir_db_attrs: str, comids: list, attrs_sel) -> dict:
+    CountingFileSystem.bytes_read = 0
+    t_start = time.perf_counter()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        df = func(dir_db_attrs, comids, attrs_sel=attrs_sel)
+    return {'seconds': round(time.perf_counter() - t_start, 3),
+            'MB_read': round(CountingFileSystem.bytes_read/1e6, 3),
+            'rows': df.shape[0]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmark fs_read_attr_comid parquet reads')
+    parser.add_argument('--n_comids', type=int, default=2000, help='Total COMIDs in the attribute database')
+    parser.add_argument('--n_attrs', type=int, default=100, help='Total attributes per COMID')
+    parser.add_argument('--n_sel', type=int, default=50, help='Total COMIDs requested per call')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        comids = gen_attr_db(Path(tmpdir), args.n_comids, args.n_attrs)
+        comids_sel = comids[0:args.n_sel]
+        dir_count = f'countfile://{tmpdir}'
+        rslt = dict()
+        for attrs_sel in ['all', [f'attr_{i:04d}' for i in range(0, args.n_attrs, 10)]]:
+            lbl = 'all attrs' if isinstance(attrs_sel, str) else f'{len(attrs_sel)} attrs'
+            rslt[('legacy', lbl)] = bench(_legacy_read_attr_comid, dir_count, comids_sel, attrs_sel)
+            rslt[('fs_read_attr_comid', lbl)] = bench(fsate.fs_read_attr_comid, dir_count, comids_sel, attrs_sel)
+        print(pd.DataFrame(rslt).transpose())
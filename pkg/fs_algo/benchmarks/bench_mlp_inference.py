@@ -0,0 +1,61 @@
+"""Benchmark multi-layer perceptron inference with :class:`fs_algo.compact_models.CompactMLP`
+against the trained `make_pipeline(StandardScaler(), MLPRegressor())`
+
+Trains a multi-layer perceptron pipeline on synthetic data, then reports the milliseconds
+per call & rows per second across batch sizes for the pipeline and for float64 & float32
+compiled forward passes, along with the largest prediction difference from the pipeline.
+
+:note python bench_mlp_inference.py --n_rows 5000 --n_attrs 30 --hidden_layer_sizes 64 32
+
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.neural_network import MLPRegressor
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+import fs_algo.fs_algo_train_eval as fsate
+
+
+def bench(func, X: pd.DataFrame | np.ndarray, y_ref: np.ndarray, min_seconds: float = 1.0) -> dict:
+    max_abs_diff = float(np.max(np.abs(func(X) - y_ref))) # also warms up
+    n_calls = 0
+    t_start = time.perf_counter()
+    while time.perf_counter() - t_start < min_seconds:
+        func(X)
+        n_calls += 1
+    sec_call = (time.perf_counter() - t_start)/n_calls
+    return {'ms_per_call': round(sec_call*1e3, 4), 'rows_per_sec': int(X.shape[0]/sec_call),
+            'max_abs_diff': max_abs_diff}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmark multi-layer perceptron inference')
+    parser.add_argument('--n_rows', type=int, default=5000, help='Total training rows')
+    parser.add_argument('--n_attrs', type=int, default=30, help='Total attributes')
+    parser.add_argument('--hidden_layer_sizes', type=int, nargs='+', default=[64, 32])
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 10, 100, 1000, 10000, 100000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(32)
+    cols = [f'attr{i}' for i in range(args.n_attrs)]
+    X = pd.DataFrame(rng.random((args.n_rows, args.n_attrs))*50, columns=cols)
+    y = np.sin(X['attr0']/10) + X['attr1']/50 + rng.random(args.n_rows)/5
+    pipe = make_pipeline(StandardScaler(), MLPRegressor(hidden_layer_sizes=tuple(args.hidden_layer_sizes),
+                                                        max_iter=200, random_state=32))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        pipe.fit(X, y)
+    mlps = {dtype: fsate.CompactMLP.from_pipeline(pipe, dtype=dtype) for dtype in ['float64', 'float32']}
+
+    rslt = dict()
+    for n in args.batch_sizes:
+        X_batch = pd.DataFrame(rng.random((n, args.n_attrs))*50, columns=cols)
+        y_ref = pipe.predict(X_batch)
+        rslt[(n, 'pipeline')] = bench(pipe.predict, X_batch, y_ref)
+        for dtype, mlp in mlps.items():
+            rslt[(n, f'CompactMLP {dtype}')] = bench(mlp.predict, X_batch, y_ref)
+    print(pd.DataFrame(rslt).transpose())
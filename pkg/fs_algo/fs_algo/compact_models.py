@@ -0,0 +1,381 @@
+"""Standalone compact models, which predict with only numpy: the flat node arrays of a random forest, 
+and the forward pass of a multi-layer perceptron. Each is built from a trained sklearn model, 
+see :mod:`fs_algo.fs_algo_train_eval`, and predicting requires neither sklearn nor unpickling.
+"""
+import numpy as np
+import os
+import json
+from collections.abc import Iterable
+from typing import List, Dict, Callable
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# %% COMPACT FOREST
+class CompactForest:
+    _MAGIC = b'FSFOREST'
+    _ALIGN = 64 # bytes
+    _COMPACT_EVERY = 4 # traversal depths between setting aside the rows that reached a leaf
+    # The largest batches predicted faster than sklearn's compiled traversal in benchmarks/bench_forest_inference.py. 
+    # Larger batches are slower, as each traversal depth is a separate pass over all (tree, row) pairs.
+    FAST_BATCH_ROWS = 500
+
+    def __init__(self, arrays: Dict[str, np.ndarray], n_features_in: int, n_outputs: int,
+                 feature_names_in: Iterable[str] | None = None, n_jobs: int | None = None, block_rows: int = 256):
+        """The node arrays of a trained random forest, concatenated across trees into flat contiguous arrays, 
+        which are saved to a single memory-mappable file that requires no unpickling. 
+        Child node indices are global, & leaves point to themselves. Build with :meth:`from_forest()` or :meth:`load()`.
+        Prediction traverses all trees at once, one depth at a time, for blocks of rows, 
+        which avoids the per-tree overhead of :meth:`RandomForestRegressor.predict()`. 
+        This is faster for small batches, up to about `FAST_BATCH_ROWS` rows, e.g. streamed prediction in small chunks, 
+        while :meth:`RandomForestRegressor.predict()` is faster for larger batches.
+
+        :param arrays: The node arrays `feature`, `threshold`, `children_left`, `children_right`, 
+            `missing_go_to_left` & `value` (shape (n_nodes, n_outputs)), the `roots` of each tree, 
+            and optionally the `inbag` counts (see :func:`fs_algo.fs_algo_train_eval.fs_calc_inbag()`)
+        :type arrays: Dict[str, np.ndarray]
+        :param n_features_in: The total features seen during training
+        :type n_features_in: int
+        :param n_outputs: The total outputs
+        :type n_outputs: int
+        :param feature_names_in: The feature names seen during training, defaults to None
+        :type feature_names_in: Iterable[str] | None, optional
+        :param n_jobs: The total threads predicting blocks of rows, defaults to None, meaning 1. -1 means all cores
+        :type n_jobs: int | None, optional
+        :param block_rows: The total rows traversing all trees at once, which bounds the memory of each call, defaults to 256
+        :type block_rows: int, optional
+        """
+        self.arrays = arrays
+        self.n_features_in_ = n_features_in
+        self.n_outputs_ = n_outputs
+        if feature_names_in is not None:
+            self.feature_names_in_ = np.asarray(list(feature_names_in), dtype=object)
+        self.n_jobs = n_jobs
+        self.block_rows = block_rows
+        self._table = None
+
+    @classmethod
+    def from_forest(cls, forest: 'RandomForestRegressor', dtype: str | np.dtype = np.float64,
+                    inbag: np.ndarray | None = None) -> 'CompactForest':
+        """Compact a trained random forest
+
+        :param forest: The trained random forest, or a pipeline whose only step is a random forest
+        :type forest: RandomForestRegressor
+        :param dtype: The floating point type of the thresholds & node values, defaults to np.float64. 
+            With np.float32, thresholds are rounded down so that every split is unchanged, & only the predicted values lose precision.
+        :type dtype: str | np.dtype, optional
+        :param inbag: The in-bag counts to store with the forest for uncertainty estimates, defaults to None
+        :type inbag: np.ndarray | None, optional
+        :return: The compact forest
+        :rtype: CompactForest
+        """
+        if hasattr(forest, 'steps'): # A pipeline
+            forest = forest[-1]
+        dtype = np.dtype(dtype)
+        trees = [est.tree_ for est in forest.estimators_]
+        n_nodes = np.array([tree.node_count for tree in trees])
+        roots = np.concatenate([[0], np.cumsum(n_nodes)[:-1]]).astype(np.int64)
+        feature = np.concatenate([tree.feature for tree in trees]).astype(np.int32)
+        is_leaf = feature < 0
+        node_ids = np.arange(len(feature), dtype=np.int32 if len(feature) < np.iinfo(np.int32).max else np.int64)
+        children = dict()
+        for side in ['children_left', 'children_right']:
+            child = np.concatenate([getattr(tree, side) + root for tree, root in zip(trees, roots)])
+            children[side] = np.where(is_leaf, node_ids, child).astype(node_ids.dtype)
+        threshold_dt = cls._round_down(np.concatenate([tree.threshold for tree in trees]), dtype)
+        arrays = {'feature': np.where(is_leaf, 0, feature).astype(np.int32), # leaves never use their feature
+                  'threshold': threshold_dt,
+                  **children,
+                  'missing_go_to_left': np.concatenate([tree.missing_go_to_left for tree in trees]).astype(np.uint8),
+                  'value': np.concatenate([tree.value[:, :, 0] for tree in trees]).astype(dtype),
+                  'roots': roots}
+        if inbag is not None:
+            arrays['inbag'] = np.asarray(inbag)
+        return cls(arrays, n_features_in=forest.n_features_in_, n_outputs=forest.n_outputs_,
+                   feature_names_in=getattr(forest, 'feature_names_in_', None))
+
+    @staticmethod
+    def _round_down(threshold: np.ndarray, dtype: np.dtype) -> np.ndarray:
+        # Round toward -inf, so that x <= threshold is unchanged for every x of that dtype
+        threshold_dt = np.asarray(threshold).astype(dtype)
+        rounded_up = threshold_dt > threshold
+        threshold_dt[rounded_up] = np.nextafter(threshold_dt[rounded_up], np.dtype(dtype).type(-np.inf))
+        return threshold_dt
+
+    @property
+    def n_estimators(self) -> int:
+        return len(self.arrays['roots'])
+
+    def save(self, path: str | os.PathLike) -> Path:
+        """Write the compact forest to a single file: a JSON header followed by each array's raw bytes
+
+        :param path: The save path, see :func:`fs_algo.fs_algo_train_eval.std_compact_forest_path()`
+        :type path: str | os.PathLike
+        :return: The save path
+        :rtype: Path
+        """
+        meta = {'n_features_in': int(self.n_features_in_), 'n_outputs': int(self.n_outputs_),
+                'feature_names_in': [str(x) for x in self.feature_names_in_] if hasattr(self, 'feature_names_in_') else None,
+                'arrays': dict()}
+        offset = 0
+        for name, arr in self.arrays.items():
+            meta['arrays'][name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+            offset += -(-arr.nbytes//self._ALIGN)*self._ALIGN
+        header = json.dumps(meta).encode()
+        len_prefix = len(self._MAGIC) + 8
+        pad_header = -(len_prefix + len(header)) % self._ALIGN
+        path = Path(path)
+        path_tmp = path.with_name(path.name + '.tmp')
+        with open(path_tmp, 'wb') as f:
+            f.write(self._MAGIC)
+            f.write(np.uint64(len(header) + pad_header).tobytes())
+            f.write(header + b' '*pad_header)
+            for name, arr in self.arrays.items():
+                f.write(np.ascontiguousarray(arr).tobytes())
+                f.write(b'\0'*(-arr.nbytes % self._ALIGN))
+        os.replace(path_tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str | os.PathLike, mmap_mode: str | None = 'r') -> 'CompactForest':
+        """Read a compact forest written by :meth:`save()`
+
+        :param path: The save path
+        :type path: str | os.PathLike
+        :param mmap_mode: The memory-map mode of the arrays, defaults to 'r'. None reads the arrays into memory
+        :type mmap_mode: str | None, optional
+        :return: The compact forest
+        :rtype: CompactForest
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(cls._MAGIC)) != cls._MAGIC:
+                raise ValueError(f"Not a compact forest file: {path}")
+            len_header = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            meta = json.loads(f.read(len_header))
+        start = len(cls._MAGIC) + 8 + len_header
+        arrays = dict()
+        for name, info in meta['arrays'].items():
+            dtype, shape = np.dtype(info['dtype']), tuple(info['shape'])
+            if mmap_mode:
+                arrays[name] = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=start + info['offset'], shape=shape)
+            else:
+                arrays[name] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)),
+                                           offset=start + info['offset']).reshape(shape)
+        return cls(arrays, n_features_in=meta['n_features_in'], n_outputs=meta['n_outputs'],
+                   feature_names_in=meta['feature_names_in'])
+
+    def _validate_X(self, X: 'pd.DataFrame | np.ndarray') -> np.ndarray:
+        if hasattr(X, 'columns') and hasattr(self, 'feature_names_in_'): # e.g. a pd.DataFrame
+            X = X[list(self.feature_names_in_)]
+        X = np.asarray(X, dtype=np.float32) # as in sklearn's trees
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X must have shape (n_rows, {self.n_features_in_})")
+        return X
+
+    def _node_table(self) -> np.ndarray:
+        # The node fields read at each traversal step, packed into a 16 byte record per node: 
+        # feature, threshold as float32 bits, left child, right child
+        if self._table is None:
+            a = self.arrays
+            table = np.empty((len(a['feature']), 4), dtype=np.int32)
+            table[:, 0] = a['feature']
+            table[:, 1] = self._round_down(a['threshold'], np.float32).view(np.int32)
+            table[:, 2] = a['children_left']
+            table[:, 3] = a['children_right']
+            self._table = table
+        return self._table
+
+    def _apply_block(self, X: np.ndarray) -> np.ndarray:
+        # Traverse all trees at once for a block of rows. Returns the leaf of each (tree, row), tree-major
+        table = self._node_table()
+        n_rows, n_feat = X.shape
+        n = self.n_estimators*n_rows
+        X_flat = X.ravel()
+        has_nan = np.isnan(X_flat).any()
+        node = np.repeat(np.asarray(self.arrays['roots'], dtype=np.intp), n_rows)
+        idx_row = np.tile(np.arange(n_rows, dtype=np.intp)*n_feat, self.n_estimators)
+        pos = np.arange(n)
+        leaves = np.empty(n, dtype=np.intp)
+        # Buffers reused at each depth
+        buf_rec = np.empty((n, 4), dtype=np.int32)
+        buf_idx = np.empty(n, dtype=np.intp)
+        buf_x = np.empty(n, dtype=np.float32)
+        buf_right = np.empty(n, dtype=bool)
+        buf_next = np.empty(n, dtype=np.intp)
+        depth = 0
+        while node.size:
+            m = node.size
+            rec, idx_x, x, go_right, node_next = buf_rec[:m], buf_idx[:m], buf_x[:m], buf_right[:m], buf_next[:m]
+            np.take(table, node, axis=0, out=rec)
+            np.add(rec[:, 0], idx_row, out=idx_x)
+            np.take(X_flat, idx_x, out=x)
+            np.greater(x, rec[:, 1].view(np.float32), out=go_right) # exact, as thresholds are rounded down
+            if has_nan: # missing values follow each split's learned direction
+                go_right |= np.isnan(x) & (self.arrays['missing_go_to_left'][node] == 0)
+            np.copyto(node_next, rec[:, 2])
+            np.copyto(node_next, rec[:, 3], where=go_right)
+            depth += 1
+            if depth % self._COMPACT_EVERY == 0: # set aside the rows that reached a leaf, which points to itself
+                done = node_next == node
+                if done.any():
+                    leaves[pos[done]] = node_next[done]
+                    keep = ~done
+                    node, idx_row, pos = node_next[keep], idx_row[keep], pos[keep]
+                    continue
+            node = node_next.copy()
+        return leaves
+
+    def _map_blocks(self, X: np.ndarray, func: Callable[[int, np.ndarray], None]):
+        # Apply func(row_start, leaves) to each block of rows, in threads when n_jobs allows
+        starts = range(0, X.shape[0], self.block_rows)
+        run = lambda i: func(i, self._apply_block(X[i:i+self.block_rows]))
+        n_jobs = os.cpu_count() if self.n_jobs == -1 else (self.n_jobs or 1)
+        if n_jobs > 1 and len(starts) > 1:
+            with ThreadPoolExecutor(max_workers=min(n_jobs, len(starts))) as executor:
+                list(executor.map(run, starts))
+        else:
+            for i in starts:
+                run(i)
+
+    def predict_trees(self, X: 'pd.DataFrame | np.ndarray') -> np.ndarray:
+        """Predict with each tree
+
+        :param X: The predictor data
+        :type X: pd.DataFrame | np.ndarray
+        :return: The predictions, with shape (n_trees, n_rows, n_outputs)
+        :rtype: np.ndarray
+        """
+        X = self._validate_X(X)
+        value = self.arrays['value']
+        preds = np.empty((self.n_estimators, X.shape[0], self.n_outputs_), dtype=value.dtype)
+        def _fill(i, leaves):
+            preds[:, i:i+self.block_rows] = np.take(value, leaves, axis=0).reshape(self.n_estimators, -1, self.n_outputs_)
+        self._map_blocks(X, _fill)
+        return preds
+
+    def predict(self, X: 'pd.DataFrame | np.ndarray') -> np.ndarray:
+        """Predict with the forest, equivalent to :meth:`RandomForestRegressor.predict()`
+
+        :param X: The predictor data
+        :type X: pd.DataFrame | np.ndarray
+        :return: The predictions, with shape (n_rows,) or (n_rows, n_outputs) for multi-output forests
+        :rtype: np.ndarray
+        """
+        X = self._validate_X(X)
+        value = self.arrays['value']
+        y_pred = np.empty((X.shape[0], self.n_outputs_))
+        def _fill(i, leaves):
+            y_pred[i:i+self.block_rows] = np.take(value, leaves, axis=0).reshape(
+                self.n_estimators, -1, self.n_outputs_).mean(axis=0, dtype=np.float64)
+        self._map_blocks(X, _fill)
+        return y_pred[:, 0] if self.n_outputs_ == 1 else y_pred
+
+# %% COMPACT MLP
+class CompactMLP:
+    _ACTIVATIONS = ('identity', 'logistic', 'tanh', 'relu')
+
+    def __init__(self, coefs: List[np.ndarray], intercepts: List[np.ndarray], activation: str,
+                 feature_names_in: Iterable[str] | None = None):
+        """A standalone forward pass of a trained multi-layer perceptron, requiring only numpy. 
+        Any standardization is folded into the first layer's weights & biases. 
+        Each layer writes into buffers that are preallocated & reused across calls of the same size, 
+        so a CompactMLP should not be shared between threads. Build with :meth:`from_pipeline()`
+
+        :param coefs: The weights of each layer, with shape (n_in, n_out)
+        :type coefs: List[np.ndarray]
+        :param intercepts: The biases of each layer, with shape (n_out,)
+        :type intercepts: List[np.ndarray]
+        :param activation: The hidden layer activation: 'identity', 'logistic', 'tanh', or 'relu'. The output layer is always 'identity'.
+        :type activation: str
+        :param feature_names_in: The feature names seen during training, defaults to None
+        :type feature_names_in: Iterable[str] | None, optional
+        """
+        if activation not in self._ACTIVATIONS:
+            raise ValueError(f"activation must be one of {self._ACTIVATIONS}")
+        self.coefs = coefs
+        self.intercepts = intercepts
+        self.activation = activation
+        self.dtype = coefs[0].dtype
+        self.n_features_in_ = coefs[0].shape[0]
+        self.n_outputs_ = coefs[-1].shape[1]
+        if feature_names_in is not None:
+            self.feature_names_in_ = np.asarray(list(feature_names_in), dtype=object)
+        self._buffers = None
+
+    @classmethod
+    def from_pipeline(cls, pipe: 'Pipeline | GridSearchCV', dtype: str | np.dtype = np.float64) -> 'CompactMLP':
+        """Compile a trained `make_pipeline(StandardScaler(), MLPRegressor())`, a hyperparameter search of it, 
+        or a bare :class:`sklearn.neural_network.MLPRegressor`.
+        Scaling then weighting, ((x - mean)/scale) @ W + b, becomes x @ (W/scale) + (b - (mean/scale) @ W).
+
+        :param pipe: The trained pipeline
+        :type pipe: Pipeline | GridSearchCV
+        :param dtype: The floating point type of the weights & computations, defaults to np.float64
+        :type dtype: str | np.dtype, optional
+        :raises ValueError: When the pipeline contains steps other than a StandardScaler followed by an MLPRegressor
+        :return: The compiled forward pass
+        :rtype: CompactMLP
+        """
+        # Imported here, as only compiling, & not predicting, requires sklearn
+        from sklearn.neural_network import MLPRegressor
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.pipeline import Pipeline
+        if hasattr(pipe, 'best_estimator_'): # A hyperparameter search
+            pipe = pipe.best_estimator_
+        steps = list(pipe.named_steps.values()) if isinstance(pipe, Pipeline) else [pipe]
+        mlp = steps[-1]
+        if not isinstance(mlp, MLPRegressor) or not all(isinstance(x, StandardScaler) for x in steps[:-1]) \
+                or len(steps) > 2:
+            raise ValueError("Expected a StandardScaler followed by an MLPRegressor")
+        coefs = [np.asarray(w, dtype=np.float64) for w in mlp.coefs_]
+        intercepts = [np.asarray(b, dtype=np.float64) for b in mlp.intercepts_]
+        if len(steps) == 2:
+            scaler = steps[0]
+            # mean_ is fit even when with_mean=False, so the flags decide what was applied
+            n_in = coefs[0].shape[0]
+            mean = scaler.mean_ if scaler.with_mean and scaler.mean_ is not None else np.zeros(n_in)
+            scale = scaler.scale_ if scaler.with_std and scaler.scale_ is not None else np.ones(n_in)
+            intercepts[0] = intercepts[0] - (mean/scale) @ coefs[0]
+            coefs[0] = coefs[0]/scale[:, None]
+        return cls([np.ascontiguousarray(w, dtype=dtype) for w in coefs],
+                   [np.asarray(b, dtype=dtype) for b in intercepts],
+                   activation=mlp.activation,
+                   feature_names_in=getattr(pipe, 'feature_names_in_', None))
+
+    def _activate(self, z: np.ndarray):
+        if self.activation == 'relu':
+            np.maximum(z, 0, out=z)
+        elif self.activation == 'tanh':
+            np.tanh(z, out=z)
+        elif self.activation == 'logistic': # 1/(1 + exp(-z))
+            np.negative(z, out=z)
+            np.exp(z, out=z)
+            z += 1
+            np.reciprocal(z, out=z)
+
+    def predict(self, X: 'pd.DataFrame | np.ndarray') -> np.ndarray:
+        """Predict with the forward pass, equivalent to the pipeline's `predict()`
+
+        :param X: The predictor data
+        :type X: pd.DataFrame | np.ndarray
+        :return: The predictions, with shape (n_rows,) or (n_rows, n_outputs) for multi-output networks. 
+            A new array, independent of the reused buffers.
+        :rtype: np.ndarray
+        """
+        if hasattr(X, 'columns') and hasattr(self, 'feature_names_in_'): # e.g. a pd.DataFrame
+            X = X[list(self.feature_names_in_)]
+        X = np.asarray(X)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X must have shape (n_rows, {self.n_features_in_})")
+        n_rows = X.shape[0]
+        if self._buffers is None or self._buffers[0].shape[0] != n_rows:
+            self._buffers = [np.empty((n_rows, self.n_features_in_), dtype=self.dtype)] + \
+                            [np.empty((n_rows, w.shape[1]), dtype=self.dtype) for w in self.coefs]
+        np.copyto(self._buffers[0], X, casting='unsafe')
+        for i, (w, b) in enumerate(zip(self.coefs, self.intercepts)):
+            z = self._buffers[i+1]
+            np.matmul(self._buffers[i], w, out=z)
+            z += b
+            if i < len(self.coefs) - 1:
+                self._activate(z)
+        y_pred = self._buffers[-1].astype(np.float64)
+        return y_pred[:, 0] if self.n_outputs_ == 1 else y_pred
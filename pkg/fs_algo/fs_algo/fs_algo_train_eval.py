@@ -1,25 +1,43 @@
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.neural_network import MLPRegressor
-from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
 from sklearn.preprocessing import StandardScaler, FunctionTransformer
-from sklearn.pipeline import make_pipeline
-from sklearn.model_selection import GridSearchCV
+from sklearn.pipeline import make_pipeline, Pipeline
+from sklearn.model_selection import KFold, GridSearchCV, RandomizedSearchCV, ParameterGrid, ParameterSampler, cross_val_score
+from sklearn.experimental import enable_halving_search_cv # noqa: F401, required for HalvingGridSearchCV
+from sklearn.model_selection import HalvingGridSearchCV
+from sklearn.base import BaseEstimator, clone
 import numpy as np
 import pandas as pd
 import xarray as xr
-import pynhd as nhd
+import dask
 import dask_expr
 import dask.dataframe as dd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
 from collections.abc import Iterable
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Callable
 from pathlib import Path
 import joblib
 import itertools
 import yaml
 import warnings
-import forestci as fci
+from forestci.calibration import calibrateEB, gfit
+import sqlite3
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+import queue
+import threading
+import copy
+import contextlib
+from threadpoolctl import threadpool_limits
+from fs_algo.compact_models import CompactForest, CompactMLP # noqa: F401, re-exported
+import time
+import tempfile
 
 # %% BASIN ATTRIBUTES (PREDICTORS) & RESPONSE VARIABLES (e.g. METRICS)
 class AttrConfigAndVars:
@@ -71,10 +89,28 @@ class AttrConfigAndVars:
                             'datasets': datasets}
 
 
+def _read_attr_parquet(path: str | os.PathLike | List[str], **kwargs) -> dd.DataFrame:
+    """Lazily read attribute parquet files with the repeated `featureID` & `attribute` strings 
+    decoded directly into pandas categoricals, without materializing a string per row
+
+    :param path: The attribute parquet file(s) or directory
+    :type path: str | os.PathLike | List[str]
+    :param kwargs: Passed to :func:`dask.dataframe.read_parquet()`, e.g. `filters` or `columns`
+    :return: The lazily read attribute data
+    :rtype: dd.DataFrame
+    """
+    # dask's pyarrow string conversion cannot be combined with categorical decoding
+    with dask.config.set({'dataframe.convert-string': False}):
+        return dd.read_parquet(path, categories=['featureID', 'attribute'], **kwargs)
+
 def fs_read_attr_comid(dir_db_attrs:str | os.PathLike, comids_resp:list | Iterable, attrs_sel: str | Iterable = 'all',
-                       _s3 = None,storage_options=None)-> pd.DataFrame:
+                       _s3 = None,storage_options=None, columns: Iterable[str] | None = None,
+                       use_manifest: bool | None = None, manifest: pd.DataFrame | None = None)-> pd.DataFrame:
     """Read attribute data acquired using proc.attr.hydfab R package & subset to desired attributes
 
+    The featureID and attribute subsets are exact matches pushed down to the parquet reader
+    as filters, so that only the matching data are decoded.
+
     :param dir_db_attrs: directory where attribute .parquet files live
     :type dir_db_attrs: str | os.PathLike
     :param comids_resp: USGS COMID values of interest 
@@ -85,6 +121,14 @@ def fs_read_attr_comid(dir_db_attrs:str | os.PathLike, comids_resp:list | Iterab
     :type _s3: future feature, optional
     :param storage_options: future feature, defaults to None
     :type storage_options: future feature, optional
+    :param columns: The columns to read from the attribute .parquet files. The `featureID`, `attribute`, and `value` columns are always read. Defaults to None, meaning all columns.
+    :type columns: Iterable[str] | None, optional
+    :param use_manifest: Should the attribute file manifest be used to open only the files containing `comids_resp`? See :func:`fs_attr_manifest()`. 
+        The manifest also resolves featureIDs compacted by :func:`fs_compact_attrs()`. Defaults to None, meaning the manifest is used 
+        when :func:`std_attr_compact_dir()` exists, & otherwise all files in `dir_db_attrs` are opened.
+    :type use_manifest: bool | None, optional
+    :param manifest: The attribute file manifest used when `use_manifest` is True, e.g. refreshed once per run. Defaults to None, meaning :func:`fs_attr_manifest()` refreshes it
+    :type manifest: pd.DataFrame | None, optional
     :return: dict of the following keys:
         - `attrs_sel`
         - `dir_db_attrs`
@@ -98,27 +142,65 @@ def fs_read_attr_comid(dir_db_attrs:str | os.PathLike, comids_resp:list | Iterab
         # TODO  Setup the s3fs filesystem that will be used, with xarray to open the parquet files
         #_s3 = s3fs.S3FileSystem(anon=True)
 
+    comids_resp = [str(x) for x in comids_resp]
+    filters = [('featureID', 'in', comids_resp)]
+    sel_all_attrs = isinstance(attrs_sel, str) and attrs_sel == 'all'
+    if not sel_all_attrs:
+        attrs_sel = [str(x) for x in attrs_sel]
+        filters.append(('attribute', 'in', attrs_sel))
+    if columns is not None:
+        columns = list(dict.fromkeys(['featureID', 'attribute', 'value'] + list(columns)))
+
+    src_attrs = dir_db_attrs
+    src_groups = [(src_attrs, comids_resp)] # The files to read, & the featureIDs to read from them
+    if use_manifest is None: # Compacted featureIDs, whose per-comid files may be removed, are only found via the manifest
+        use_manifest = std_attr_compact_dir(dir_db_attrs).exists()
+    if use_manifest:
+        if manifest is None:
+            manifest = fs_attr_manifest(dir_db_attrs)
+        sub = manifest[manifest['featureID'].isin(comids_resp)]
+        if sub.shape[0] == 0:
+            warnings.warn(f'None of the provided featureIDs exist in {dir_db_attrs}: \
+                          \n {", ".join(comids_resp)} ', UserWarning)
+            return pd.DataFrame({'featureID': pd.Series(dtype='category'), 'attribute': pd.Series(dtype='category'),
+                                 'value': pd.Series(dtype='float64')})
+        # Compacted featureIDs are read from their compacted file in place of their per-comid files. See fs_compact_attrs()
+        is_cmpt = sub['path_compact'].notna() if 'path_compact' in sub.columns else pd.Series(False, index=sub.index)
+        src_groups = [(grp['path_compact' if cmpt else 'path'].unique().tolist(), grp['featureID'].unique().tolist())
+                      for cmpt, grp in sub.groupby(is_cmpt)]
+        src_attrs = [path for paths, _ in src_groups for path in paths]
+
     # Read attribute data acquired using proc.attr.hydfab R package
-    all_attr_ddf = dd.read_parquet(dir_db_attrs, storage_options = storage_options)
+    ls_ddf = list()
+    for paths, ids in src_groups:
+        ddf = _read_attr_parquet(paths, storage_options = storage_options,
+                                 filters = [('featureID', 'in', ids)] + filters[1:], columns = columns)
+        # Subset based on comids of interest. Exact matching is retained in case
+        # the parquet engine only applies filters at the row group level.
+        ls_ddf.append(ddf[ddf['featureID'].isin(ids)])
+    attr_ddf_subloc = ls_ddf[0] if len(ls_ddf) == 1 else dd.concat(ls_ddf)
+    if not sel_all_attrs:
+        attr_ddf_subloc = attr_ddf_subloc[attr_ddf_subloc['attribute'].isin(attrs_sel)]
+
+    # A single graph execution. The empty checks & attribute discovery use the in-memory result.
+    attr_df_sub = attr_ddf_subloc.compute()
+    # Repeated strings are far larger than the values, so featureID & attribute are categorical
+    attr_df_sub = _categorize_attr_df(attr_df_sub)
 
-    # Subset based on comids of interest
-    attr_ddf_subloc = all_attr_ddf[all_attr_ddf['featureID'].str.contains('|'.join(comids_resp))]
+    if attr_df_sub.shape[0] == 0:
+        # Diagnose the empty result. Only reads the featureID column.
+        ddf_ids = dd.read_parquet(src_attrs, storage_options = storage_options,
+                                  filters = filters[0:1], columns = ['featureID'])
+        if ddf_ids[ddf_ids['featureID'].isin(comids_resp)].shape[0].compute() == 0:
+            warnings.warn(f'None of the provided featureIDs exist in {dir_db_attrs}: \
+                          \n {", ".join(comids_resp)} ', UserWarning)
+        else:
+            warnings.warn(f'The provided attributes do not exist with the retrieved featureIDs : \
+                            \n {",".join(attrs_sel)}',UserWarning)
 
-    if attr_ddf_subloc.shape[0].compute() == 0:
-        warnings.warn(f'None of the provided featureIDs exist in {dir_db_attrs}: \
-                      \n {", ".join(attrs_sel)} ', UserWarning)
-    
     # Subset based on attributes of interest
-    if attrs_sel == 'all':
-        attrs_sel = attr_ddf_subloc['attribute'].unique().compute()
-
-    attr_ddf_sub = attr_ddf_subloc[attr_ddf_subloc['attribute'].str.contains('|'.join(attrs_sel))]
-    
-    attr_df_sub = attr_ddf_sub.compute()
-
-    if attr_df_sub.shape[0] == 0:
-        warnings.warn(f'The provided attributes do not exist with the retrieved featureIDs : \
-                        \n {",".join(attrs_sel)}',UserWarning)
+    if sel_all_attrs:
+        attrs_sel = attr_df_sub['attribute'].unique().tolist()
  
     # Run check that all variables are present across all basins
     dict_rslt = _check_attributes_exist(attr_df_sub,attrs_sel)
@@ -136,6 +218,60 @@ def fs_read_attr_comid(dir_db_attrs:str | os.PathLike, comids_resp:list | Iterab
 
     return attr_df_sub
 
+def _categorize_attr_df(df_attr: pd.DataFrame, cols: Iterable[str] = ('featureID', 'attribute')) -> pd.DataFrame:
+    """Convert the repeated string columns of long-format attribute data to pandas categoricals. 
+    Columns already read as categoricals, see :func:`_read_attr_parquet()`, only have their categories tidied.
+
+    :param df_attr: The long-format attribute data, as generated in :func:`fs_read_attr_comid()`
+    :type df_attr: pd.DataFrame
+    :param cols: The columns to convert, defaults to ('featureID', 'attribute')
+    :type cols: Iterable[str], optional
+    :return: The attribute data with categorical columns containing only the observed categories
+    :rtype: pd.DataFrame
+    """
+    for col in cols:
+        if col not in df_attr.columns:
+            continue
+        if isinstance(df_attr[col].dtype, pd.CategoricalDtype):
+            df_attr[col] = df_attr[col].cat.remove_unused_categories()
+        else:
+            # Factorized directly, without an intermediate object array of per-row strings
+            df_attr[col] = df_attr[col].astype('category')
+        cats = df_attr[col].cat.categories
+        if not pd.api.types.is_object_dtype(cats):
+            # Only the (few) categories are converted to python strings
+            df_attr[col] = df_attr[col].cat.rename_categories(cats.astype(str).astype(object))
+        if not df_attr[col].cat.categories.is_monotonic_increasing:
+            # Parquet dictionaries follow file order, so sort for outputs independent of the files read
+            df_attr[col] = df_attr[col].cat.reorder_categories(df_attr[col].cat.categories.sort_values())
+    return df_attr
+
+def fs_attr_pivot(df_attr: pd.DataFrame) -> pd.DataFrame:
+    """Convert long-format attribute data into wide format, equivalent to
+    `df_attr.pivot(index='featureID', columns='attribute', values='value')`, 
+    but built directly from the categorical codes of `featureID` & `attribute`
+
+    :param df_attr: The long-format attribute data, as generated in :func:`fs_read_attr_comid()`
+    :type df_attr: pd.DataFrame
+    :raises ValueError: When a featureID/attribute combination is duplicated
+    :return: The attribute data indexed by `featureID` with one column per attribute
+    :rtype: pd.DataFrame
+    """
+    df_attr = _categorize_attr_df(df_attr[['featureID', 'attribute', 'value']].copy())
+    # Sorted categories match the row/column ordering of pd.DataFrame.pivot
+    for col in ['featureID', 'attribute']:
+        df_attr[col] = df_attr[col].cat.reorder_categories(df_attr[col].cat.categories.sort_values())
+    cat_fid, cat_attr = df_attr['featureID'].cat, df_attr['attribute'].cat
+    codes = cat_fid.codes.to_numpy(dtype=np.int64) * len(cat_attr.categories) + cat_attr.codes.to_numpy(dtype=np.int64)
+    if pd.Series(codes).duplicated().any():
+        raise ValueError("Index contains duplicate featureID/attribute entries, cannot reshape")
+    vals = np.full(len(cat_fid.categories) * len(cat_attr.categories), np.nan)
+    vals[codes] = df_attr['value'].to_numpy(dtype=np.float64)
+    df_wide = pd.DataFrame(vals.reshape(len(cat_fid.categories), len(cat_attr.categories)),
+                           index=pd.Index(cat_fid.categories, name='featureID'),
+                           columns=pd.Index(cat_attr.categories, name='attribute'))
+    return df_wide
+
 def _check_attributes_exist(df_attr: pd.DataFrame, attrs_sel:pd.Series | Iterable) -> Dict[pd.DataFrame, pd.Series]:
     """ Checks if any COMIDs have different numbers of attributes. It's expected that they all have the same attributes.
 
@@ -153,12 +289,13 @@ def _check_attributes_exist(df_attr: pd.DataFrame, attrs_sel:pd.Series | Iterabl
             # Convert to a series for convenience of pd.Series.isin()
             attrs_sel = pd.Series(attrs_sel)
 
-    # Run check that all attributes are present for all basins
-    if df_attr.groupby('featureID')['attribute'].count().nunique() != 1:
+    # Run check that all attributes are present for all basins. Grouping by a categorical uses its codes.
+    cnt_attrs = df_attr.groupby('featureID', observed=True)['attribute'].count()
+    if cnt_attrs.nunique() != 1:
         
         # multiple combos of comid/attrs exist. Find them and warn about it.
-        vec_missing = df_attr.groupby('featureID')['attribute'].count() != len(attrs_sel)
-        bad_comids = vec_missing.index.values[vec_missing]
+        vec_missing = cnt_attrs != len(attrs_sel)
+        bad_comids = vec_missing.index.astype(str).values[vec_missing]
         
         warnings.warn(f"    TOTAL unique locations with missing attributes: {len(bad_comids)}",UserWarning)
         df_attr_sub_missing = df_attr[df_attr['featureID'].isin(bad_comids)]
@@ -178,6 +315,558 @@ def _check_attributes_exist(df_attr: pd.DataFrame, attrs_sel:pd.Series | Iterabl
     
     return {'df_attr': df_attr, 'attrs_sel': attrs_sel}
 
+def std_attr_manifest_path(dir_db_attrs: str | os.PathLike) -> Path:
+    """Standardize the location of the attribute file manifest. 
+    The manifest lives next to (not inside) `dir_db_attrs` so that it is never read as attribute data.
+
+    :param dir_db_attrs: directory where attribute .parquet files live
+    :type dir_db_attrs: str | os.PathLike
+    :return: full path of the manifest parquet file
+    :rtype: Path
+    """
+    dir_db_attrs = Path(dir_db_attrs).absolute()
+    return Path(dir_db_attrs.parent/Path(f'{dir_db_attrs.name}_manifest.parquet'))
+
+def std_attr_compact_dir(dir_db_attrs: str | os.PathLike) -> Path:
+    """Standardize the location of the compacted attribute files, next to (not inside) `dir_db_attrs`, 
+    so that the per-comid files remain the only files inside `dir_db_attrs`
+
+    :param dir_db_attrs: directory where attribute .parquet files live
+    :type dir_db_attrs: str | os.PathLike
+    :return: The directory containing the compacted attribute files
+    :rtype: Path
+    :seealso: :func:`fs_compact_attrs()`
+    """
+    dir_db_attrs = Path(dir_db_attrs).absolute()
+    return Path(dir_db_attrs.parent/Path(f'{dir_db_attrs.name}_compact'))
+
+def _read_attr_compact_index(dir_db_attrs: str | os.PathLike) -> pd.DataFrame:
+    """Read the index of compacted featureIDs, with the `path` & `mtime` of the per-comid file 
+    each was compacted from, and the compacted file, `path_compact`, containing it. See :func:`fs_compact_attrs()`
+    """
+    path_index = Path(std_attr_compact_dir(dir_db_attrs)/Path('sources.parquet'))
+    if path_index.exists():
+        return pd.read_parquet(path_index)
+    return pd.DataFrame({'featureID': pd.Series(dtype=str), 'path': pd.Series(dtype=str),
+                         'n_rows': pd.Series(dtype='int64'), 'attributes': pd.Series(dtype=str),
+                         'mtime': pd.Series(dtype='float64'), 'path_compact': pd.Series(dtype=str)})
+
+def _join_attr_compact(manifest: pd.DataFrame, dir_db_attrs: str | os.PathLike) -> pd.DataFrame:
+    """Record the compacted file, `path_compact`, of each featureID whose per-comid files are unchanged since 
+    compaction. FeatureIDs whose per-comid files were removed after compaction are read from `path_compact`.
+    """
+    index = _read_attr_compact_index(dir_db_attrs)
+    if index.shape[0] == 0:
+        return manifest.assign(path_compact=pd.Series(None, index=manifest.index, dtype=object))
+    keys = ['featureID', 'path', 'mtime']
+    manifest = manifest.merge(index[keys + ['path_compact']], on=keys, how='left')
+    # A featureID is read from its compacted file only when all of its source files are unchanged
+    is_cmpt = manifest['path_compact'].notna().groupby(manifest['featureID']).transform('all')
+    manifest.loc[~is_cmpt, 'path_compact'] = None
+    orphans = index[~index['featureID'].isin(manifest['featureID'])].drop_duplicates(['featureID', 'path_compact'])
+    orphans = orphans.assign(path=orphans['path_compact'])
+    return pd.concat([manifest, orphans[manifest.columns]], ignore_index=True)
+
+def _attr_manifest_entries(path_attr: str, mtime: float) -> pd.DataFrame:
+    """Summarize the featureIDs contained inside a single attribute parquet file
+
+    :param path_attr: path of an attribute parquet file
+    :type path_attr: str
+    :param mtime: the file's modification time
+    :type mtime: float
+    :return: one row per featureID in the file. See :func:`fs_attr_manifest()`
+    :rtype: pd.DataFrame
+    """
+    df = pq.read_table(path_attr, columns=['featureID', 'attribute']).to_pandas()
+    grp_attr = df.groupby(df['featureID'].astype(str), observed=True)['attribute']
+    df_entries = pd.DataFrame({'n_rows': grp_attr.size(),
+                               'attributes': grp_attr.agg(lambda x: '|'.join(sorted(x.astype(str))))}
+                               ).reset_index()
+    df_entries['path'] = path_attr
+    df_entries['mtime'] = mtime
+    return df_entries[['featureID', 'path', 'n_rows', 'attributes', 'mtime']]
+
+def fs_attr_manifest(dir_db_attrs: str | os.PathLike, refresh: bool = True,
+                     max_workers: int = 8) -> pd.DataFrame:
+    """Build or incrementally refresh the manifest of attribute parquet files generated by proc.attr.hydfab
+
+    Only files that are new or modified since the manifest was last written are opened.
+    Entries for files that no longer exist are dropped. 
+
+    :param dir_db_attrs: directory where attribute .parquet files live
+    :type dir_db_attrs: str | os.PathLike
+    :param refresh: Should `dir_db_attrs` be listed to update the manifest? If False, an existing manifest is used as-is, defaults to True
+    :type refresh: bool, optional
+    :param max_workers: The total threads reading new files, defaults to 8
+    :type max_workers: int, optional
+    :return: The manifest with one row per featureID per file and the following columns:
+        - `featureID`: the COMID
+        - `path`: the attribute parquet file containing the COMID
+        - `n_rows`: the total rows for this COMID inside the file
+        - `attributes`: the COMID's attribute names, sorted and '|' separated
+        - `mtime`: the file modification time when the entry was generated
+        - `path_compact`: the compacted file containing the COMID, while `path` is unchanged since compaction. See :func:`fs_compact_attrs()`
+    :rtype: pd.DataFrame
+    :seealso: :func:`std_attr_manifest_path()`
+    """
+    path_manifest = std_attr_manifest_path(dir_db_attrs)
+    if path_manifest.exists():
+        manifest = pd.read_parquet(path_manifest)
+    else:
+        manifest = pd.DataFrame({'featureID': pd.Series(dtype=str), 'path': pd.Series(dtype=str),
+                                 'n_rows': pd.Series(dtype='int64'), 'attributes': pd.Series(dtype=str),
+                                 'mtime': pd.Series(dtype='float64')})
+        refresh = True
+    if not refresh:
+        return _join_attr_compact(manifest, dir_db_attrs)
+
+    dict_mtime = {str(p.absolute()): p.stat().st_mtime for p in Path(dir_db_attrs).rglob('*.parquet')}
+    keep = manifest['path'].map(dict_mtime) == manifest['mtime']
+    paths_new = [p for p in dict_mtime.keys() if p not in set(manifest.loc[keep, 'path'])]
+
+    if len(paths_new) > 0 or not keep.all():
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            ls_new = list(executor.map(lambda p: _attr_manifest_entries(p, dict_mtime[p]), paths_new))
+        manifest = pd.concat([manifest[keep]] + ls_new, ignore_index=True)
+        manifest['attributes'] = manifest['attributes'].astype('category')
+        manifest.to_parquet(path_manifest)
+    return _join_attr_compact(manifest, dir_db_attrs)
+
+def fs_compact_attrs(dir_db_attrs: str | os.PathLike, max_rows_file: int = 5000000,
+                     row_group_size: int = 100000, remove_src: bool = False) -> dict:
+    """Compact the per-comid attribute parquet files generated by proc.attr.hydfab into a few large files
+
+    The compacted files, named `attrs_compact_{i}.parquet`, are written inside :func:`std_attr_compact_dir()`, 
+    along with `sources.parquet`, which records the per-comid file & its modification time that each 
+    featureID was compacted from. :func:`fs_attr_manifest()` records the compacted file of each featureID 
+    whose per-comid files are unchanged, so that :func:`fs_read_attr_comid()` reads it in their place. Each compacted file is sorted by `featureID` so that row group statistics allow featureID 
+    filters to skip row groups, and the string columns are dictionary-encoded. Re-running only folds in 
+    featureIDs whose per-comid files were added or modified since the prior compaction, replacing their 
+    previously compacted data. 
+    The per-comid files are kept by default, as proc.attr.hydfab checks for `comid_{comid}_attrs.parquet` files 
+    and re-acquires attributes for any comid whose file does not exist.
+
+    :param dir_db_attrs: directory where attribute .parquet files live
+    :type dir_db_attrs: str | os.PathLike
+    :param max_rows_file: The approximate maximum rows in a compacted file. A featureID is never split across files. Defaults to 5000000
+    :type max_rows_file: int, optional
+    :param row_group_size: The total rows in each parquet row group, defaults to 100000
+    :type row_group_size: int, optional
+    :param remove_src: Should the compacted per-comid files be deleted? The compacted data are then only read 
+        through the manifest, which :func:`fs_read_attr_comid()` uses by default once compacted files exist, 
+        & proc.attr.hydfab re-acquires the deleted comids. Defaults to False
+    :type remove_src: bool, optional
+    :return: dict with the following keys:
+        - `paths_src`: the per-comid files that were compacted, & deleted if `remove_src`
+        - `paths_compact`: the compacted files written during this run
+    :rtype: dict
+    :seealso: :func:`fs_attr_manifest()`
+    """
+    dir_cmpt = std_attr_compact_dir(dir_db_attrs)
+    manifest = fs_attr_manifest(dir_db_attrs)
+    index_old = _read_attr_compact_index(dir_db_attrs)
+
+    # The featureIDs with any per-comid file that is new or modified since compaction
+    keys = ['featureID', 'path', 'mtime']
+    cmbo = manifest[keys].merge(index_old[keys], on=keys, how='left', indicator=True)
+    ids_new = cmbo.loc[cmbo['_merge'] == 'left_only', 'featureID'].unique()
+    if len(ids_new) == 0:
+        return {'paths_src': [], 'paths_compact': []}
+    src_new = manifest.loc[manifest['featureID'].isin(ids_new), ['featureID', 'path', 'n_rows', 'attributes', 'mtime']]
+    paths_src = [Path(p) for p in src_new['path'].unique()]
+
+    df_new = dd.read_parquet([str(p) for p in paths_src]).compute()
+    df_new['featureID'] = df_new['featureID'].astype(str)
+    df_new['attribute'] = df_new['attribute'].astype(str)
+    df_new = df_new[df_new['featureID'].isin(ids_new)]
+    df_new = df_new.sort_values(['featureID', 'attribute'], kind='stable').reset_index(drop=True)
+    cols_dict = [c for c in ['featureID', 'attribute', 'featureSource', 'data_source'] if c in df_new.columns]
+
+    def _write_compact(df: pd.DataFrame, path: Path):
+        path_tmp = Path(path.parent/Path(f'{path.name}.tmp'))
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path_tmp,
+                       row_group_size=row_group_size, use_dictionary=cols_dict)
+        os.replace(path_tmp, path)
+
+    # Remove superseded featureIDs from previously compacted files
+    dir_cmpt.mkdir(exist_ok=True, parents=True)
+    paths_stale = index_old.loc[index_old['featureID'].isin(ids_new), 'path_compact'].unique()
+    for path_stale in paths_stale:
+        df_stale = pd.read_parquet(path_stale)
+        df_stale = df_stale[~df_stale['featureID'].astype(str).isin(ids_new)]
+        if df_stale.shape[0] > 0:
+            _write_compact(df_stale, Path(path_stale))
+        else:
+            Path(path_stale).unlink()
+
+    # Split into files at featureID boundaries
+    is_first = ~df_new['featureID'].duplicated()
+    idx_file = (np.arange(df_new.shape[0]) // max_rows_file)[is_first.values]
+    idx_file = pd.Series(idx_file, index=df_new.index[is_first]).reindex(df_new.index).ffill().astype(int)
+    paths_cmpt = dir_cmpt.glob('attrs_compact_*.parquet')
+    i_start = max([int(p.stem.split('_')[-1]) for p in paths_cmpt], default=-1) + 1
+
+    paths_new = []
+    dict_id_cmpt = dict()
+    for i, (_, df_file) in enumerate(df_new.groupby(idx_file.values, sort=True)):
+        path_cmpt = Path(dir_cmpt/Path(f'attrs_compact_{i_start + i:05d}.parquet'))
+        _write_compact(df_file, path_cmpt)
+        paths_new.append(path_cmpt)
+        dict_id_cmpt.update(dict.fromkeys(df_file['featureID'].unique(), str(path_cmpt)))
+
+    # Record the sources, written last so that the index never references missing data
+    index = pd.concat([index_old[~index_old['featureID'].isin(ids_new)],
+                       src_new.assign(path_compact=src_new['featureID'].map(dict_id_cmpt))], ignore_index=True)
+    index = index[index['path_compact'].notna()] # featureIDs without any rows
+    path_index = Path(dir_cmpt/Path('sources.parquet'))
+    path_tmp = Path(dir_cmpt/Path('sources.parquet.tmp'))
+    index.to_parquet(path_tmp)
+    os.replace(path_tmp, path_index)
+
+    if remove_src:
+        for path_src in paths_src:
+            path_src.unlink()
+        fs_attr_manifest(dir_db_attrs) # Drop the removed files from the manifest
+    return {'paths_src': paths_src, 'paths_compact': paths_new}
+
+def std_attr_matrix_dir(dir_db_attrs: str | os.PathLike) -> Path:
+    """Standardize the location of the consolidated wide-format attribute matrix store, next to `dir_db_attrs`
+
+    :param dir_db_attrs: directory where attribute .parquet files live
+    :type dir_db_attrs: str | os.PathLike
+    :return: The directory containing the attribute matrix store
+    :rtype: Path
+    :seealso: :class:`AttrMatrixStore`
+    """
+    dir_db_attrs = Path(dir_db_attrs).absolute()
+    return Path(dir_db_attrs.parent/Path(f'{dir_db_attrs.name}_matrix'))
+
+class AttrMatrixStore:
+    def __init__(self, dir_db_attrs: str | os.PathLike, chunk_rows: int = 50000):
+        """A consolidated, memory-mappable COMID x attribute matrix built from the per-comid attribute parquet files
+
+        The store contains the following inside :func:`std_attr_matrix_dir()`:
+            - `values.npy`: dense float64 matrix, NaN where an attribute is missing for a COMID
+            - `rows.parquet`: the row index (`featureID`) along with the `sources` of each row, 
+              i.e. the `path` & `mtime` of every attribute file containing the featureID
+            - `cols.parquet`: the column index (`attribute`)
+
+        :param dir_db_attrs: directory where attribute .parquet files live
+        :type dir_db_attrs: str | os.PathLike
+        :param chunk_rows: The total rows copied at once when rewriting the matrix, defaults to 50000
+        :type chunk_rows: int, optional
+        """
+        self.dir_db_attrs = dir_db_attrs
+        self.dir_store = std_attr_matrix_dir(dir_db_attrs)
+        self.chunk_rows = chunk_rows
+
+        self.path_values = Path(self.dir_store/Path('values.npy'))
+        self.path_rows = Path(self.dir_store/Path('rows.parquet'))
+        self.path_cols = Path(self.dir_store/Path('cols.parquet'))
+
+        # Populated by load()
+        self.values = None
+        self.rows = pd.DataFrame()
+        self.featureIDs = pd.Index([], name='featureID')
+        self.attributes = pd.Index([], name='attribute')
+
+    def exists(self) -> bool:
+        return self.path_values.exists() and self.path_rows.exists() and self.path_cols.exists()
+
+    def load(self):
+        """Memory-map the matrix & read its row/column indices
+        """
+        if not self.exists():
+            raise FileNotFoundError(f"No attribute matrix store exists inside {self.dir_store}. Run AttrMatrixStore.build() first.")
+        self.values = np.load(self.path_values, mmap_mode='r')
+        self.rows = pd.read_parquet(self.path_rows)
+        self.featureIDs = pd.Index(self.rows['featureID'], name='featureID')
+        self.attributes = pd.Index(pd.read_parquet(self.path_cols)['attribute'], name='attribute')
+
+    def build(self) -> dict:
+        """Build the matrix store, or incrementally update it with new/modified attribute parquet files
+
+        :return: Summary of the update with keys `n_new` (rows read from parquet), `n_kept`, and `n_removed`
+        :rtype: dict
+        """
+        manifest = fs_attr_manifest(self.dir_db_attrs)
+        # A featureID's attributes may be spread across files, so each row is the union of all its files
+        manifest = manifest.sort_values(['mtime', 'path'])
+        src = manifest.assign(sources=manifest['path'] + '@' + manifest['mtime'].map(repr)
+                              ).groupby('featureID', sort=False)['sources'].agg(lambda x: '|'.join(sorted(x))).reset_index()
+
+        if self.exists():
+            self.load()
+            rows_old, attrs_old = self.rows, self.attributes
+        else:
+            rows_old = pd.DataFrame({'featureID': pd.Series(dtype=str), 'sources': pd.Series(dtype=str)})
+            attrs_old = pd.Index([], name='attribute')
+        if 'sources' not in rows_old.columns: # A store built before tracking every file, which is rebuilt
+            rows_old = rows_old.assign(sources=pd.Series(pd.NA, index=rows_old.index, dtype=object))
+        cmbo = src.merge(rows_old[['featureID', 'sources']], on='featureID', how='left', suffixes=('', '_old'))
+        is_kept = cmbo['sources'] == cmbo['sources_old']
+        rows_kept = cmbo.loc[is_kept, ['featureID', 'sources']]
+        rows_new = cmbo.loc[~is_kept, ['featureID', 'sources']]
+        n_removed = rows_old.shape[0] - rows_kept.shape[0]
+        summ = {'n_new': rows_new.shape[0], 'n_kept': rows_kept.shape[0], 'n_removed': n_removed}
+        if rows_new.shape[0] == 0 and n_removed == 0:
+            return summ
+
+        # Read only the new/modified data & convert to wide format
+        if rows_new.shape[0] > 0:
+            # Ordered oldest first, so that an attribute repeated across files keeps its newest value
+            paths_new = manifest.loc[manifest['featureID'].isin(rows_new['featureID']), 'path'].unique().tolist()
+            df_new = _read_attr_parquet(paths_new, columns=['featureID', 'attribute', 'value'],
+                                        filters=[('featureID', 'in', rows_new['featureID'].tolist())]).compute()
+            df_new = _categorize_attr_df(df_new)
+            df_new = df_new[df_new['featureID'].isin(rows_new['featureID'])]
+            wide_new = fs_attr_pivot(df_new.drop_duplicates(['featureID', 'attribute'], keep='last'))
+        else:
+            wide_new = pd.DataFrame()
+        attrs_all = attrs_old.append(pd.Index(sorted(set(wide_new.columns) - set(attrs_old)))).rename('attribute')
+
+        # Write the new matrix to a temporary file, then swap it in
+        self.dir_store.mkdir(exist_ok=True, parents=True)
+        path_tmp = Path(self.dir_store/Path('values_tmp.npy'))
+        n_rows = rows_kept.shape[0] + rows_new.shape[0]
+        vals = np.lib.format.open_memmap(path_tmp, mode='w+', dtype=np.float64, shape=(n_rows, len(attrs_all)))
+        vals[:] = np.nan
+        if rows_kept.shape[0] > 0:
+            idx_old = self.featureIDs.get_indexer(rows_kept['featureID'])
+            for i in range(0, len(idx_old), self.chunk_rows):
+                vals[i:i+self.chunk_rows, 0:len(attrs_old)] = self.values[idx_old[i:i+self.chunk_rows], :]
+        if rows_new.shape[0] > 0:
+            vals[rows_kept.shape[0]:, :] = wide_new.reindex(index=rows_new['featureID'].values,
+                                                            columns=attrs_all).to_numpy(dtype=np.float64)
+        vals.flush()
+        del vals
+        self.values = None # release the memory map of the prior matrix
+        os.replace(path_tmp, self.path_values)
+        pd.concat([rows_kept, rows_new], ignore_index=True).to_parquet(self.path_rows)
+        pd.DataFrame({'attribute': attrs_all}).to_parquet(self.path_cols)
+        self.load()
+        return summ
+
+    def select(self, comids: Iterable, attrs_sel: str | Iterable = 'all') -> pd.DataFrame:
+        """Select COMIDs & attributes from the memory-mapped matrix in wide format. 
+        Equivalent to pivoting the output of :func:`fs_read_attr_comid()`.
+
+        :param comids: USGS COMID values of interest
+        :type comids: Iterable
+        :param attrs_sel: desired attributes, defaults to 'all'
+        :type attrs_sel: str | Iterable, optional
+        :return: The attribute data indexed by `featureID` with one column per attribute
+        :rtype: pd.DataFrame
+        """
+        if self.values is None:
+            self.load()
+        comids = pd.Index(dict.fromkeys(str(x) for x in comids), name='featureID')
+        idx_rows = self.featureIDs.get_indexer(comids)
+        if (idx_rows < 0).any():
+            warnings.warn(f"{(idx_rows < 0).sum()} featureIDs not in the attribute matrix store: \
+                          \n {', '.join(comids[idx_rows < 0])}", UserWarning)
+        if isinstance(attrs_sel, str) and attrs_sel == 'all':
+            attrs = self.attributes
+        else:
+            attrs = pd.Index([str(x) for x in attrs_sel], name='attribute')
+        idx_cols = self.attributes.get_indexer(attrs)
+        if (idx_cols < 0).any():
+            warnings.warn(f"Attributes not in the attribute matrix store: \
+                          \n {', '.join(attrs[idx_cols < 0])}", UserWarning)
+        idx_rows, idx_cols = idx_rows[idx_rows >= 0], idx_cols[idx_cols >= 0]
+        df_wide = pd.DataFrame(self.values[np.ix_(idx_rows, idx_cols)],
+                               index=self.featureIDs[idx_rows], columns=self.attributes[idx_cols])
+        if df_wide.isna().any().any():
+            warnings.warn('The attribute matrix contains NA values, meaning some featureIDs are missing attributes. \
+                          \nConsider reprocessing the attribute grabber (proc.attr.hydfab R package)', UserWarning)
+        return df_wide
+
+def std_design_cache_dir(dir_base: str | os.PathLike) -> Path:
+    """Standardize the location of the on-disk design matrix cache
+
+    :param dir_base: The base directory for file output, as defined in the attribute config file
+    :type dir_base: str | os.PathLike
+    :return: The cache directory, which lives inside the `cache` directory of `dir_base`
+    :rtype: Path
+    :seealso: :class:`DesignMatrixCache`
+    """
+    dir_cache = Path(Path(dir_base).absolute()/Path('cache')/Path('design_matrix'))
+    dir_cache.mkdir(exist_ok=True, parents=True)
+    return dir_cache
+
+class DesignMatrixCache:
+    def __init__(self, dir_cache: str | os.PathLike, max_bytes: int | None = None):
+        """A content-addressed on-disk cache of wide-format attribute data (the design matrix). 
+        Each entry is an uncompressed .npz file named after its key.
+
+        :param dir_cache: The cache directory. Created if it does not exist. See :func:`std_design_cache_dir()`
+        :type dir_cache: str | os.PathLike
+        :param max_bytes: Least recently used entries are evicted once the cache exceeds this size, defaults to None, meaning no eviction
+        :type max_bytes: int | None, optional
+        """
+        self.dir_cache = Path(dir_cache)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.dir_cache.mkdir(exist_ok=True, parents=True)
+
+    @staticmethod
+    def key(comids: Iterable, attrs_sel: str | Iterable, fingerprint: Iterable[str]) -> str:
+        """Generate the cache key from the sorted COMIDs, the selected attributes, and the source file fingerprint
+
+        :param comids: USGS COMID values of interest
+        :type comids: Iterable
+        :param attrs_sel: desired attributes, or 'all'
+        :type attrs_sel: str | Iterable
+        :param fingerprint: Identifiers of the source data, e.g. from :func:`_attr_fingerprint()`
+        :type fingerprint: Iterable[str]
+        :return: sha256 hexdigest
+        :rtype: str
+        """
+        if not isinstance(attrs_sel, str):
+            attrs_sel = sorted(str(x) for x in attrs_sel)
+        h = hashlib.sha256()
+        for part in [sorted(set(str(x) for x in comids)), attrs_sel, sorted(fingerprint)]:
+            h.update(json.dumps(part).encode())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return Path(self.dir_cache/Path(f'{key}.npz'))
+
+    def get(self, key: str) -> pd.DataFrame | None:
+        """Retrieve a cached design matrix, counting towards `hits` or `misses`
+
+        :param key: The cache key. See :meth:`key()`
+        :type key: str
+        :return: The wide-format attribute data, or None when not cached
+        :rtype: pd.DataFrame | None
+        """
+        path = self._path(key)
+        if not path.exists():
+            self.misses += 1
+            return None
+        with np.load(path, allow_pickle=False) as npz:
+            df_wide = pd.DataFrame(npz['values'],
+                                   index=pd.Index(npz['index'].astype(object), name=str(npz['index_name'])),
+                                   columns=pd.Index(npz['columns'].astype(object), name=str(npz['columns_name'])))
+        os.utime(path) # mark as recently used
+        self.hits += 1
+        return df_wide
+
+    def put(self, key: str, df_wide: pd.DataFrame):
+        """Write a design matrix to the cache & evict old entries if needed
+
+        :param key: The cache key. See :meth:`key()`
+        :type key: str
+        :param df_wide: The wide-format attribute data
+        :type df_wide: pd.DataFrame
+        """
+        path = self._path(key)
+        path_tmp = Path(self.dir_cache/Path(f'{key}.tmp.npz'))
+        np.savez(path_tmp, values=df_wide.to_numpy(dtype=np.float64),
+                 index=df_wide.index.astype(str).to_numpy(dtype=str),
+                 columns=df_wide.columns.astype(str).to_numpy(dtype=str),
+                 index_name=str(df_wide.index.name), columns_name=str(df_wide.columns.name))
+        os.replace(path_tmp, path)
+        self.evict()
+
+    def _entries(self) -> List[tuple]:
+        return [(p, p.stat()) for p in self.dir_cache.glob('*.npz') if not p.name.endswith('.tmp.npz')]
+
+    def evict(self) -> int:
+        """Delete the least recently used entries until the cache is within `max_bytes`
+
+        :return: The number of deleted entries
+        :rtype: int
+        """
+        if self.max_bytes is None:
+            return 0
+        entries = sorted(self._entries(), key=lambda x: x[1].st_mtime)
+        size = sum(st.st_size for _, st in entries)
+        n_del = 0
+        for path, st in entries:
+            if size <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            size -= st.st_size
+            n_del += 1
+        return n_del
+
+    def stats(self) -> dict:
+        """Summarize cache usage
+
+        :return: dict with the keys `hits`, `misses`, `hit_rate`, `size` (total cached entries), and `bytes`
+        :rtype: dict
+        """
+        entries = self._entries()
+        n_req = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits/n_req if n_req > 0 else np.nan,
+                'size': len(entries), 'bytes': sum(st.st_size for _, st in entries)}
+
+def _attr_fingerprint(dir_db_attrs: str | os.PathLike, comids: Iterable,
+                      manifest: pd.DataFrame | None = None) -> List[str]:
+    """Identify the attribute parquet files, & their modification times, containing the COMIDs of interest
+
+    :param dir_db_attrs: directory where attribute .parquet files live
+    :type dir_db_attrs: str | os.PathLike
+    :param comids: USGS COMID values of interest
+    :type comids: Iterable
+    :param manifest: The attribute file manifest, defaults to None, meaning :func:`fs_attr_manifest()` refreshes it
+    :type manifest: pd.DataFrame | None, optional
+    :return: sorted `'{path}|{mtime}'` strings
+    :rtype: List[str]
+    """
+    if manifest is None:
+        manifest = fs_attr_manifest(dir_db_attrs)
+    sub = manifest.loc[manifest['featureID'].isin([str(x) for x in comids]), ['path', 'mtime']].drop_duplicates()
+    return sorted(f'{p}|{m}' for p, m in zip(sub['path'], sub['mtime']))
+
+def fs_attr_wide(dir_db_attrs: str | os.PathLike, comids: Iterable, attrs_sel: str | Iterable = 'all',
+                 cache: DesignMatrixCache | None = None,
+                 attr_mat: AttrMatrixStore | None = None,
+                 manifest: pd.DataFrame | None = None) -> pd.DataFrame:
+    """Retrieve wide-format attribute data (the design matrix) for the COMIDs of interest, 
+    using the design matrix cache when the COMIDs, attributes, and source files are unchanged
+
+    :param dir_db_attrs: directory where attribute .parquet files live
+    :type dir_db_attrs: str | os.PathLike
+    :param comids: USGS COMID values of interest
+    :type comids: Iterable
+    :param attrs_sel: desired attributes, defaults to 'all'
+    :type attrs_sel: str | Iterable, optional
+    :param cache: The design matrix cache, defaults to None, meaning no caching
+    :type cache: DesignMatrixCache | None, optional
+    :param attr_mat: The attribute matrix store, used in place of reading the parquet files on a cache miss, defaults to None
+    :type attr_mat: AttrMatrixStore | None, optional
+    :param manifest: The attribute file manifest. Pass the manifest refreshed once per run when calling repeatedly, 
+        e.g. per chunk of COMIDs, as refreshing lists every file in `dir_db_attrs`. 
+        Defaults to None, meaning :func:`fs_attr_manifest()` refreshes it once for this call
+    :type manifest: pd.DataFrame | None, optional
+    :return: The attribute data indexed by `featureID` with one column per attribute
+    :rtype: pd.DataFrame
+    """
+    comids = [str(x) for x in comids if x is not None]
+    if manifest is None and (cache is not None or attr_mat is None):
+        manifest = fs_attr_manifest(dir_db_attrs)
+    if cache is not None:
+        key = cache.key(comids, attrs_sel, _attr_fingerprint(dir_db_attrs, comids, manifest=manifest))
+        df_wide = cache.get(key)
+        if df_wide is not None:
+            return df_wide
+
+    if attr_mat is not None:
+        df_wide = attr_mat.select(comids, attrs_sel)
+    else:
+        df_attr = fs_read_attr_comid(dir_db_attrs, comids, attrs_sel = attrs_sel,
+                                     _s3 = None,storage_options=None,use_manifest=True,
+                                     manifest=manifest)
+        df_wide = fs_attr_pivot(df_attr)
+
+    if cache is not None:
+        cache.put(key, df_wide)
+    return df_wide
+
 def _find_feat_srce_id(dat_resp: Optional[xr.core.dataset.Dataset] = None,
                        attr_config: Optional[Dict] = None) -> List[str]:
     """ Try grabbing :mod:`fs_proc` standardized dataset attributes &/or config file.
@@ -225,7 +914,115 @@ def _find_feat_srce_id(dat_resp: Optional[xr.core.dataset.Dataset] = None,
 
     return [featureSource, featureID]
 
-def fs_retr_nhdp_comids(featureSource:str,featureID:str,gage_ids: Iterable[str] ) ->list:    
+def std_comid_cache_path(dir_base: str | os.PathLike) -> Path:
+    """Standardize the location of the persistent gage_id to COMID lookup cache
+
+    :param dir_base: The base directory for file output, as defined in the attribute config file
+    :type dir_base: str | os.PathLike
+    :return: full path of the sqlite cache file, which lives in a `cache` directory next to `dir_base`
+    :rtype: Path
+    """
+    dir_cache = Path(Path(dir_base).parent.absolute()/Path('cache'))
+    dir_cache.mkdir(exist_ok=True, parents=True)
+    path_cache = Path(dir_cache/Path('nldi_comid_cache.sqlite'))
+    return path_cache
+
+class NldiComidCache:
+    def __init__(self, path_cache: str | os.PathLike, max_age_days: float | None = None):
+        """A persistent on-disk cache of COMIDs resolved via the NLDI, keyed on (featureSource, featureID)
+
+        :param path_cache: The sqlite file path for the cache. Created if it does not exist. See :func:`std_comid_cache_path()`
+        :type path_cache: str | os.PathLike
+        :param max_age_days: Cached entries older than this many days are treated as misses & re-resolved, defaults to None, meaning entries never expire
+        :type max_age_days: float | None, optional
+        """
+        self.path_cache = Path(path_cache)
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+
+        self.path_cache.parent.mkdir(exist_ok=True, parents=True)
+        with sqlite3.connect(self.path_cache) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS comid_cache (\
+                         featureSource TEXT NOT NULL, featureID TEXT NOT NULL,\
+                         comid TEXT NOT NULL, timestamp REAL NOT NULL,\
+                         PRIMARY KEY (featureSource, featureID))")
+        conn.close()
+
+    def _min_timestamp(self) -> float:
+        if self.max_age_days is None:
+            return float('-inf')
+        return time.time() - self.max_age_days*86400
+
+    def get_many(self, featureSource: str, featureIDs: Iterable[str]) -> Dict[str, str]:
+        """Retrieve cached COMIDs. Every requested featureID counts towards either `hits` or `misses`
+
+        :param featureSource: the datasource for featureID, e.g. 'nwissite'
+        :type featureSource: str
+        :param featureIDs: The formatted featureIDs, e.g. `'USGS-01031500'`
+        :type featureIDs: Iterable[str]
+        :return: The unexpired cached COMIDs, keyed by featureID. Misses are absent.
+        :rtype: Dict[str, str]
+        """
+        featureIDs = list(dict.fromkeys(featureIDs))
+        found = dict()
+        with sqlite3.connect(self.path_cache) as conn:
+            # Chunk the query to stay under sqlite's host parameter limit
+            for i in range(0, len(featureIDs), 500):
+                chunk = featureIDs[i:i+500]
+                qry = f"SELECT featureID, comid FROM comid_cache WHERE featureSource = ? \
+                    AND timestamp >= ? AND featureID IN ({','.join('?'*len(chunk))})"
+                found.update(dict(conn.execute(qry, [featureSource, self._min_timestamp()] + chunk).fetchall()))
+        conn.close()
+        self.hits += len(found)
+        self.misses += len(featureIDs) - len(found)
+        return found
+
+    def put_many(self, featureSource: str, dict_fid_comid: Dict[str, str]):
+        """Write resolved COMIDs to the cache. Unresolved (None) COMIDs are not cached.
+
+        :param featureSource: the datasource for featureID, e.g. 'nwissite'
+        :type featureSource: str
+        :param dict_fid_comid: The resolved COMIDs, keyed by formatted featureID
+        :type dict_fid_comid: Dict[str, str]
+        """
+        now = time.time()
+        rows = [(featureSource, str(fid), str(comid), now) for fid, comid in dict_fid_comid.items()
+                if comid is not None and not pd.isna(comid)]
+        with sqlite3.connect(self.path_cache) as conn:
+            conn.executemany("INSERT OR REPLACE INTO comid_cache VALUES (?,?,?,?)", rows)
+        conn.close()
+
+    def purge_expired(self) -> int:
+        """Delete entries older than `max_age_days`
+
+        :return: The number of deleted entries
+        :rtype: int
+        """
+        with sqlite3.connect(self.path_cache) as conn:
+            n_del = conn.execute("DELETE FROM comid_cache WHERE timestamp < ?",
+                                 [self._min_timestamp()]).rowcount
+        conn.close()
+        return n_del
+
+    def stats(self) -> dict:
+        """Summarize cache usage
+
+        :return: dict with the keys `hits`, `misses`, `hit_rate`, and `size` (total cached entries)
+        :rtype: dict
+        """
+        with sqlite3.connect(self.path_cache) as conn:
+            size = conn.execute("SELECT COUNT(*) FROM comid_cache").fetchone()[0]
+        conn.close()
+        n_req = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits/n_req if n_req > 0 else np.nan,
+                'size': size}
+
+def fs_retr_nhdp_comids(featureSource:str,featureID:str,gage_ids: Iterable[str],
+                        path_cache: str | os.PathLike | None = None,
+                        cache_max_age_days: float | None = None,
+                        verbose: bool = False, **kwargs_nldi) ->list:
     """Retrieve response variable's comids, querying the shortest distance in the flowline
 
     :param featureSource: the datasource for featureID from the R function :mod:`nhdplusTools` :func:`get_nldi_features()`, e.g. 'nwissite'
@@ -234,21 +1031,49 @@ def fs_retr_nhdp_comids(featureSource:str,featureID:str,gage_ids: Iterable[str]
     :type featureID: str
     :param gage_ids: The location identifiers compatible with the format specified in `featureID`
     :type gage_ids: Iterable[str]
+    :param path_cache: The persistent COMID cache file, see :class:`NldiComidCache`. Only cache misses are queried via the NLDI, defaults to None, meaning no caching
+    :type path_cache: str | os.PathLike | None, optional
+    :param cache_max_age_days: Cached entries older than this are re-resolved, defaults to None, meaning entries never expire
+    :type cache_max_age_days: float | None, optional
+    :param verbose: Should print the COMID cache stats, defaults to False
+    :type verbose: bool, optional
+    :param kwargs_nldi: Optional arguments passed to :func:`fs_proc.proc_eval_metrics.retr_nldi_comids_batch()`, e.g. `max_workers` or `max_rps`
     :raises warnings.warn: In case number of retrieved comids does not match total requested gage ids
-    :return: The COMIDs corresponding to the provided location identifiers, `gage_ids`
+    :return: The COMIDs corresponding to the provided location identifiers, `gage_ids`. None where a COMID could not be retrieved.
     :rtype: list
     """
+    fids = [featureID.format(gage_id=gage_id) for gage_id in gage_ids]
+
+    dict_fid_comid = dict()
+    if path_cache:
+        comid_cache = NldiComidCache(path_cache, max_age_days=cache_max_age_days)
+        dict_fid_comid = comid_cache.get_many(featureSource, fids)
+    fids_miss = [fid for fid in dict.fromkeys(fids) if fid not in dict_fid_comid]
 
-    nldi = nhd.NLDI()
-    comids_resp = [nldi.navigate_byid(fsource=featureSource,fid= featureID.format(gage_id=gage_id),
-                                navigation='upstreamMain',
-                                source='flowlines',
-                                distance=1 # the shortest distance
-                                ).loc[0]['nhdplus_comid'] 
-                                for gage_id in gage_ids]
+    if fids_miss:
+        # Imported here, as only cache misses need fs_proc & its dependencies
+        try:
+            from fs_proc.proc_eval_metrics import retr_nldi_comids_batch
+        except ImportError as e:
+            raise ImportError(f"Resolving {len(fids_miss)} COMIDs missing from the COMID cache requires the fs_proc \
+                              package. Install it from pkg/fs_proc") from e
+        df_nldi = retr_nldi_comids_batch(fids_miss, featureSource=featureSource, **kwargs_nldi)
+        dict_new = dict(zip(df_nldi['featureID'], df_nldi['comid']))
+        dict_fid_comid.update(dict_new)
+        if path_cache:
+            comid_cache.put_many(featureSource, dict_new)
+
+        df_err = df_nldi[df_nldi['comid'].isna()]
+        if df_err.shape[0] > 0:
+            str_err = '\n    '.join(df_err['featureID'] + ': ' + df_err['error'])
+            warnings.warn(f"Could not retrieve the COMID for {df_err.shape[0]} locations:\n    {str_err}", UserWarning)
+    if path_cache and verbose:
+        print(f"    COMID cache stats: {comid_cache.stats()}")
+
+    comids_resp = [dict_fid_comid.get(fid) for fid in fids]
     
     if len(comids_resp) != len(gage_ids) or comids_resp.count(None) > 0: # May not be an important check
-        raise warnings.warn("The total number of retrieved comids does not match \
+        warnings.warn("The total number of retrieved comids does not match \
                       total number of provided gage_ids",UserWarning)
 
     return comids_resp
@@ -341,6 +1166,423 @@ def _open_response_data_fs(dir_std_base: str | os.PathLike, ds:str) -> xr.Datase
 
 # %% ALGORITHM TRAINING AND EVALUATION
 
+class BudgetSearchCV(BaseEstimator):
+    def __init__(self, estimator, param_distributions: dict, max_fits: int | None = None,
+                 max_time: float | None = None, cv: int = 5, scoring: str | None = None,
+                 n_jobs: int | None = None, random_state: int | None = None):
+        """A hyperparameter search that cross-validates randomly ordered candidates until a 
+        budget of model fits and/or wall-clock seconds is spent, then refits the best candidate. 
+        At least one candidate is always evaluated. The fitted attributes follow 
+        :class:`sklearn.model_selection.GridSearchCV`.
+
+        :param estimator: The estimator, or pipeline, to tune
+        :type estimator: sklearn.base.BaseEstimator
+        :param param_distributions: The hyperparameter values to sample, keyed by parameter name
+        :type param_distributions: dict
+        :param max_fits: The maximum total fits, where each candidate requires `cv` fits, defaults to None
+        :type max_fits: int | None, optional
+        :param max_time: The maximum seconds spent evaluating candidates, defaults to None
+        :type max_time: float | None, optional
+        :param cv: The total cross-validation folds, defaults to 5
+        :type cv: int, optional
+        :param scoring: The scoring method, defaults to None, meaning the estimator's score method
+        :type scoring: str | None, optional
+        :param n_jobs: The total parallel jobs across folds, defaults to None
+        :type n_jobs: int | None, optional
+        :param random_state: The random seed for candidate ordering, defaults to None
+        :type random_state: int | None, optional
+        """
+        self.estimator = estimator
+        self.param_distributions = param_distributions
+        self.max_fits = max_fits
+        self.max_time = max_time
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        n_cands = len(ParameterGrid(self.param_distributions))
+        sampler = ParameterSampler(self.param_distributions, n_iter=n_cands, random_state=self.random_state)
+        time_start = time.time()
+        ls_params, ls_scores, ls_times = list(), list(), list()
+        for params in sampler:
+            if len(ls_params) > 0:
+                if self.max_fits is not None and (len(ls_params) + 1)*self.cv > self.max_fits:
+                    break
+                if self.max_time is not None and time.time() - time_start >= self.max_time:
+                    break
+            time_fit = time.time()
+            scores = cross_val_score(clone(self.estimator).set_params(**params), X, y, cv=self.cv,
+                                     scoring=self.scoring, n_jobs=self.n_jobs)
+            ls_params.append(params)
+            ls_scores.append(scores)
+            ls_times.append((time.time() - time_fit)/self.cv)
+
+        arr_scores = np.array(ls_scores)
+        mean_scores = arr_scores.mean(axis=1)
+        self.cv_results_ = {'params': ls_params,
+                            'mean_test_score': mean_scores,
+                            'std_test_score': arr_scores.std(axis=1),
+                            'rank_test_score': pd.Series(-mean_scores).rank(method='min').to_numpy(dtype=int),
+                            'mean_fit_time': np.array(ls_times),
+                            **{f'split{i}_test_score': arr_scores[:, i] for i in range(arr_scores.shape[1])},
+                            **{f'param_{k}': np.array([p.get(k) for p in ls_params], dtype=object)
+                               for k in self.param_distributions.keys()}}
+        self.best_index_ = int(np.argmax(mean_scores))
+        self.best_params_ = ls_params[self.best_index_]
+        self.best_score_ = mean_scores[self.best_index_]
+        self.n_splits_ = self.cv
+        self.n_candidates_ = len(ls_params)
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+def fs_calc_inbag(forest: RandomForestRegressor, n_train: int) -> np.ndarray:
+    """Count the times each training sample was drawn to fit each tree of a random forest.
+    Equivalent to :func:`forestci.calc_inbag()`, stored compactly as unsigned integers
+
+    :param forest: The fitted random forest, which must use bootstrapping
+    :type forest: RandomForestRegressor
+    :param n_train: The total training samples
+    :type n_train: int
+    :return: The in-bag counts with shape (n_train, n_trees), as uint8 unless a count exceeds 255
+    :rtype: np.ndarray
+    """
+    if not forest.bootstrap:
+        raise ValueError("The in-bag counts only exist for random forests fit with bootstrap=True")
+    inbag = np.zeros((n_train, len(forest.estimators_)), dtype=np.uint16)
+    for i, idx_samples in enumerate(forest.estimators_samples_):
+        inbag[:, i] = np.bincount(idx_samples, minlength=n_train)
+    return inbag.astype(np.uint8) if inbag.max() <= np.iinfo(np.uint8).max else inbag
+
+def _forest_pred_var_ss(forest: 'RandomForestRegressor | CompactForest', X: pd.DataFrame | np.ndarray,
+                        inbag: np.ndarray | None, n_train: int | None, subsample: bool,
+                        chunk_size: int | None, memory_limit: float | None, random_state: int | None) -> tuple:
+    # The single chunked pass of fs_forest_pred_var. With subsample, the variance is also estimated 
+    # from a random half of the trees for the calibration. Returns y_pred, var, var_ss & the tree fraction, 
+    # each array with shape (n_rows, n_outputs)
+    if inbag is None and isinstance(forest, CompactForest):
+        inbag = forest.arrays.get('inbag')
+        if inbag is None:
+            raise ValueError("The in-bag counts are required for a compact forest saved without them")
+    if inbag is None:
+        inbag = fs_calc_inbag(forest, n_train)
+    inbag = np.asarray(inbag, dtype=np.float64)
+    n_train, n_trees = inbag.shape
+    X = np.asarray(X, dtype=np.float32)
+    n_rows = X.shape[0]
+    if chunk_size is None:
+        # The (n_train x chunk) product plus the (n_trees x chunk x n_outputs) tree predictions dominate
+        n_bytes_row = 8.0*(n_train + 2*n_trees*forest.n_outputs_)
+        chunk_size = int(memory_limit*1e6/n_bytes_row) if memory_limit else n_rows
+        if chunk_size == 0:
+            raise ValueError(f"memory_limit is too small. It must be at least {n_bytes_row/1e6:.3e} MB")
+    chunk_size = max(1, chunk_size)
+
+    # The calibration re-estimates the variance from a random half of the trees
+    idx_ss = np.random.RandomState(random_state).permutation(n_trees)[:int(np.ceil(n_trees/2))]
+
+    def _v_ij_terms(inbag_sub: np.ndarray) -> tuple:
+        # The chunk-independent terms of forestci._core_computation & forestci._bias_correction
+        n_var = np.mean(np.square(inbag_sub).mean(axis=1) - np.square(inbag_sub.mean(axis=1)))
+        # Correct for cases where resampling is done without replacement
+        inflation = 1/(1 - np.mean(inbag_sub))**2 if np.max(inbag_sub) == 1 else 1
+        return inbag_sub - 1, n_var, inflation
+
+    def _v_ij(terms: tuple, pred: np.ndarray) -> np.ndarray:
+        inbag_centered, n_var, inflation = terms
+        n_sub = inbag_centered.shape[1]
+        pred_centered = pred - pred.mean(axis=0)
+        v_ij = np.sum((np.dot(inbag_centered, pred_centered)/n_sub)**2, 0)
+        v_ij -= n_train*n_var*np.square(pred_centered).sum(axis=0)/n_sub/n_sub
+        return v_ij*inflation
+
+    terms = _v_ij_terms(inbag)
+    terms_ss = _v_ij_terms(inbag[:, idx_ss]) if subsample else None
+    y_pred = np.empty((n_rows, forest.n_outputs_))
+    var = np.empty((n_rows, forest.n_outputs_))
+    var_ss = np.empty((n_rows, forest.n_outputs_)) if subsample else None
+    for i in range(0, n_rows, chunk_size):
+        # A single pass of tree predictions, shape (n_trees, chunk, n_outputs)
+        if isinstance(forest, CompactForest):
+            preds = forest.predict_trees(X[i:i+chunk_size]).astype(np.float64)
+        else:
+            preds = np.stack([tree.predict(X[i:i+chunk_size]).reshape(-1, forest.n_outputs_)
+                              for tree in forest.estimators_])
+        y_pred[i:i+chunk_size] = preds.mean(axis=0)
+        for j in range(forest.n_outputs_):
+            var[i:i+chunk_size, j] = _v_ij(terms, preds[:, :, j])
+            if subsample:
+                var_ss[i:i+chunk_size, j] = _v_ij(terms_ss, preds[idx_ss, :, j])
+    return y_pred, var, var_ss, len(idx_ss)/n_trees
+
+def _calib_sigma2(var: np.ndarray, var_ss: np.ndarray, delta: float) -> float:
+    # The Monte Carlo noise of the variance estimates. See forestci.random_forest_error
+    return (delta**2 + (1 - delta)**2)/(2*(1 - delta)**2)*np.mean((var_ss - var)**2)
+
+def _apply_calib_eb(var: np.ndarray, calib: dict | None, block_rows: int = 1000) -> np.ndarray:
+    # The posterior mean of each variance under a stored empirical Bayes prior, as forestci.calibration.gbayes, 
+    # evaluated row-wise rather than interpolated, so that each row's result is independent of the other rows
+    if calib is None: # A degenerate calibration, as in forestci.calibrateEB
+        return np.maximum(var, 0)
+    g_x, g_dens = np.asarray(calib['g_est'][0]), np.asarray(calib['g_est'][1])
+    var_calib = np.empty_like(var, dtype=np.float64)
+    for i in range(0, len(var), block_rows):
+        # The normal pdf's constant cancels in the normalization
+        post = np.exp(-0.5*np.square((g_x[None, :] - var[i:i+block_rows, None])/calib['sigma']))*g_dens
+        var_calib[i:i+block_rows] = (post @ g_x)/post.sum(axis=1)
+    return var_calib
+
+def fs_forest_calib_eb(forest: 'RandomForestRegressor | CompactForest', X: pd.DataFrame | np.ndarray,
+                       inbag: np.ndarray | None = None, n_train: int | None = None,
+                       chunk_size: int | None = None, memory_limit: float | None = None,
+                       random_state: int | None = None) -> List[dict | None] | None:
+    """Fit the forestci empirical Bayes calibration of a random forest's variance once, on reference rows, 
+    so that the same calibration applies to any rows predicted later, e.g. to each chunk of a 
+    streamed prediction. See the `calibration` of :func:`fs_forest_pred_var()`
+
+    :param forest: The fitted random forest
+    :type forest: RandomForestRegressor | CompactForest
+    :param X: The reference predictor data, already transformed by any preceding pipeline steps
+    :type X: pd.DataFrame | np.ndarray
+    :param inbag: The in-bag counts, defaults to None. See :func:`fs_forest_pred_var()`
+    :type inbag: np.ndarray | None, optional
+    :param n_train: The total training samples, required when `inbag` is None, defaults to None
+    :type n_train: int | None, optional
+    :param chunk_size: The total rows per chunk, defaults to None. See :func:`fs_forest_pred_var()`
+    :type chunk_size: int | None, optional
+    :param memory_limit: The approximate memory ceiling in MB of each chunk, defaults to None
+    :type memory_limit: float | None, optional
+    :param random_state: The random seed for selecting the calibration trees, defaults to None
+    :type random_state: int | None, optional
+    :return: Each output's prior `g_est` & noise `sigma`, or None where forestci would only clip the variance at zero. 
+        None overall when there are too few reference rows (20 or fewer) to calibrate.
+    :rtype: List[dict | None] | None
+    """
+    if np.asarray(X).shape[0] <= 20:
+        return None
+    _, var, var_ss, delta = _forest_pred_var_ss(forest, X, inbag, n_train, True,
+                                                chunk_size, memory_limit, random_state)
+    calibration = list()
+    for j in range(var.shape[1]):
+        sigma2 = _calib_sigma2(var[:, j], var_ss[:, j], delta)
+        if sigma2 <= 0 or var[:, j].min() == var[:, j].max(): # As in forestci.calibrateEB
+            calibration.append(None)
+        else:
+            calibration.append({'g_est': gfit(var[:, j], np.sqrt(sigma2)), 'sigma': float(np.sqrt(sigma2))})
+    return calibration
+
+def fs_forest_pred_var(forest: 'RandomForestRegressor | CompactForest', X: pd.DataFrame | np.ndarray,
+                       inbag: np.ndarray | None = None, n_train: int | None = None,
+                       calibrate: bool = True, chunk_size: int | None = None,
+                       memory_limit: float | None = None, random_state: int | None = None,
+                       calibration: List[dict | None] | None = None) -> tuple:
+    """Predict with a random forest & estimate the infinitesimal jackknife variance of each prediction 
+    in a single pass over the trees. Equivalent to :func:`forestci.random_forest_error()`, 
+    but the rows of `X` are processed in chunks so that memory is bounded regardless of the total rows, 
+    and the tree predictions are shared by the prediction, the variance, and the calibration.
+    The calibration is otherwise fit to the rows of `X`, so it differs when the same rows are predicted 
+    in separate calls. Pass a `calibration` from :func:`fs_forest_calib_eb()` to apply the same one to every call.
+
+    :param forest: The fitted random forest
+    :type forest: RandomForestRegressor | CompactForest
+    :param X: The predictor data, already transformed by any preceding pipeline steps
+    :type X: pd.DataFrame | np.ndarray
+    :param inbag: The in-bag counts with shape (n_train, n_trees), defaults to None, meaning they are regenerated with :func:`fs_calc_inbag()`
+    :type inbag: np.ndarray | None, optional
+    :param n_train: The total training samples, required when `inbag` is None, defaults to None
+    :type n_train: int | None, optional
+    :param calibrate: Should the empirical Bayes calibration of forestci be applied? defaults to True
+    :type calibrate: bool, optional
+    :param chunk_size: The total rows per chunk, defaults to None, meaning derived from `memory_limit`, or all rows
+    :type chunk_size: int | None, optional
+    :param memory_limit: The approximate memory ceiling in MB of each chunk's intermediate arrays, defaults to None
+    :type memory_limit: float | None, optional
+    :param random_state: The random seed for selecting the calibration trees, defaults to None
+    :type random_state: int | None, optional
+    :param calibration: A stored calibration applied in place of fitting one to `X`, when `calibrate`. 
+        Defaults to None. See :func:`fs_forest_calib_eb()`
+    :type calibration: List[dict | None] | None, optional
+    :return: The predictions & their variance, each with shape (n_rows,) or (n_rows, n_outputs) for multi-output forests
+    :rtype: tuple
+    """
+    n_rows = np.asarray(X).shape[0]
+    fit_calib = calibrate and calibration is None and n_rows > 20
+    y_pred, var, var_ss, delta = _forest_pred_var_ss(forest, X, inbag, n_train, fit_calib,
+                                                     chunk_size, memory_limit, random_state)
+    if calibrate and calibration is not None:
+        for j in range(forest.n_outputs_):
+            var[:, j] = _apply_calib_eb(var[:, j], calibration[j])
+    elif fit_calib: # See forestci.random_forest_error
+        for j in range(forest.n_outputs_):
+            var[:, j] = calibrateEB(var[:, j], _calib_sigma2(var[:, j], var_ss[:, j], delta))
+
+    if forest.n_outputs_ == 1:
+        return y_pred[:, 0], var[:, 0]
+    return y_pred, var
+
+def fs_pipe_pred_var(pipe: 'Pipeline | CompactForest', X: pd.DataFrame | np.ndarray, **kwargs) -> tuple:
+    """Predict with a pipeline ending in a random forest & estimate the variance of each prediction.
+    Any preceding pipeline steps first transform `X`. See :func:`fs_forest_pred_var()`
+
+    :param pipe: The fitted pipeline, whose final step is a random forest, or a compact forest
+    :type pipe: Pipeline | CompactForest
+    :param X: The predictor data
+    :type X: pd.DataFrame | np.ndarray
+    :raises TypeError: When the pipeline's final step is not a random forest
+    :return: The predictions & their variance
+    :rtype: tuple
+    """
+    return fs_forest_pred_var(*_pipe_forest_X(pipe, X), **kwargs)
+
+def fs_pipe_calib_eb(pipe: 'Pipeline | CompactForest', X: pd.DataFrame | np.ndarray, **kwargs) -> List[dict | None] | None:
+    """Fit the variance calibration of a pipeline ending in a random forest on reference rows. 
+    Any preceding pipeline steps first transform `X`. See :func:`fs_forest_calib_eb()`
+
+    :param pipe: The fitted pipeline, whose final step is a random forest, or a compact forest
+    :type pipe: Pipeline | CompactForest
+    :param X: The reference predictor data
+    :type X: pd.DataFrame | np.ndarray
+    :raises TypeError: When the pipeline's final step is not a random forest
+    :return: The calibration of each output
+    :rtype: List[dict | None] | None
+    """
+    return fs_forest_calib_eb(*_pipe_forest_X(pipe, X), **kwargs)
+
+def _pipe_forest_X(pipe: 'Pipeline | CompactForest', X: pd.DataFrame | np.ndarray) -> tuple:
+    # The pipeline's random forest & X transformed by the preceding steps
+    if isinstance(pipe, CompactForest):
+        return pipe, pipe._validate_X(X)
+    forest = pipe[-1]
+    if not isinstance(forest, RandomForestRegressor):
+        raise TypeError(f"Uncertainty may only be estimated for random forests, not {type(forest).__name__}")
+    return forest, pipe[:-1].transform(X) if len(pipe) > 1 else X
+
+def _take_rows(data: pd.DataFrame | pd.Series | np.ndarray, idx: np.ndarray):
+    return data.iloc[idx] if isinstance(data, (pd.DataFrame, pd.Series)) else data[idx]
+
+class ForestSizeSweep(BaseEstimator):
+    def __init__(self, n_estimators: Iterable[int], scoring: str = 'oob', cv: int = 5,
+                 random_state: int | None = None, n_jobs: int | None = None):
+        """Tune a random forest's `n_estimators` by growing a single forest with `warm_start` 
+        up to the largest size & scoring each intermediate size, rather than fitting 
+        an independent forest per size. Sizes are scored with the negative mean absolute error 
+        of either the out-of-bag predictions (`scoring='oob'`), or of the held-out fold 
+        predictions when a forest is grown per cross-validation fold (`scoring='cv'`). 
+        The fitted attributes follow :class:`sklearn.model_selection.GridSearchCV`.
+
+        :param n_estimators: The forest sizes to score
+        :type n_estimators: Iterable[int]
+        :param scoring: 'oob' or 'cv', defaults to 'oob'
+        :type scoring: str, optional
+        :param cv: The total cross-validation folds when `scoring='cv'`, defaults to 5
+        :type cv: int, optional
+        :param random_state: The random seed of the forest, defaults to None
+        :type random_state: int | None, optional
+        :param n_jobs: The total parallel jobs building trees, defaults to None
+        :type n_jobs: int | None, optional
+        """
+        self.n_estimators = n_estimators
+        self.scoring = scoring
+        self.cv = cv
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+
+    def _grow(self, X, y, X_eval=None, y_eval=None):
+        """Grow a forest through each size, accumulating per-tree predictions to score every size
+
+        :return: The fitted pipeline, the scores per size, and the evaluation predictions per size (NaN when a sample has no prediction)
+        :rtype: tuple
+        """
+        sizes = sorted(set(int(n) for n in self.n_estimators))
+        # OOB predictions are accumulated here, rather than recomputed by every warm start fit
+        pipe = make_pipeline(RandomForestRegressor(n_estimators=sizes[0], warm_start=True, oob_score=False,
+                                                   random_state=self.random_state, n_jobs=self.n_jobs))
+        rf = pipe.named_steps['randomforestregressor']
+        X_eval = np.asarray(X if X_eval is None else X_eval, dtype=np.float32)
+        y_eval = np.asarray(y if y_eval is None else y_eval, dtype=np.float64).reshape(X_eval.shape[0], -1)
+        sum_pred = np.zeros(y_eval.shape)
+        cnt_pred = np.zeros(y_eval.shape[0])
+        scores, preds = list(), list()
+        for n in sizes:
+            n_prev = len(getattr(rf, 'estimators_', []))
+            pipe.set_params(randomforestregressor__n_estimators=n)
+            pipe.fit(X, y)
+            for i in range(n_prev, n):
+                if self.scoring == 'oob': # only the samples left out of the tree's bootstrap
+                    is_eval = np.ones(X_eval.shape[0], dtype=bool)
+                    is_eval[rf.estimators_samples_[i]] = False
+                else:
+                    is_eval = np.ones(X_eval.shape[0], dtype=bool)
+                sum_pred[is_eval] += rf.estimators_[i].predict(X_eval[is_eval]).reshape(is_eval.sum(), -1)
+                cnt_pred[is_eval] += 1
+            with np.errstate(invalid='ignore', divide='ignore'):
+                preds.append(sum_pred/cnt_pred[:, None])
+            has_pred = cnt_pred > 0
+            scores.append(-mean_absolute_error(y_eval[has_pred], preds[-1][has_pred]))
+        return pipe, np.array(scores), preds
+
+    def fit(self, X, y):
+        sizes = sorted(set(int(n) for n in self.n_estimators))
+        if self.scoring == 'oob':
+            pipe, scores, preds = self._grow(X, y)
+            arr_scores = scores.reshape(-1, 1)
+        elif self.scoring == 'cv':
+            ls_scores = list()
+            for idx_tr, idx_val in KFold(n_splits=self.cv).split(X):
+                ls_scores.append(self._grow(_take_rows(X, idx_tr), _take_rows(y, idx_tr),
+                                            _take_rows(X, idx_val), _take_rows(y, idx_val))[1])
+            arr_scores = np.column_stack(ls_scores)
+        else:
+            raise ValueError(f"Unrecognized forest size scoring '{self.scoring}'. Expected 'oob' or 'cv'")
+
+        mean_scores = arr_scores.mean(axis=1)
+        self.best_index_ = int(np.argmax(mean_scores))
+        n_best = sizes[self.best_index_]
+        ls_params = [{'randomforestregressor__n_estimators': n} for n in sizes]
+        self.cv_results_ = {'params': ls_params,
+                            'mean_test_score': mean_scores,
+                            'std_test_score': arr_scores.std(axis=1),
+                            'rank_test_score': pd.Series(-mean_scores).rank(method='min').to_numpy(dtype=int),
+                            'param_randomforestregressor__n_estimators': np.array(sizes, dtype=object)}
+        self.best_params_ = ls_params[self.best_index_]
+        self.best_score_ = mean_scores[self.best_index_]
+        self.n_splits_ = arr_scores.shape[1]
+
+        if self.scoring == 'oob': # The forest's first n_best trees form the n_best sized forest
+            rf = pipe.named_steps['randomforestregressor']
+            rf.estimators_ = rf.estimators_[:n_best]
+            rf.n_estimators = n_best
+            rf.warm_start = False
+            rf.oob_score = True
+            oob_pred = preds[self.best_index_]
+            has_pred = ~np.isnan(oob_pred).any(axis=1)
+            rf.oob_prediction_ = oob_pred[:, 0] if oob_pred.shape[1] == 1 else oob_pred
+            rf.oob_score_ = r2_score(np.asarray(y).reshape(oob_pred.shape)[has_pred], oob_pred[has_pred])
+        else:
+            pipe = make_pipeline(RandomForestRegressor(n_estimators=n_best, random_state=self.random_state,
+                                                       n_jobs=self.n_jobs, oob_score=True))
+            pipe.fit(X, y)
+        self.best_estimator_ = pipe
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+# %% COMPACT FOREST ARTIFACTS
+def std_compact_forest_path(path_algo: str | os.PathLike) -> Path:
+    """Standardize the compact random forest save path, next to the algorithm save path
+
+    :param path_algo: The algorithm save path, see :func:`std_algo_path()`
+    :type path_algo: str | os.PathLike
+    :return: full save path of the compact forest. See :class:`CompactForest`
+    :rtype: Path
+    """
+    return Path(path_algo).with_suffix('.fsforest')
+
 def std_algo_path(dir_out_alg_ds:str | os.PathLike, algo: str, metric: str, dataset_id: str) -> str:
     """Standardize the algorithm save path
     :param dir_out_alg_ds:  Directory where algorithm's output stored.
@@ -380,6 +1622,189 @@ def std_pred_path(dir_out: str | os.PathLike, algo: str, metric: str, dataset_id
     path_pred_rslt = Path(dir_preds_ds)/Path(basename_pred_alg_ds_metr)
     return path_pred_rslt
 
+def std_unit_eval_path(dir_out_alg_ds: str | os.PathLike, metric: str, dataset_id: str) -> Path:
+    """Standardize the path of a training unit's evaluation summary, which records the unit's 
+    input fingerprint to allow skipping unchanged units. See :func:`fs_train_eval_units()`
+
+    :param dir_out_alg_ds: Directory where algorithm's output stored.
+    :type dir_out_alg_ds: str | os.PathLike
+    :param metric: The metric or hydrologic signature identifier of interest, or 'multioutput'
+    :type metric: str
+    :param dataset_id: Unique identifier/descriptor of the dataset of interest
+    :type dataset_id: str
+    :return: The evaluation summary's save path
+    :rtype: Path
+    """
+    return Path(dir_out_alg_ds)/f'unit_eval_{metric}__{dataset_id}.parquet'
+
+def _resolve_model_path(path_algo: str | os.PathLike, path_model: str | os.PathLike) -> Path:
+    path_model = Path(path_model)
+    if not path_model.exists(): # e.g. the algorithm directory was moved
+        path_model = Path(Path(path_algo).parent/Path(path_model.name))
+    return path_model
+
+def _is_mlp_pipeline(pipe) -> bool:
+    pipe = getattr(pipe, 'best_estimator_', pipe)
+    return isinstance(pipe, Pipeline) and isinstance(pipe.steps[-1][1], MLPRegressor)
+
+def _org_algo_dict(algo_dict: dict | Pipeline, metric: str | None = None) -> dict:
+    if not isinstance(algo_dict, dict): # A bare pipeline
+        algo_dict = {'model': algo_dict, 'confidence_intervals': None}
+    metric = metric or algo_dict.get('metric')
+    metrics = algo_dict.get('metrics')
+    idx_output = metrics.index(metric) if metrics and metric else None
+    return {'model': algo_dict['model'], 'confidence_intervals': algo_dict.get('confidence_intervals'),
+            'metrics': metrics, 'idx_output': idx_output, 'n_train': algo_dict.get('n_train'),
+            'inbag': algo_dict.get('inbag')}
+
+def fs_load_algo(path_algo: str | os.PathLike, mmap_mode: str | None = None) -> dict:
+    """Load a trained algorithm written by :meth:`AlgoTrainEval.save_algos()`, 
+    resolving the per-metric references to a multi-output algorithm
+
+    :param path_algo: The algorithm save path, see :func:`std_algo_path()`
+    :type path_algo: str | os.PathLike
+    :param mmap_mode: The memory-map mode for large arrays, e.g. 'r', passed to :func:`joblib.load()`. Defaults to None, meaning arrays are read into memory
+    :type mmap_mode: str | None, optional
+    :return: dict with the following keys:
+        - `model`: the trained pipeline
+        - `confidence_intervals`: the saved confidence intervals, if any
+        - `metrics`: the metrics predicted by a multi-output model, otherwise None
+        - `idx_output`: the column of the multi-output model's prediction for the metric, otherwise None
+        - `n_train`: the total training samples, if saved
+        - `inbag`: the random forest's in-bag counts with shape (n_train, n_trees), if saved. See :func:`fs_calc_inbag()`
+    :rtype: dict
+    """
+    algo_dict = joblib.load(path_algo, mmap_mode=mmap_mode)
+    if isinstance(algo_dict, dict) and algo_dict.get('path_model'):
+        path_model = _resolve_model_path(path_algo, algo_dict['path_model'])
+        return _org_algo_dict(joblib.load(path_model, mmap_mode=mmap_mode), algo_dict['metric'])
+    return _org_algo_dict(algo_dict)
+
+class AlgoRegistry:
+    def __init__(self, dir_out_alg_base: str | os.PathLike, max_models: int = 4, mmap_mode: str | None = 'r',
+                 use_compact_forest: bool = False, n_jobs: int | None = None, compile_mlp: str | None = None):
+        """An index of the trained algorithms saved by :meth:`AlgoTrainEval.save_algos()`, 
+        which loads algorithms on first use & keeps the most recently used in memory. 
+        The metrics of a multi-output algorithm share a single loaded algorithm.
+
+        :param dir_out_alg_base: The base directory of the saved algorithms, containing a subdirectory per dataset. See :func:`fs_save_algo_dir_struct()`
+        :type dir_out_alg_base: str | os.PathLike
+        :param max_models: The maximum total algorithms kept in memory, defaults to 4
+        :type max_models: int, optional
+        :param mmap_mode: The memory-map mode for large arrays, passed to :func:`joblib.load()`, defaults to 'r'. None reads arrays into memory
+        :type mmap_mode: str | None, optional
+        :param use_compact_forest: Should a random forest's compact copy be loaded in place of the pickled pipeline when it exists? 
+            Only faster when predicting small batches, see :class:`CompactForest`. Defaults to False
+        :type use_compact_forest: bool, optional
+        :param n_jobs: The total threads each compact forest predicts with, defaults to None, meaning 1. -1 means all cores
+        :type n_jobs: int | None, optional
+        :param compile_mlp: The floating point type, e.g. 'float32', of the :class:`CompactMLP` compiled from each loaded 
+            multi-layer perceptron pipeline in its place. Defaults to None, meaning the pipeline is kept
+        :type compile_mlp: str | None, optional
+        """
+        self.dir_out_alg_base = Path(dir_out_alg_base)
+        self.max_models = max_models
+        self.mmap_mode = mmap_mode
+        self.use_compact_forest = use_compact_forest
+        self.n_jobs = n_jobs
+        self.compile_mlp = compile_mlp
+        self.hits = 0
+        self.misses = 0
+        self._cache = dict() # insertion ordered, with the most recently used last
+        self._refs = dict() # the per-metric references to multi-output algorithms
+        self.index = self.build_index()
+
+    def build_index(self) -> pd.DataFrame:
+        """Index the saved algorithms by parsing their filenames. See :func:`std_algo_path()`
+
+        :return: The `dataset`, `algo`, `metric` & `path_algo` of each saved algorithm
+        :rtype: pd.DataFrame
+        """
+        rows = list()
+        for path_algo in sorted(self.dir_out_alg_base.glob('*/algo_*__*.joblib')):
+            algo_metr, dataset_id = path_algo.stem[len('algo_'):].rsplit('__', 1)
+            algo, metric = algo_metr.split('_', 1)
+            rows.append({'dataset': dataset_id, 'algo': algo, 'metric': metric, 'path_algo': path_algo})
+        self.index = pd.DataFrame(rows, columns=['dataset', 'algo', 'metric', 'path_algo'])
+        return self.index
+
+    def path(self, dataset_id: str, algo: str, metric: str) -> Path:
+        """The save path of an indexed algorithm
+
+        :raises FileNotFoundError: When the algorithm is not in the index
+        :return: The algorithm save path
+        :rtype: Path
+        """
+        idx = self.index
+        match = idx[(idx['dataset'] == dataset_id) & (idx['algo'] == algo) & (idx['metric'] == metric)]
+        if match.empty:
+            raise FileNotFoundError(f"No {algo} algorithm for {metric} of {dataset_id} inside {self.dir_out_alg_base}")
+        return Path(match['path_algo'].iloc[0])
+
+    def _load(self, path: Path) -> dict | Pipeline:
+        # The key changes when an algorithm is retrained
+        key = (str(path), path.stat().st_mtime_ns)
+        if key in self._refs:
+            return self._refs[key]
+        if key in self._cache:
+            self.hits += 1
+            self._cache[key] = self._cache.pop(key)
+            return self._cache[key]
+        if path.suffix == '.fsforest':
+            obj = CompactForest.load(path, mmap_mode=self.mmap_mode)
+            obj.n_jobs = self.n_jobs
+        else:
+            obj = joblib.load(path, mmap_mode=self.mmap_mode)
+        if isinstance(obj, dict) and obj.get('path_model'): # The small per-metric references are always kept
+            self._refs[key] = obj
+            return obj
+        if self.compile_mlp and isinstance(obj, dict) and _is_mlp_pipeline(obj.get('model')):
+            obj = {**obj, 'model': CompactMLP.from_pipeline(obj['model'], dtype=self.compile_mlp)}
+        self.misses += 1
+        self._cache[key] = obj
+        while len(self._cache) > self.max_models:
+            del self._cache[next(iter(self._cache))]
+        return obj
+
+    def get(self, dataset_id: str, algo: str, metric: str) -> dict:
+        """Retrieve a trained algorithm, loading it if not already in memory
+
+        :param dataset_id: The dataset the algorithm was trained on
+        :type dataset_id: str
+        :param algo: The algorithm abbreviation, e.g. 'rf'
+        :type algo: str
+        :param metric: The metric predicted by the algorithm
+        :type metric: str
+        :return: The trained algorithm. See :func:`fs_load_algo()`
+        :rtype: dict
+        """
+        path_algo = self.path(dataset_id, algo, metric)
+        if self.use_compact_forest and std_compact_forest_path(path_algo).exists():
+            return self._org_compact(std_compact_forest_path(path_algo))
+        algo_dict = self._load(path_algo)
+        if isinstance(algo_dict, dict) and algo_dict.get('path_model'):
+            path_model = _resolve_model_path(path_algo, algo_dict['path_model'])
+            if self.use_compact_forest and std_compact_forest_path(path_model).exists():
+                return self._org_compact(std_compact_forest_path(path_model), algo_dict['metrics'], algo_dict['metric'])
+            return _org_algo_dict(self._load(path_model), algo_dict['metric'])
+        return _org_algo_dict(algo_dict)
+
+    def _org_compact(self, path_compact: Path, metrics: List[str] | None = None, metric: str | None = None) -> dict:
+        forest = self._load(path_compact)
+        return _org_algo_dict({'model': forest, 'metrics': metrics, 'metric': metric,
+                               'inbag': forest.arrays.get('inbag')})
+
+    def stats(self) -> dict:
+        """Summarize registry usage
+
+        :return: dict with the keys `hits`, `misses`, `hit_rate`, `size` (total algorithms in memory), and `indexed`
+        :rtype: dict
+        """
+        n_req = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits/n_req if n_req > 0 else np.nan,
+                'size': len(self._cache), 'indexed': len(self.index)}
+
 def _read_pred_comid(path_pred_locs: str | os.PathLike, comid_pred_col:str ) -> list[str]:
     """Read the comids from a prediction file formatted as .csv
 
@@ -408,11 +1833,245 @@ def _read_pred_comid(path_pred_locs: str | os.PathLike, comid_pred_col:str ) ->
         raise ValueError(f"NEED TO ADD CAPABILITY THAT HANDLES {Path(path_pred_locs).suffix} file extensions")
     comids_pred = [str(x) for x in comids_pred]
     return comids_pred
+
+def fs_pred_algo_df(algo_dict: dict, df_attr_wide: pd.DataFrame, metric: str, dataset_id: str,
+                    algo: str, name_algo: str, uncertainty_cfg: dict | None = None,
+                    calibration: List[dict | None] | None = None) -> pd.DataFrame:
+    """Predict a metric with a trained algorithm & compile the prediction results
+
+    :param algo_dict: The trained algorithm, see :func:`fs_load_algo()`
+    :type algo_dict: dict
+    :param df_attr_wide: The attribute data indexed by `featureID` with one column per attribute, see :func:`fs_attr_wide()`
+    :type df_attr_wide: pd.DataFrame
+    :param metric: The predicted metric
+    :type metric: str
+    :param dataset_id: The dataset the algorithm was trained on
+    :type dataset_id: str
+    :param algo: The algorithm abbreviation, e.g. 'rf'
+    :type algo: str
+    :param name_algo: The algorithm's filename
+    :type name_algo: str
+    :param uncertainty_cfg: The random forest uncertainty settings, with the keys `enabled` (default False), `calibrate`, 
+        `chunk_size`, `memory_limit` & `seed`, defaults to None. See :func:`fs_forest_pred_var()`
+    :type uncertainty_cfg: dict | None, optional
+    :param calibration: A stored variance calibration, see :func:`fs_pipe_calib_eb()`. Defaults to None, 
+        meaning any calibration is fit to `df_attr_wide`
+    :type calibration: List[dict | None] | None, optional
+    :return: The predictions, with a `variance` column after `prediction` when uncertainty is estimated
+    :rtype: pd.DataFrame
+    """
+    uncertainty_cfg = uncertainty_cfg or dict()
+    pipe = algo_dict['model']
+    df_attr_sub = df_attr_wide[list(pipe.feature_names_in_)]
+
+    est_var = uncertainty_cfg.get('enabled', False) and algo == 'rf'
+    if est_var and algo_dict.get('inbag') is None and algo_dict.get('n_train') is None:
+        warnings.warn(f"Skipping the uncertainty of {name_algo}, which predates saving the total training samples. Retrain to estimate uncertainty.", UserWarning)
+        est_var = False
+    if est_var: # The forestci variance, processed in chunks of rows to bound memory
+        resp_pred, resp_var = fs_pipe_pred_var(pipe, df_attr_sub, inbag=algo_dict.get('inbag'),
+                                               n_train=algo_dict.get('n_train'),
+                                               calibrate=uncertainty_cfg.get('calibrate', True),
+                                               chunk_size=uncertainty_cfg.get('chunk_size'),
+                                               memory_limit=uncertainty_cfg.get('memory_limit'),
+                                               random_state=uncertainty_cfg.get('seed'),
+                                               calibration=calibration)
+    else:
+        resp_pred = pipe.predict(df_attr_sub)
+    if algo_dict.get('idx_output') is not None: # A multi-output algorithm predicts all metrics
+        resp_pred = resp_pred[:, algo_dict['idx_output']]
+        if est_var:
+            resp_var = resp_var[:, algo_dict['idx_output']]
+
+    df_pred = pd.DataFrame({'comid': df_attr_wide.index.astype(str),
+                            'prediction': resp_pred,
+                            'metric': metric,
+                            'dataset': dataset_id,
+                            'algo': algo,
+                            'name_algo': name_algo})
+    if est_var:
+        df_pred.insert(df_pred.columns.get_loc('prediction')+1, 'variance', resp_var)
+    return df_pred
+
+def _fs_stream_calib(comids: list, read_attr_wide: Callable[[list], pd.DataFrame], models: Dict[tuple, dict],
+                     uncertainty_cfg: dict) -> Dict[tuple, List[dict | None] | None]:
+    # The variance calibration of each streamed random forest, fit on a seeded sample of the locations 
+    # whose size is independent of the chunk size. See fs_pipe_calib_eb
+    models_rf = {k: v for k, v in models.items() if k[0] == 'rf' and
+                 (v['algo_dict'].get('inbag') is not None or v['algo_dict'].get('n_train') is not None)}
+    if not models_rf or not comids:
+        return dict()
+    rng = np.random.default_rng(uncertainty_cfg.get('seed'))
+    n_ref = min(len(comids), uncertainty_cfg.get('calibration_size', 5000))
+    comids_ref = [comids[i] for i in np.sort(rng.choice(len(comids), n_ref, replace=False))]
+    df_ref = read_attr_wide(comids_ref)
+    calibs, calibs_pipe = dict(), dict()
+    for k, mdl in models_rf.items():
+        pipe = mdl['algo_dict']['model']
+        if id(pipe) not in calibs_pipe: # A multi-output algorithm is shared by its metrics
+            calibs_pipe[id(pipe)] = fs_pipe_calib_eb(pipe, df_ref[list(pipe.feature_names_in_)],
+                                                     inbag=mdl['algo_dict'].get('inbag'),
+                                                     n_train=mdl['algo_dict'].get('n_train'),
+                                                     chunk_size=uncertainty_cfg.get('chunk_size'),
+                                                     memory_limit=uncertainty_cfg.get('memory_limit'),
+                                                     random_state=uncertainty_cfg.get('seed'))
+        calibs[k] = calibs_pipe[id(pipe)]
+    return calibs
+
+def fs_pred_stream(comids: Iterable, read_attr_wide: Callable[[list], pd.DataFrame], models: Dict[tuple, dict],
+                   dataset_id: str, chunk_size: int = 10000, uncertainty_cfg: dict | None = None,
+                   verbose: bool = True) -> Dict[tuple, int]:
+    """Predict in fixed-size chunks of COMIDs, appending each chunk's results to parquet files, 
+    so that peak memory depends on `chunk_size` rather than the total prediction locations.
+    Each chunk's attributes are read, predicted by every algorithm, & written before reading the next chunk.
+
+    :param comids: The COMIDs of the prediction locations
+    :type comids: Iterable
+    :param read_attr_wide: Returns the attribute data for a list of COMIDs, e.g. a wrapper of :func:`fs_attr_wide()`
+    :type read_attr_wide: Callable[[list], pd.DataFrame]
+    :param models: The algorithms keyed by (algo, metric), each a dict with the keys `algo_dict` (see :func:`fs_load_algo()`), 
+        `path_algo` and `path_pred_out` (see :func:`std_pred_path()`)
+    :type models: Dict[tuple, dict]
+    :param dataset_id: The dataset the algorithms were trained on
+    :type dataset_id: str
+    :param chunk_size: The total COMIDs per chunk, defaults to 10000
+    :type chunk_size: int, optional
+    :param uncertainty_cfg: The random forest uncertainty settings, defaults to None. See :func:`fs_pred_algo_df()`. 
+        Any calibration is fit once, on a seeded sample of `calibration_size` locations (default 5000), 
+        & applied to every chunk, so the variance does not depend on `chunk_size`.
+    :type uncertainty_cfg: dict | None, optional
+    :param verbose: Should progress be printed per chunk? defaults to True
+    :type verbose: bool, optional
+    :return: The total rows written for each (algo, metric)
+    :rtype: Dict[tuple, int]
+    """
+    comids = list(comids)
+    uncertainty_cfg = uncertainty_cfg or dict()
+    calibs = dict()
+    if uncertainty_cfg.get('enabled', False) and uncertainty_cfg.get('calibrate', True):
+        calibs = _fs_stream_calib(comids, read_attr_wide, models, uncertainty_cfg)
+    n_chunks = max(1, int(np.ceil(len(comids)/chunk_size)))
+    writers = dict()
+    n_rows = {k: 0 for k in models.keys()}
+    try:
+        for i in range(n_chunks):
+            comids_chunk = comids[i*chunk_size:(i+1)*chunk_size]
+            df_attr_wide = read_attr_wide(comids_chunk)
+            for (algo, metric), mdl in models.items():
+                if df_attr_wide.empty: # None of the chunk's COMIDs have attribute data
+                    break
+                calib = calibs.get((algo, metric))
+                df_pred = fs_pred_algo_df(mdl['algo_dict'], df_attr_wide, metric=metric,
+                                          dataset_id=dataset_id, algo=algo,
+                                          name_algo=Path(mdl['path_algo']).name,
+                                          # Without a shared calibration, no chunk is calibrated
+                                          uncertainty_cfg=uncertainty_cfg if calib is not None else \
+                                            {**uncertainty_cfg, 'calibrate': False},
+                                          calibration=calib)
+                tbl = pa.Table.from_pandas(df_pred, preserve_index=False)
+                if (algo, metric) not in writers:
+                    writers[(algo, metric)] = pq.ParquetWriter(mdl['path_pred_out'], tbl.schema)
+                writers[(algo, metric)].write_table(tbl)
+                n_rows[(algo, metric)] += len(df_pred)
+            if verbose:
+                print(f"   Predicted chunk {i+1}/{n_chunks} of {dataset_id}: {len(df_attr_wide)} of {len(comids_chunk)} locations with attributes")
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return n_rows
+# %% BACKGROUND ARTIFACT WRITING
+class ArtifactWriter:
+    def __init__(self, max_queue: int = 2):
+        """Write files in a background thread, so that training continues while artifacts are written. 
+        Writes happen one at a time, in the order submitted. The queue is bounded, so that at most 
+        `max_queue` pending artifacts, e.g. trained algorithms, are held in memory; a full queue 
+        blocks :meth:`submit()` until a write completes. 
+        Call :meth:`close()`, or use as a context manager, to finish all writes before exiting. 
+        Write errors are raised by the next :meth:`submit()`, :meth:`flush()` or :meth:`close()`.
+
+        :param max_queue: The maximum total writes waiting in the queue, defaults to 2
+        :type max_queue: int, optional
+        """
+        self.max_queue = max_queue
+        self.n_written = 0
+        self.seconds_writing = 0.0
+        self._errors = list()
+        self._closed = False
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name='fs_artifact_writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None: # Sentinel from close()
+                    return
+                func, args, kwargs = item
+                t_start = time.perf_counter()
+                try:
+                    func(*args, **kwargs)
+                    self.n_written += 1
+                except Exception as e:
+                    self._errors.append(e)
+                self.seconds_writing += time.perf_counter() - t_start
+            finally:
+                self._queue.task_done()
+
+    def _raise_errors(self):
+        if self._errors:
+            errors, self._errors = self._errors, list()
+            if len(errors) > 1:
+                warnings.warn(f"{len(errors)} artifact writes failed, raising the first. The others: {errors[1:]}",
+                              UserWarning)
+            raise errors[0]
+
+    def submit(self, func: Callable, *args, **kwargs):
+        """Queue `func(*args, **kwargs)`, which writes a file, blocking while the queue is full
+
+        :param func: The writing function, e.g. :func:`joblib.dump()`
+        :type func: Callable
+        :raises RuntimeError: When the writer was closed
+        """
+        self._raise_errors()
+        if self._closed:
+            raise RuntimeError("Cannot submit to a closed ArtifactWriter")
+        self._queue.put((func, args, kwargs))
+
+    def flush(self):
+        """Wait for all queued writes to complete, raising the first write error if any failed
+        """
+        self._queue.join()
+        self._raise_errors()
+
+    def close(self):
+        """Complete all queued writes, stop the background thread, & raise the first write error if any failed
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_errors()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else: # Finish the writes, without masking the original exception
+            try:
+                self.close()
+            except Exception as e:
+                warnings.warn(f"Artifact write failed: {e}", UserWarning)
+
 class AlgoTrainEval:
     def __init__(self, df: pd.DataFrame, attrs: Iterable[str], algo_config: dict,
                  dir_out_alg_ds: str | os.PathLike, dataset_id: str,
-                 metr: str, test_size: float = 0.3,rs: int = 32,
-                 verbose: bool = False):
+                 metr: str | List[str], test_size: float = 0.3,rs: int = 32,
+                 verbose: bool = False, n_jobs: int = -1, search_config: dict | None = None,
+                 uncertainty_config: dict | None = None, compact_forest: str | None = None,
+                 writer: ArtifactWriter | None = None):
         """The algorithm training and evaluation class.
 
         :param df: The combined response variable and predictor variables DataFrame.
@@ -429,14 +2088,29 @@ class AlgoTrainEval:
         :type dir_out_alg_ds: str | os.PathLike
         :param dataset_id: Unique identifier/descriptor of the dataset of interest, and will be used in file writing.
         :type dataset_id: str
-        :param metr: Column name in `df`. The metric or hydrologic signature identifier of interest, defaults to None.
-        :type metr: str, optional
+        :param metr: Column name in `df`. The metric or hydrologic signature identifier of interest, defaults to None. 
+            A list of column names trains multi-output algorithms that predict all metrics in a single fit. 
+            Rows missing any of the metrics are then dropped.
+        :type metr: str | List[str], optional
         :param test_size: Parameter for :func:`sklearn.model_selection.train_test_split`, represents proportion of dataset to include in the test split, defaults to 0.3.
         :type test_size: float, optional
         :param rs: The random seed, defaults to 32.
         :type rs: int, optional
         :param verbose: Should print, defaults to False.
         :type verbose: bool, optional
+        :param n_jobs: The total parallel jobs for hyperparameter search cross-validation, defaults to -1, meaning all cores.
+        :type n_jobs: int, optional
+        :param search_config: The hyperparameter search strategy & its settings, defaults to None, meaning an exhaustive grid search. See :meth:`search_cv()`
+        :type search_config: dict | None, optional
+        :param uncertainty_config: The random forest uncertainty stage settings, with the keys `enabled` (default True), 
+            `calibrate` (default True), `chunk_size` & `memory_limit` (in MB). See :func:`fs_forest_pred_var()`. Defaults to None, meaning the defaults.
+        :type uncertainty_config: dict | None, optional
+        :param compact_forest: The floating point type, 'float32' or 'float64', of a compact copy of each random forest saved next to the algorithm. 
+            See :class:`CompactForest`. Defaults to None, meaning no compact copy.
+        :type compact_forest: str | None, optional
+        :param writer: The background writer of the saved algorithms, which the caller must flush or close. 
+            Defaults to None, meaning algorithms are written before :meth:`save_algos()` returns.
+        :type writer: ArtifactWriter | None, optional
         """
         # class args
         self.df = df
@@ -444,13 +2118,22 @@ class AlgoTrainEval:
         self.algo_config = algo_config
         self.dir_out_alg_ds = dir_out_alg_ds
         self.metric = metr
+        self.multi_output = not isinstance(metr, str)
+        self.metrics = list(metr) if self.multi_output else [metr]
         self.test_size = test_size
         self.rs = rs
         self.dataset_id = dataset_id
         self.verbose = verbose
+        self.n_jobs = n_jobs
+        self.search_config = dict(search_config or {})
+        self.uncertainty_config = dict(uncertainty_config or {})
+        self.compact_forest = compact_forest
+        self.writer = writer
 
 
-        # train/test split
+        # train/test split, with row positions in df
+        self.idx_train = np.array([], dtype=int)
+        self.idx_test = np.array([], dtype=int)
         self.X_train = pd.DataFrame()
         self.X_test = pd.DataFrame()
         self.y_train = pd.Series()
@@ -472,24 +2155,38 @@ class AlgoTrainEval:
     def split_data(self):
         """Split dataframe into training and testing predictors (X) and response (y) variables using :func:`sklearn.model_selection.train_test_split`
 
+        The split is performed on row positions, recorded in `idx_train` and `idx_test`, so that `df` may be 
+        a dataset-level frame containing every metric & shared by all metrics without being copied. 
+        Only the training & testing subsets of the attributes and the metric(s) of interest are materialized.
         """
         
         if self.verbose:
             print(f"      Performing train/test split as {round(1-self.test_size,2)}/{self.test_size}")
 
-        # Check for NA values first
-        self.df_non_na = self.df[self.attrs + [self.metric]].dropna()
-        if self.df_non_na.shape[0] < self.df.shape[0]:
+        # Check for NA values first, one column at a time to avoid copying the attribute table
+        is_valid = np.ones(self.df.shape[0], dtype=bool)
+        for col in list(self.attrs) + self.metrics:
+            is_valid &= self.df[col].notna().to_numpy()
+        idx_valid = np.flatnonzero(is_valid)
+        if len(idx_valid) < self.df.shape[0]:
             warnings.warn(f"\
                 \n   !!!!!!!!!!!!!!!!!!!\
                 \n   NA VALUES FOUND IN INPUT DATASET!! \
-                \n   DROPPING {self.df.shape[0] - self.df_non_na.shape[0]} ROWS OF DATA. \
+                \n   DROPPING {self.df.shape[0] - len(idx_valid)} ROWS OF DATA. \
                 \n   !!!!!!!!!!!!!!!!!!!",UserWarning)
             
-
-        X = self.df_non_na[self.attrs]
-        y = self.df_non_na[self.metric]
-        self.X_train, self.X_test, self.y_train, self.y_test = train_test_split(X,y, test_size=self.test_size, random_state=self.rs)
+        self.idx_train, self.idx_test = train_test_split(idx_valid, test_size=self.test_size, random_state=self.rs)
+
+        pos_attrs = self.df.columns.get_indexer(self.attrs)
+        self.X_train = self.df.iloc[self.idx_train, pos_attrs]
+        self.X_test = self.df.iloc[self.idx_test, pos_attrs]
+        if self.multi_output:
+            pos_metrs = self.df.columns.get_indexer(self.metrics)
+            self.y_train = self.df.iloc[self.idx_train, pos_metrs]
+            self.y_test = self.df.iloc[self.idx_test, pos_metrs]
+        else:
+            self.y_train = self.df[self.metric].iloc[self.idx_train]
+            self.y_test = self.df[self.metric].iloc[self.idx_test]
 
     
     def convert_to_list(self,d:dict) ->dict:
@@ -572,28 +2269,10 @@ class AlgoTrainEval:
                                        )
             pipe_rf = make_pipeline(rf)                           
             pipe_rf.fit(self.X_train, self.y_train)
-            
-            # --- Make predictions using the RandomForest model ---
-            y_pred_rf = rf.predict(self.X_test)
-
-            # --- Inserting forestci for uncertainty calculation ---
-            ci = fci.random_forest_error(
-                forest=rf,
-                X_train_shape=self.X_train.shape,
-                X_test=self.X_test,  # Assuming X contains test samples
-                inbag=None, 
-                calibrate=True, 
-                memory_constrained=False, 
-                memory_limit=None, 
-                y_output=0  # Change this if multi-output
-            )
-            # ci now contains the confidence intervals for each prediction
-            
-            # --- Compare predictions with confidence intervals ---
-            print("Predictions using RandomForest model:", y_pred_rf)
-            print("Confidence intervals (ci) for predictions:", ci)
+            # Uncertainty is estimated alongside prediction. See predict_algos()
             self.algs_dict['rf'] = {'algo': rf,
                                     'pipeline': pipe_rf,
+                                    'inbag': fs_calc_inbag(rf, self.X_train.shape[0]),
                                     'type': 'random forest regressor',
                                     'metric': self.metric}
 
@@ -620,8 +2299,48 @@ class AlgoTrainEval:
                                      'metric': self.metric}
 
    
+    def search_cv(self, pipe, param_grid: dict):
+        """Create the hyperparameter search for a pipeline based on `search_config['strategy']`:
+
+            - `grid`: :class:`sklearn.model_selection.GridSearchCV`, the exhaustive default
+            - `halving`: :class:`sklearn.model_selection.HalvingGridSearchCV`, successive halving that drops low performers 
+              after evaluating them on small fractions of the training data. Optional `factor` & `min_resources` settings.
+            - `random`: :class:`sklearn.model_selection.RandomizedSearchCV` sampling `n_iter` candidates, default 10.
+            - `budget`: :class:`BudgetSearchCV` evaluating random candidates until `max_fits` and/or `max_time` (seconds) are reached.
+
+        Every strategy also accepts `cv` (default 5) & `scoring` (default 'neg_mean_absolute_error'). 
+        When `rf_n_estimators_sweep` is 'oob' or 'cv' & `n_estimators` is the only tuned random forest 
+        hyperparameter, :class:`ForestSizeSweep` tunes the random forest instead. 
+        The returned object exposes `best_params_`, `best_estimator_` & `cv_results_` as GridSearchCV does.
+
+        :param pipe: The pipeline whose hyperparameters are searched
+        :type pipe: sklearn.pipeline.Pipeline
+        :param param_grid: The hyperparameter values, keyed by pipeline parameter name
+        :type param_grid: dict
+        :raises ValueError: When the strategy is not recognized
+        :return: The unfitted hyperparameter search
+        :rtype: GridSearchCV | HalvingGridSearchCV | RandomizedSearchCV | BudgetSearchCV
+        """
+        cfg = self.search_config
+        strategy = cfg.get('strategy', 'grid')
+        kwargs = dict(cv=cfg.get('cv', 5), scoring=cfg.get('scoring', 'neg_mean_absolute_error'), n_jobs=self.n_jobs)
+        if strategy == 'grid':
+            return GridSearchCV(pipe, param_grid, **kwargs)
+        elif strategy == 'halving':
+            return HalvingGridSearchCV(pipe, param_grid, factor=cfg.get('factor', 3),
+                                       min_resources=cfg.get('min_resources', 'exhaust'),
+                                       random_state=self.rs, **kwargs)
+        elif strategy == 'random':
+            return RandomizedSearchCV(pipe, param_grid, n_iter=cfg.get('n_iter', 10),
+                                      random_state=self.rs, **kwargs)
+        elif strategy == 'budget':
+            return BudgetSearchCV(pipe, param_grid, max_fits=cfg.get('max_fits'),
+                                  max_time=cfg.get('max_time'), random_state=self.rs, **kwargs)
+        raise ValueError(f"Unrecognized hyperparameter search strategy '{strategy}'. \
+                         Expected one of 'grid', 'halving', 'random', 'budget'")
+
     def train_algos_grid_search(self):
-        """Train algorithms using GridSearchCV based on the algo config file.
+        """Train algorithms using a hyperparameter search based on the algo config file. See :meth:`search_cv()`
         
         Algorithm options include the following:
         
@@ -638,11 +2357,19 @@ class AlgoTrainEval:
                 'randomforestregressor__n_estimators': self.algo_config_grid['rf'].get('n_estimators', [100, 200, 300])
             }
             pipe_rf = make_pipeline(rf)
-            grid_rf = GridSearchCV(pipe_rf, param_grid_rf, cv=5, scoring='neg_mean_absolute_error', n_jobs=-1)
+            rf_sweep = self.search_config.get('rf_n_estimators_sweep')
+            if rf_sweep and list(param_grid_rf.keys()) == ['randomforestregressor__n_estimators']:
+                # Grow a single forest through all n_estimators values
+                grid_rf = ForestSizeSweep(param_grid_rf['randomforestregressor__n_estimators'], scoring=rf_sweep,
+                                          cv=self.search_config.get('cv', 5), random_state=self.rs, n_jobs=self.n_jobs)
+            else:
+                grid_rf = self.search_cv(pipe_rf, param_grid_rf)
             grid_rf.fit(self.X_train, self.y_train)
-            self.algs_dict['rf'] = {'algo': grid_rf.best_estimator_.named_steps['randomforestregressor'],
+            rf_best = grid_rf.best_estimator_.named_steps['randomforestregressor']
+            self.algs_dict['rf'] = {'algo': rf_best,
                                     'pipeline': grid_rf.best_estimator_,
                                     'gridsearchcv': grid_rf,
+                                    'inbag': fs_calc_inbag(rf_best, self.X_train.shape[0]),
                                     'type': 'random forest regressor',
                                     'metric': self.metric}
 
@@ -660,7 +2387,7 @@ class AlgoTrainEval:
                 'mlpregressor__max_iter': mlpcfg.get('max_iter', [200, 300])
             }
             pipe_mlp = make_pipeline(StandardScaler(), mlp)
-            grid_mlp = GridSearchCV(pipe_mlp, param_grid_mlp, cv=5, scoring='neg_mean_absolute_error', n_jobs=-1)
+            grid_mlp = self.search_cv(pipe_mlp, param_grid_mlp)
             grid_mlp.fit(self.X_train, self.y_train)
             self.algs_dict['mlp'] = {'algo': grid_mlp.best_estimator_,
                                     'pipeline': grid_mlp,
@@ -670,13 +2397,17 @@ class AlgoTrainEval:
     def predict_algos(self) -> dict:
         """ Make predictions with trained algorithms   
 
+        When the uncertainty stage is enabled (see `uncertainty_config`), random forest predictions & 
+        their forestci variance come from a single chunked pass over the trees, 
+        see :func:`fs_forest_pred_var()`. The variance is stored in `algs_dict[algo]['ci']`.
+
         :return: Evaluation results, with the following keys:
             - `y_pred`: The predicted values vector
             - `type`: The type of algorithm used for prediction (e.g. `"random forest"`)
             - `metric`: The formulation evaluation metric or hydrologic signature represented by `y_pred`
         :rtype: dict
         """
-          
+        unc_cfg = self.uncertainty_config
         for k, v in self.algs_dict.items():
             algo = v['algo']
             pipe = v['pipeline']
@@ -684,7 +2415,18 @@ class AlgoTrainEval:
             if self.verbose:
                 print(f"      Generating predictions for {type_algo} algorithm.")   
             
-            y_pred = pipe.predict(self.X_test)
+            if unc_cfg.get('enabled', True) and isinstance(algo, RandomForestRegressor):
+                if self.verbose:
+                    print(f"      Estimating forestci uncertainty for {type_algo} algorithm.")
+                y_pred, ci = fs_pipe_pred_var(pipe, self.X_test, inbag=v.get('inbag'),
+                                              n_train=self.X_train.shape[0],
+                                              calibrate=unc_cfg.get('calibrate', True),
+                                              chunk_size=unc_cfg.get('chunk_size'),
+                                              memory_limit=unc_cfg.get('memory_limit'),
+                                              random_state=self.rs)
+                self.algs_dict[k]['ci'] = ci
+            else:
+                y_pred = pipe.predict(self.X_test)
             self.preds_dict[k] = {'y_pred': y_pred,
                              'type': v['type'],
                              'metric': v['metric']}
@@ -706,22 +2448,37 @@ class AlgoTrainEval:
         # TODO add more evaluation metrics here
         for k, v in self.preds_dict.items():
             y_pred = v['y_pred']
-            self.eval_dict[k] = {'type': v['type'],
-                            'metric': v['metric'],
-                            'mse': mean_squared_error(self.y_test, y_pred),
-                            'r2': r2_score(self.y_test, y_pred)}
+            if not self.multi_output:
+                self.eval_dict[k] = {'type': v['type'],
+                                'metric': v['metric'],
+                                'mse': mean_squared_error(self.y_test, y_pred),
+                                'r2': r2_score(self.y_test, y_pred)}
+                continue
+            # One evaluation per metric, keyed by (algo, metric)
+            for i, metr in enumerate(self.metrics):
+                self.eval_dict[(k, metr)] = {'type': v['type'],
+                                'metric': metr,
+                                'mse': mean_squared_error(self.y_test[metr], y_pred[:, i]),
+                                'r2': r2_score(self.y_test[metr], y_pred[:, i])}
         return self.eval_dict
 
     def save_algos(self):
         """ Write pipeline to file & record save path in `algs_dict['loc_pipe']`
 
+        A multi-output algorithm is written once, using 'multioutput' in place of the metric name. 
+        Each metric then receives a lightweight file referencing the shared algorithm, 
+        with its save path recorded in `algs_dict['loc_pipe_metric']`. See :func:`fs_load_algo()`.
+        When `compact_forest` is set, random forests are also saved as a :class:`CompactForest`, 
+        with the save path recorded in `algs_dict['loc_compact']`. 
+        With a `writer`, the files are written in the background & the paths are recorded immediately.
         """
         
         for algo in self.algs_dict.keys():
             if self.verbose:
                 print(f"      Saving {algo} pipeline for {self.metric} to file")
 
-            path_algo = std_algo_path(self.dir_out_alg_ds, algo, self.metric, self.dataset_id)
+            metr_path = 'multioutput' if self.multi_output else self.metric
+            path_algo = std_algo_path(self.dir_out_alg_ds, algo, metr_path, self.dataset_id)
             # basename_alg_ds_metr = f'algo_{algo}_{self.metric}__{self.dataset_id}'
             # path_algo = Path(self.dir_out_alg_ds) / Path(basename_alg_ds_metr + '.joblib')
             
@@ -731,25 +2488,56 @@ class AlgoTrainEval:
             # --- Modified part: Combine rf model and ci into a single dictionary ---
             pipeline_with_ci = {
             'model': self.algs_dict[algo]['pipeline'],   # The trained model (Random Forest or other algorithm)
-            'confidence_intervals': self.algs_dict[algo].get('ci')  # The ci object if it exists
+            'confidence_intervals': self.algs_dict[algo].get('ci'),  # The ci object if it exists
+            'n_train': self.X_train.shape[0], # Needed to rebuild the in-bag samples for prediction uncertainty
+            'inbag': self.algs_dict[algo].get('inbag') # The random forest's in-bag counts if they exist
             }
+            if self.multi_output:
+                pipeline_with_ci['metrics'] = self.metrics
             
             # Save the combined pipeline (model + ci) using joblib
-            joblib.dump(pipeline_with_ci, path_algo)
+            self._write(joblib.dump, pipeline_with_ci, path_algo)
             
             self.algs_dict[algo]['loc_pipe'] = str(path_algo)
+
+            if self.compact_forest and isinstance(self.algs_dict[algo]['algo'], RandomForestRegressor):
+                path_compact = std_compact_forest_path(path_algo)
+                forest = CompactForest.from_forest(self.algs_dict[algo]['algo'], dtype=self.compact_forest,
+                                                   inbag=self.algs_dict[algo].get('inbag'))
+                self._write(forest.save, path_compact)
+                self.algs_dict[algo]['loc_compact'] = str(path_compact)
+
+            if self.multi_output: # The per-metric references to the multi-output algorithm
+                self.algs_dict[algo]['loc_pipe_metric'] = dict()
+                for metr in self.metrics:
+                    path_algo_metr = std_algo_path(self.dir_out_alg_ds, algo, metr, self.dataset_id)
+                    self._write(joblib.dump, {'model': None, 'confidence_intervals': None, 'metrics': self.metrics,
+                                              'metric': metr, 'path_model': str(path_algo)}, path_algo_metr)
+                    self.algs_dict[algo]['loc_pipe_metric'][metr] = str(path_algo_metr)
    
+    def _write(self, func: Callable, *args):
+        if self.writer is not None:
+            self.writer.submit(func, *args)
+        else:
+            func(*args)
+
     def org_metadata_alg(self):
         """Must be called after running AlgoTrainEval.save_algos(). Records saved location of trained algorithm
 
         """
 
-        self.eval_df = pd.DataFrame(self.eval_dict).transpose().rename_axis(index='algorithm')
+        self.eval_df = pd.DataFrame.from_dict(self.eval_dict, orient='index')
+        algs = [k[0] if isinstance(k, tuple) else k for k in self.eval_dict.keys()]
+        self.eval_df.index = pd.Index(algs, name='algorithm')
 
         self.eval_df['dataset'] = self.dataset_id
 
         # Assign the locations where algorithms were saved
-        self.eval_df['loc_pipe'] = [self.algs_dict[alg]['loc_pipe'] for alg in self.algs_dict.keys()] 
+        if self.multi_output:
+            self.eval_df['loc_pipe'] = [self.algs_dict[alg]['loc_pipe_metric'][metr]
+                                        for alg, metr in self.eval_dict.keys()]
+        else:
+            self.eval_df['loc_pipe'] = [self.algs_dict[alg]['loc_pipe'] for alg in self.algs_dict.keys()] 
         self.eval_df['algo'] = self.eval_df.index
         self.eval_df = self.eval_df.reset_index()
     
@@ -783,3 +2571,260 @@ class AlgoTrainEval:
         # Generate metadata dataframe
         self.org_metadata_alg() # Must be called after save_algos()
         
+
+# %% PARALLEL TRAINING
+def _cpu_budget(n_tasks: int, n_cores: int | None = None, n_outer: int | None = None,
+                n_fits: int | None = None) -> dict:
+    """Split a core budget between concurrent training units, the cross-validation 
+    jobs inside each unit, and the BLAS threads inside each job. 
+    The cores left over once every cross-validation fit has a job go to BLAS threads.
+
+    :param n_tasks: The total training units
+    :type n_tasks: int
+    :param n_cores: The total cores available, defaults to None, meaning :func:`os.cpu_count()`
+    :type n_cores: int | None, optional
+    :param n_outer: The total training units run concurrently, defaults to None, meaning as many as `n_cores` allows
+    :type n_outer: int | None, optional
+    :param n_fits: The most cross-validation fits a unit runs at once, defaults to None, meaning unbounded. 
+        See :func:`_unit_n_fits()`
+    :type n_fits: int | None, optional
+    :return: dict with the keys `n_outer`, `n_jobs_inner`, and `n_threads_blas`
+    :rtype: dict
+    """
+    n_cores = max(1, n_cores or os.cpu_count() or 1)
+    n_outer = max(1, min(n_tasks, n_outer or n_cores, n_cores))
+    n_jobs_inner = max(1, min(n_cores // n_outer, n_fits or n_cores))
+    n_threads_blas = max(1, n_cores // (n_outer * n_jobs_inner))
+    return {'n_outer': n_outer, 'n_jobs_inner': n_jobs_inner, 'n_threads_blas': n_threads_blas}
+
+def _unit_n_fits(kwargs_ate: dict) -> int:
+    """The most cross-validation fits that any hyperparameter search of a training unit runs at once, 
+    i.e. the candidates times the folds, beyond which more cross-validation jobs would sit idle. 
+    See :meth:`AlgoTrainEval.search_cv()`
+
+    :param kwargs_ate: The keyword arguments to :class:`AlgoTrainEval`
+    :type kwargs_ate: dict
+    :return: The total fits, at least 1
+    :rtype: int
+    """
+    cfg = kwargs_ate.get('search_config') or dict()
+    cv = cfg.get('cv', 5)
+    n_fits = 1
+    for alg_ls in kwargs_ate['algo_config'].values():
+        alg_ls = alg_ls if isinstance(alg_ls, list) else [alg_ls]
+        # As in AlgoTrainEval.select_algs_grid_search(), params with multiple values are searched
+        n_cands = int(np.prod([len(v) if isinstance(v, Iterable) and not isinstance(v, str) else 1
+                               for alg_dict in alg_ls for v in alg_dict.values()]))
+        if n_cands == 1: # A single fit, without a search
+            continue
+        strategy = cfg.get('strategy', 'grid')
+        if strategy == 'budget': # Candidates are cross-validated one at a time
+            n_fits = max(n_fits, cv)
+        elif strategy == 'random':
+            n_fits = max(n_fits, min(cfg.get('n_iter', 10), n_cands)*cv)
+        else:
+            n_fits = max(n_fits, n_cands*cv)
+    return n_fits
+
+def _train_eval_unit(kwargs_ate: dict, n_jobs_inner: int, n_threads_blas: int,
+                     fingerprint: str | None = None, writer: ArtifactWriter | None = None,
+                     write_queue_size: int | None = None) -> pd.DataFrame:
+    """Train & evaluate a single (dataset, metric) unit within its share of the core budget
+
+    :param kwargs_ate: The keyword arguments to :class:`AlgoTrainEval`. Its `df` may instead be 
+        the path to a parquet file of the data, read here.
+    :type kwargs_ate: dict
+    :param n_jobs_inner: The total cross-validation jobs
+    :type n_jobs_inner: int
+    :param n_threads_blas: The total BLAS/OpenMP threads per job
+    :type n_threads_blas: int
+    :param fingerprint: The unit's input fingerprint, recorded with its evaluation summary & the paths of all its 
+        saved files at :func:`std_unit_eval_path()`. Defaults to None, meaning nothing is recorded. See :func:`fs_unit_fingerprint()`
+    :type fingerprint: str | None, optional
+    :param writer: The background writer of the unit's files, which the caller must flush or close. 
+        Defaults to None, meaning the files are written before returning
+    :type writer: ArtifactWriter | None, optional
+    :param write_queue_size: Without a `writer`, the `max_queue` of an :class:`ArtifactWriter` of the unit's own, 
+        which completes all writes before returning. Defaults to None, meaning the files are written synchronously
+    :type write_queue_size: int | None, optional
+    :return: The unit's evaluation summary, `AlgoTrainEval.eval_df`
+    :rtype: pd.DataFrame
+    """
+    if isinstance(kwargs_ate['df'], (str, os.PathLike)):
+        kwargs_ate = {**kwargs_ate, 'df': pd.read_parquet(kwargs_ate['df'])}
+    # A writer of the unit's own is closed, completing its writes, before the unit returns
+    own_writer = writer is None and write_queue_size
+    with (ArtifactWriter(max_queue=write_queue_size) if own_writer else contextlib.nullcontext(writer)) as writer:
+        with threadpool_limits(limits=n_threads_blas), \
+            joblib.parallel_backend('loky', inner_max_num_threads=n_threads_blas):
+            train_eval = AlgoTrainEval(**kwargs_ate, n_jobs=n_jobs_inner, writer=writer)
+            train_eval.train_eval()
+        if fingerprint: # Written last, after the unit's algorithms, so that only completed units are skipped
+            train_eval._write(_write_unit_eval, train_eval.eval_df, _unit_eval_path(kwargs_ate), fingerprint,
+                              _unit_artifacts(train_eval.algs_dict))
+    return train_eval.eval_df
+
+def _hash_cols(df: pd.DataFrame, cols: Iterable[str]) -> str:
+    # One column at a time, to avoid copying the dataset-level frame. The index, e.g. the comids, is hashed too
+    h = hashlib.sha256()
+    for col in cols:
+        h.update(str(col).encode())
+        h.update(pd.util.hash_pandas_object(df[col], index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+def fs_unit_fingerprint(kwargs_ate: dict) -> str:
+    """Fingerprint the inputs of a training unit: the attribute data, the response data, 
+    the algorithm, search, uncertainty & compact forest configs, the seed and the test size. 
+    Settings that do not change the trained algorithms, e.g. `verbose` & `n_jobs`, are excluded.
+
+    :param kwargs_ate: The keyword arguments to :class:`AlgoTrainEval`
+    :type kwargs_ate: dict
+    :return: A sha256 hex digest
+    :rtype: str
+    """
+    metr = kwargs_ate['metr']
+    metrics = [metr] if isinstance(metr, str) else list(metr)
+    df = kwargs_ate['df']
+    if isinstance(df, (str, os.PathLike)): # Only the fingerprinted columns are read
+        df = pd.read_parquet(df, columns=list(kwargs_ate['attrs']) + metrics)
+    inputs = {'attrs': _hash_cols(df, kwargs_ate['attrs']),
+              'response': _hash_cols(df, metrics),
+              'metr': metr,
+              'algo_config': kwargs_ate['algo_config'],
+              'search_config': kwargs_ate.get('search_config'),
+              'uncertainty_config': kwargs_ate.get('uncertainty_config'),
+              'compact_forest': kwargs_ate.get('compact_forest'),
+              'rs': kwargs_ate.get('rs', 32),
+              'test_size': kwargs_ate.get('test_size', 0.3)}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+def _unit_eval_path(kwargs_ate: dict) -> Path:
+    metr = kwargs_ate['metr']
+    return std_unit_eval_path(kwargs_ate['dir_out_alg_ds'], metr if isinstance(metr, str) else 'multioutput',
+                              kwargs_ate['dataset_id'])
+
+def _unit_artifacts(algs_dict: dict) -> List[str]:
+    # Every file a unit's algorithms were saved to: the algorithm, any per-metric references to a 
+    # multi-output algorithm, & any compact forest. See AlgoTrainEval.save_algos()
+    paths = list()
+    for v in algs_dict.values():
+        paths += [v['loc_pipe'], *v.get('loc_pipe_metric', dict()).values()]
+        if v.get('loc_compact'):
+            paths.append(v['loc_compact'])
+    return paths
+
+def _write_unit_eval(eval_df: pd.DataFrame, path: Path, fingerprint: str, paths_artifact: List[str] | None = None):
+    # Written to a temporary file then renamed, so an interrupted write is never mistaken for a completed unit
+    table = pa.Table.from_pandas(eval_df)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'fs_fingerprint': fingerprint.encode(),
+                                           b'fs_artifacts': json.dumps(paths_artifact or list()).encode()})
+    path_tmp = path.with_name(path.name + '.tmp')
+    pq.write_table(table, path_tmp)
+    os.replace(path_tmp, path)
+
+def _read_unit_eval(path: Path, fingerprint: str) -> pd.DataFrame | None:
+    """Read a training unit's evaluation summary when its inputs are unchanged & its algorithms still exist
+
+    :return: The unit's evaluation summary, otherwise None
+    :rtype: pd.DataFrame | None
+    """
+    if not path.exists():
+        return None
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+        if metadata.get(b'fs_fingerprint', b'').decode() != fingerprint:
+            return None
+        eval_df = pd.read_parquet(path)
+        # The per-metric references of a multi-output algorithm are small, so the shared algorithm is checked too
+        paths_artifact = json.loads(metadata.get(b'fs_artifacts', b'[]').decode())
+    except (OSError, pa.ArrowException, ValueError) as e:
+        warnings.warn(f"Could not read {path}, retraining the unit: {e}", UserWarning)
+        return None
+    if not all(Path(p).exists() for p in [*eval_df['loc_pipe'], *paths_artifact]):
+        return None
+    return eval_df
+
+def fs_train_eval_units(units: Dict[tuple, dict], n_cores: int | None = None,
+                        n_outer: int | None = None, verbose: bool = False,
+                        resume: bool = False, writer: ArtifactWriter | None = None,
+                        write_queue_size: int | None = None) -> Dict[tuple, pd.DataFrame]:
+    """Run (dataset, metric) training units in a process pool that shares a single core budget. 
+    See :func:`_cpu_budget()`.
+
+    Each completed unit records its input fingerprint & saved files alongside its evaluation summary. 
+    With `resume`, a unit whose fingerprint matches the record, & whose saved files all still exist, is skipped 
+    and its evaluation summary reloaded. An interrupted run, with or without `resume`, thereby resumes 
+    after its last completed unit when rerun with `resume`.
+
+    :param units: The keyword arguments to :class:`AlgoTrainEval` for each unit, keyed by e.g. (dataset_id, metric). 
+        Units may share the same `df`, which is then passed to concurrent units' processes only once. 
+        A `df` may also be the path to a parquet file of the data, read only while its unit trains.
+    :type units: Dict[tuple, dict]
+    :param n_cores: The total cores available, defaults to None, meaning :func:`os.cpu_count()`
+    :type n_cores: int | None, optional
+    :param n_outer: The total training units run concurrently, defaults to None, meaning as many as `n_cores` allows
+    :type n_outer: int | None, optional
+    :param verbose: Should print progress, defaults to False
+    :type verbose: bool, optional
+    :param resume: Should units with unchanged inputs be skipped? See :func:`fs_unit_fingerprint()`. Defaults to False
+    :type resume: bool, optional
+    :param writer: The background writer of the units' files when units run one at a time, which the caller must 
+        flush or close, so that writing overlaps the next unit's training. Concurrent units instead use `write_queue_size`. 
+        Defaults to None
+    :type writer: ArtifactWriter | None, optional
+    :param write_queue_size: The `max_queue` of the :class:`ArtifactWriter` each unit creates when there is no `writer`, 
+        e.g. for each concurrent unit in its own process. The unit completes its writes before returning. 
+        Defaults to None, meaning each unit's files are written synchronously
+    :type write_queue_size: int | None, optional
+    :return: Each unit's evaluation summary, `AlgoTrainEval.eval_df`, keyed the same as `units`
+    :rtype: Dict[tuple, pd.DataFrame]
+    """
+    # Fingerprinted before training, as AlgoTrainEval modifies the algo config
+    fingerprints = {k: fs_unit_fingerprint(v) for k, v in units.items()}
+    rslt = dict()
+    if resume:
+        for k, kwargs_ate in units.items():
+            eval_df = _read_unit_eval(_unit_eval_path(kwargs_ate), fingerprints[k])
+            if eval_df is not None:
+                rslt[k] = eval_df
+        if verbose and rslt:
+            print(f"Skipping {len(rslt)} training units with unchanged inputs: {list(rslt.keys())}")
+    # Each unit gets its own copy of the algo config, which AlgoTrainEval modifies
+    units_todo = {k: {**v, 'algo_config': copy.deepcopy(v['algo_config'])} for k, v in units.items() if k not in rslt}
+
+    budget = _cpu_budget(max(1, len(units_todo)), n_cores=n_cores, n_outer=n_outer,
+                         n_fits=max([_unit_n_fits(v) for v in units_todo.values()], default=None))
+    if verbose:
+        print(f"Training {len(units_todo)} units: {budget['n_outer']} concurrent units, each with \
+              {budget['n_jobs_inner']} CV jobs of {budget['n_threads_blas']} thread(s)")
+
+    if budget['n_outer'] == 1:
+        for k, kwargs_ate in units_todo.items():
+            rslt[k] = _train_eval_unit(kwargs_ate, budget['n_jobs_inner'], budget['n_threads_blas'],
+                                       fingerprints[k], writer=writer, write_queue_size=write_queue_size)
+        return {k: rslt[k] for k in units.keys()}
+
+    # spawn, rather than fork, avoids inheriting the parent's thread pools. The executor shuts down before 
+    # the temporary directory is removed.
+    with tempfile.TemporaryDirectory(prefix='fs_algo_units_') as dir_tmp, \
+        ProcessPoolExecutor(max_workers=budget['n_outer'],
+                            mp_context=multiprocessing.get_context('spawn')) as executor:
+        # Units sharing a dataset's data, e.g. each metric's unit, would otherwise each pickle the same frame 
+        # to the workers. Each frame is instead written once, as units are submitted, and read by path.
+        paths_df = dict()
+        futures = dict()
+        for k, kwargs_ate in units_todo.items():
+            df = kwargs_ate['df']
+            if isinstance(df, pd.DataFrame):
+                if id(df) not in paths_df:
+                    paths_df[id(df)] = Path(dir_tmp)/Path(f'unit_df_{len(paths_df)}.parquet')
+                    df.to_parquet(paths_df[id(df)])
+                kwargs_ate = {**kwargs_ate, 'df': paths_df[id(df)]}
+            futures[executor.submit(_train_eval_unit, kwargs_ate, budget['n_jobs_inner'],
+                                    budget['n_threads_blas'], fingerprints[k],
+                                    write_queue_size=write_queue_size)] = k
+        for future in as_completed(futures):
+            rslt[futures[future]] = future.result()
+            if verbose:
+                print(f"   Completed training unit {futures[future]}")
+    return {k: rslt[k] for k in units.keys()}
@@ -0,0 +1,30 @@
+import argparse
+from pathlib import Path
+import fs_algo.fs_algo_train_eval as fsate
+
+"""Workflow script to compact the per-comid attribute parquet files generated by
+    proc.attr.hydfab into a small number of large parquet files, written next to the attribute directory.
+    The per-comid files are kept unless --remove_src is given.
+
+:note python fs_compact_attrs.py "/path/to/attr_config.yaml"
+
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'compact the attribute parquet files')
+    parser.add_argument('path_attr_config', type=str, help='Path to the YAML configuration file specific for attribute acquisition')
+    parser.add_argument('--max_rows_file', type=int, default=5000000, help='The approximate maximum rows per compacted file')
+    parser.add_argument('--row_group_size', type=int, default=100000, help='The total rows in each parquet row group')
+    parser.add_argument('--remove_src', action='store_true',
+                        help='Delete the per-comid files once compacted. proc.attr.hydfab re-acquires attributes for any comid whose file does not exist.')
+    args = parser.parse_args()
+
+    attr_cfig = fsate.AttrConfigAndVars(Path(args.path_attr_config))
+    attr_cfig._read_attr_config()
+    dir_db_attrs = attr_cfig.attrs_cfg_dict.get('dir_db_attrs')
+
+    print(f"BEGINNING compaction of attribute files inside \n {dir_db_attrs}")
+    rslt = fsate.fs_compact_attrs(dir_db_attrs, max_rows_file=args.max_rows_file,
+                                  row_group_size=args.row_group_size, remove_src=args.remove_src)
+    print(f"FINISHED compacting {len(rslt['paths_src'])} attribute files into {len(rslt['paths_compact'])} files \
+          inside {fsate.std_attr_compact_dir(dir_db_attrs)}")
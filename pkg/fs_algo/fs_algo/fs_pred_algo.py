@@ -1,13 +1,8 @@
 import argparse
 import yaml
-import joblib
 import fs_algo.fs_algo_train_eval as fsate
 import pandas as pd
 from pathlib import Path
-import ast
-import warnings
-import os
-import numpy as np
 
 # TODO create a function that's flexible/converts user formatted checks (a la fs_proc)
 
@@ -52,8 +47,34 @@ if __name__ == "__main__":
     #%% prediction config
     resp_vars = pred_cfg.get('algo_response_vars')
     algos = pred_cfg.get('algo_type')
-
-
+    use_attr_matrix = pred_cfg.get('use_attr_matrix', False)
+    attr_mat = None
+    if use_attr_matrix: # Build/update the COMID x attribute matrix shared by all datasets
+        attr_mat = fsate.AttrMatrixStore(dir_db_attrs)
+        attr_mat.build()
+    # The attribute file manifest, refreshed once per run rather than for each read. Already refreshed by attr_mat.build()
+    attr_manifest = fsate.fs_attr_manifest(dir_db_attrs, refresh=attr_mat is None)
+    uncertainty_cfg = pred_cfg.get('uncertainty', None) # Random forest prediction variance
+    stream_chunk_size = pred_cfg.get('stream_chunk_size', None) # Out-of-core prediction in chunks of COMIDs
+    design_cache_max_gb = pred_cfg.get('design_cache_max_gb', None)
+    design_cache = None
+    if design_cache_max_gb: # Cache of wide-format attribute data, shared with fs_proc_algo
+        design_cache = fsate.DesignMatrixCache(fsate.std_design_cache_dir(dir_base),
+                                               max_bytes=int(design_cache_max_gb*1e9))
+
+
+
+    use_compact_forest = pred_cfg.get('use_compact_forest', False)
+    if use_compact_forest and not (stream_chunk_size and stream_chunk_size <= fsate.CompactForest.FAST_BATCH_ROWS):
+        # Compact forests are only faster than the pickled random forests for small batches
+        print(f"Ignoring use_compact_forest, which requires a stream_chunk_size of at most {fsate.CompactForest.FAST_BATCH_ROWS} COMIDs")
+        use_compact_forest = False
+    # Trained algorithms are loaded on first use & the most recently used are kept in memory
+    algo_registry = fsate.AlgoRegistry(dir_out_alg_base, max_models=pred_cfg.get('max_models_loaded', 4),
+                                       mmap_mode=pred_cfg.get('algo_mmap_mode', 'r'),
+                                       use_compact_forest=use_compact_forest,
+                                       n_jobs=pred_cfg.get('n_jobs', None),
+                                       compile_mlp=pred_cfg.get('compile_mlp', None))
 
     #%% Run prediction
     for ds in datasets:
@@ -63,40 +84,40 @@ if __name__ == "__main__":
 
         comids_pred = fsate._read_pred_comid(path_pred_locs, comid_pred_col )
 
+        print(f"PREDICTING algorithm for {ds}")
+        models = dict()
+        for metric in resp_vars:
+            for algo in algos:
+                path_algo = algo_registry.path(ds, algo=algo, metric=metric) # Raises FileNotFoundError if not saved
+                models[(algo, metric)] = {'path_algo': path_algo,
+                                          'path_pred_out': fsate.std_pred_path(dir_out,algo=algo,metric=metric,dataset_id=ds)}
+
+        if stream_chunk_size: # Read attributes, predict & write results in chunks of COMIDs
+            for (algo, metric), mdl in models.items(): # Every algorithm predicts each chunk
+                mdl['algo_dict'] = algo_registry.get(ds, algo=algo, metric=metric)
+            read_attr_wide = lambda comids_chunk: fsate.fs_attr_wide(dir_db_attrs, comids_chunk, attrs_sel=attrs_sel,
+                                                                     cache=None, attr_mat=attr_mat,
+                                                                     manifest=attr_manifest)
+            fsate.fs_pred_stream(comids_pred, read_attr_wide, models, dataset_id=ds, chunk_size=stream_chunk_size,
+                                 uncertainty_cfg=uncertainty_cfg)
+            print(f"   Completed {', '.join(algos)} prediction of {', '.join(resp_vars)}")
+            continue
+
         #%%  Read in predictor variable data (aka basin attributes) 
         # Read the predictor variable data (basin attributes) generated by proc.attr.hydfab
-        df_attr = fsate.fs_read_attr_comid(dir_db_attrs, comids_pred, attrs_sel = attrs_sel,
-                                        _s3 = None,storage_options=None)
-        # Convert into wide format for model training
-        df_attr_wide = df_attr.pivot(index='featureID', columns = 'attribute', values = 'value')
+        # Wide format for prediction. Reused from the design matrix cache when inputs are unchanged.
+        df_attr_wide = fsate.fs_attr_wide(dir_db_attrs, comids_pred, attrs_sel=attrs_sel,
+                                          cache=design_cache, attr_mat=attr_mat, manifest=attr_manifest)
 
         # Run predictions & save output
-        dir_out_alg_ds = Path(dir_out_alg_base/Path(ds))
-        print(f"PREDICTING algorithm for {ds}")
-        for metric in resp_vars:
-            for algo in algos:
-                path_algo = fsate.std_algo_path(dir_out_alg_ds, algo=algo, metric=metric, dataset_id=ds)
-                if not Path(path_algo).exists():
-                    raise FileNotFoundError(f"The following algorithm path does not exist: \n{path_algo}")
-
-
-                # Read in the algorithm's pipeline
-                pipe = joblib.load(path_algo)
-                feat_names = list(pipe.feature_names_in_)
-                df_attr_sub = df_attr_wide[feat_names]
-
-                # Perform prediction
-                resp_pred = pipe.predict(df_attr_sub)
-
-                # compile prediction results:
-                df_pred =pd.DataFrame({'comid':comids_pred,
-                             'prediction':resp_pred,
-                             'metric':metric,
-                             'dataset':ds,
-                             'algo':algo,
-                             'name_algo':Path(path_algo).name})
-                
-                path_pred_out = fsate.std_pred_path(dir_out,algo=algo,metric=metric,dataset_id=ds)
-                # Write prediction results
-                df_pred.to_parquet(path_pred_out)
-                print(f"   Completed {algo} prediction of {metric}")
\ No newline at end of file
+        for (algo, metric), mdl in models.items():
+            # Read in the algorithm's pipeline
+            algo_dict = algo_registry.get(ds, algo=algo, metric=metric)
+            # Perform prediction & compile prediction results
+            df_pred = fsate.fs_pred_algo_df(algo_dict, df_attr_wide, metric=metric, dataset_id=ds,
+                                            algo=algo, name_algo=Path(mdl['path_algo']).name,
+                                            uncertainty_cfg=uncertainty_cfg)
+            # Write prediction results
+            df_pred.to_parquet(mdl['path_pred_out'])
+            print(f"   Completed {algo} prediction of {metric}")
+    print(f"Algorithm registry: {algo_registry.stats()}")
\ No newline at end of file
@@ -4,6 +4,7 @@ import pandas as pd
 from pathlib import Path
 import fs_algo.fs_algo_train_eval as fsate
 import ast
+import tempfile
 
 """Workflow script to train algorithms on catchment attribute data for predicting
     formulation metrics and/or hydrologic signatures.
@@ -31,6 +32,17 @@ if __name__ == "__main__":
     verbose = algo_cfg['verbose']
     test_size = algo_cfg['test_size']
     seed = algo_cfg['seed']
+    comid_cache_max_age_days = algo_cfg.get('comid_cache_max_age_days', None)
+    use_attr_matrix = algo_cfg.get('use_attr_matrix', False)
+    design_cache_max_gb = algo_cfg.get('design_cache_max_gb', None)
+    n_cores = algo_cfg.get('n_cores', None)
+    n_outer_tasks = algo_cfg.get('n_outer_tasks', None)
+    multi_output = algo_cfg.get('multi_output', False)
+    search_config = algo_cfg.get('hyperparam_search', None)
+    uncertainty_config = algo_cfg.get('uncertainty', None)
+    compact_forest = algo_cfg.get('compact_forest', None)
+    resume = algo_cfg.get('resume', False) # Opt-in. Skip training units whose inputs are unchanged since their last completed run
+    write_queue_size = algo_cfg.get('write_queue_size', 2) # Write artifacts in the background while training continues
 
     #%% Attribute configuration
     name_attr_config = algo_cfg.get('name_attr_config', Path(path_algo_config).name.replace('algo','attr')) 
@@ -54,8 +66,28 @@ if __name__ == "__main__":
     #%%  Generate standardized output directories
     dir_out = fsate.fs_save_algo_dir_struct(dir_base).get('dir_out')
     dir_out_alg_base = fsate.fs_save_algo_dir_struct(dir_base).get('dir_out_alg_base')
+    path_comid_cache = fsate.std_comid_cache_path(dir_base)
+    if comid_cache_max_age_days is not None: # Expired mappings are purged once per run, rather than only re-resolved
+        n_purged = fsate.NldiComidCache(path_comid_cache, max_age_days=comid_cache_max_age_days).purge_expired()
+        if verbose:
+            print(f"Purged {n_purged} expired entries from the COMID cache")
+
+    attr_mat = None
+    if use_attr_matrix: # Build/update the COMID x attribute matrix shared by all datasets
+        attr_mat = fsate.AttrMatrixStore(dir_db_attrs)
+        attr_mat.build()
+    # The attribute file manifest, refreshed once per run rather than for each dataset. Already refreshed by attr_mat.build()
+    attr_manifest = fsate.fs_attr_manifest(dir_db_attrs, refresh=attr_mat is None)
+    design_cache = None
+    if design_cache_max_gb: # Cache of wide-format attribute data, shared with fs_pred_algo
+        design_cache = fsate.DesignMatrixCache(fsate.std_design_cache_dir(dir_base),
+                                               max_bytes=int(design_cache_max_gb*1e9))
     
     # %% Looping over datasets
+    # Each dataset's joined data is written to a temporary parquet file once built, so that only 
+    # one dataset is held in memory at a time. The training units read it by path.
+    dir_tmp_units = tempfile.TemporaryDirectory(prefix='fs_proc_algo_')
+    units = dict()
     for ds in datasets: 
         print(f'PROCESSING {ds} dataset inside \n {dir_std_base}')
 
@@ -71,48 +103,78 @@ if __name__ == "__main__":
 
         # %% COMID retrieval and assignment to response variable's coordinate
         [featureSource,featureID] = fsate._find_feat_srce_id(dat_resp,attr_cfig.attr_config) # e.g. ['nwissite','USGS-{gage_id}']
-        comids_resp = fsate.fs_retr_nhdp_comids(featureSource,featureID,gage_ids=dat_resp['gage_id'].values)
+        comids_resp = fsate.fs_retr_nhdp_comids(featureSource,featureID,gage_ids=dat_resp['gage_id'].values,
+                                                path_cache=path_comid_cache,
+                                                cache_max_age_days=comid_cache_max_age_days,
+                                                verbose=verbose)
         dat_resp = dat_resp.assign_coords(comid = comids_resp)
 
         # TODO allow secondary option where featureSource and featureIDs already provided, not COMID 
 
         #%%  Read in predictor variable data (aka basin attributes) 
         # Read the predictor variable data (basin attributes) generated by proc.attr.hydfab
-        df_attr = fsate.fs_read_attr_comid(dir_db_attrs, comids_resp, attrs_sel = attrs_sel,
-                                        _s3 = None,storage_options=None)
-        # Convert into wide format for model training
-        df_attr_wide = df_attr.pivot(index='featureID', columns = 'attribute', values = 'value')
-
-    # %% Train, test, and evaluate
-        rslt_eval = dict()
-        for metr in metrics:
-            print(f' - Processing {metr}')
-            # Subset response data to metric of interest & the comid
-            df_metr_resp = pd.DataFrame({'comid': dat_resp['comid'],
-                                        metr : dat_resp[metr].data})
-            # Join attribute data and response data
-            df_pred_resp = df_metr_resp.merge(df_attr_wide, left_on = 'comid', right_on = 'featureID')
-
-            # TODO may need to add additional distinguishing strings to dataset_id, e.g. in cases of probabilistic simulation
-
-            # Instantiate the training, testing, and evaluation class
-            train_eval = fsate.AlgoTrainEval(df=df_pred_resp,
-                                        attrs=attrs_sel,
-                                        algo_config=algo_config,
-                                        dir_out_alg_ds=dir_out_alg_ds, dataset_id=ds,
-                                        metr=metr,test_size=test_size, rs = seed,
-                                        verbose=verbose)
-            train_eval.train_eval() # Train, test, eval wrapper
-            
-            # Retrieve evaluation metrics dataframe
-            rslt_eval[metr] = train_eval.eval_df
-
-        # Compile results and write to file
-        rslt_eval_df = pd.concat(rslt_eval).reset_index(drop=True)
-        rslt_eval_df['dataset'] = ds
-        rslt_eval_df.to_parquet(Path(dir_out_alg_ds)/Path('algo_eval_'+ds+'.parquet'))
-
-        print(f'... Wrote training and testing evaluation to file for {ds}')
-
+        # Wide format for model training. Reused from the design matrix cache when inputs are unchanged.
+        df_attr_wide = fsate.fs_attr_wide(dir_db_attrs, comids_resp, attrs_sel=attrs_sel,
+                                          cache=design_cache, attr_mat=attr_mat, manifest=attr_manifest)
+
+    # %% Join the response data for every metric to the attribute data, once per dataset
+        df_metr_resp = pd.DataFrame({'comid': dat_resp['comid'],
+                                     **{metr: dat_resp[metr].data for metr in metrics}})
+        df_pred_resp = df_metr_resp.merge(df_attr_wide, left_on = 'comid', right_on = 'featureID')
+        path_pred_resp = Path(dir_tmp_units.name)/Path(f'df_pred_resp_{ds}.parquet')
+        df_pred_resp.to_parquet(path_pred_resp)
+        del df_pred_resp, df_attr_wide, df_metr_resp
+
+        # TODO may need to add additional distinguishing strings to dataset_id, e.g. in cases of probabilistic simulation
+
+        # %% Define the (dataset, metric) training units, which share the dataset's joined data
+        if multi_output: # A single unit fits all metrics at once
+            units[(ds, 'multioutput')] = dict(df=path_pred_resp,
+                                              attrs=attrs_sel,
+                                              algo_config=algo_config,
+                                              dir_out_alg_ds=dir_out_alg_ds, dataset_id=ds,
+                                              metr=metrics,test_size=test_size, rs = seed,
+                                              verbose=verbose, search_config=search_config,
+                                              uncertainty_config=uncertainty_config,
+                                              compact_forest=compact_forest)
+        else:
+            for metr in metrics:
+                # The arguments for the training, testing, and evaluation class
+                units[(ds, metr)] = dict(df=path_pred_resp,
+                                         attrs=attrs_sel,
+                                         algo_config=algo_config,
+                                         dir_out_alg_ds=dir_out_alg_ds, dataset_id=ds,
+                                         metr=metr,test_size=test_size, rs = seed,
+                                         verbose=verbose, search_config=search_config,
+                                         uncertainty_config=uncertainty_config,
+                                         compact_forest=compact_forest)
         dat_resp.close()
+
+    # %% Train, test, and evaluate all units within the core budget
+    writer = fsate.ArtifactWriter(max_queue=write_queue_size) if write_queue_size else None
+    rslt_eval = fsate.fs_train_eval_units(units, n_cores=n_cores, n_outer=n_outer_tasks, verbose=verbose,
+                                           resume=resume, writer=writer, write_queue_size=write_queue_size)
+
+    # Compile results and write to file
+    for ds in datasets:
+        rslt_eval_ds = {k[1]: v for k, v in rslt_eval.items() if k[0] == ds}
+        if not rslt_eval_ds: # e.g. a dataset without any metrics
+            print(f'... No training units for the {ds} dataset, so no evaluation written')
+            continue
+        rslt_eval_df = pd.concat(rslt_eval_ds).reset_index(drop=True)
+        rslt_eval_df['dataset'] = ds
+        path_eval = Path(dir_out_alg_base/Path(ds))/Path('algo_eval_'+ds+'.parquet')
+        if writer is not None:
+            writer.submit(rslt_eval_df.to_parquet, path_eval)
+        else:
+            rslt_eval_df.to_parquet(path_eval)
+
+    if writer is not None: # Completes all writes, raising any write error
+        writer.close()
+        print(f"Wrote {writer.n_written} files in the background, taking {round(writer.seconds_writing, 1)} seconds")
+    dir_tmp_units.cleanup()
+    print(f'... Wrote training and testing evaluation to file for {datasets}')
+
+    if design_cache is not None:
+        print(f"Design matrix cache: {design_cache.stats()}")
     print("FINISHED algorithm training, testing, & evaluation")
\ No newline at end of file
@@ -17,18 +17,26 @@ if __name__ == '__main__':
 import unittest
 from unittest.mock import patch, MagicMock, mock_open
 import pandas as pd
+import numpy as np
 import dask.dataframe as dd
+import dask.base
+import pyarrow.parquet as pq
+import forestci as fci
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.neural_network import MLPRegressor
 from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_squared_error, r2_score
 import tempfile
 from pathlib import Path
 from fs_algo.fs_algo_train_eval import AlgoTrainEval, AttrConfigAndVars
 from fs_algo import fs_algo_train_eval
+from fs_algo import compact_models
 import warnings
 import xarray as xr
 import os
+import copy
 
 # %% UNIT TESTING FOR AttrConfigAndVars
 
@@ -116,8 +124,287 @@ class TestFsReadAttrComid(unittest.TestCase):
             fs_algo_train_eval.fs_read_attr_comid(dir_db_attrs=dir_db_attrs,
                                             comids_resp= comids_resp,
                                             attrs_sel= ['nonexistent'])
+
+    def test_exact_match(self):
+        # Substrings of requested featureIDs/attributes must not be returned
+        dir_db_attrs = Path(tempfile.mkdtemp())
+        for comid in ['1234', '12345']:
+            pd.DataFrame({'data_source': 'usgs',
+                          'dl_timestamp': '2024-07-26 08:59:36',
+                          'attribute': ['TOT_PET', 'TOT_PET_X'],
+                          'value': [1.0, 2.0],
+                          'featureID': comid,
+                          'featureSource': 'COMID'}
+                          ).to_parquet(dir_db_attrs/Path(f'comid_{comid}_attrs.parquet'))
+        result = fs_algo_train_eval.fs_read_attr_comid(dir_db_attrs, ['1234'], attrs_sel=['TOT_PET'])
+        self.assertEqual(result.shape[0], 1)
+        self.assertEqual(result['featureID'].iloc[0], '1234')
+        self.assertEqual(result['attribute'].iloc[0], 'TOT_PET')
+
+        # Column projection always retains the required columns
+        result = fs_algo_train_eval.fs_read_attr_comid(dir_db_attrs, [1234, 12345], attrs_sel='all',
+                                                       columns=['featureSource'])
+        self.assertEqual(set(result.columns), {'featureID', 'attribute', 'value', 'featureSource'})
+        self.assertEqual(result.shape[0], 4)
+
+        # The parquet files are only read through a single graph execution
+        with patch('dask.base.compute', wraps=dask.base.compute) as mock_compute:
+            fs_algo_train_eval.fs_read_attr_comid(dir_db_attrs, ['1234', '12345'], attrs_sel='all')
+        self.assertEqual(mock_compute.call_count, 1)
             
 
+class TestFsAttrPivot(unittest.TestCase):
+    def test_categorical_pivot(self):
+        df_attr = pd.DataFrame({'attribute': ['pet_mm_s01', 'cly_pc_sav', 'pet_mm_s01', 'cly_pc_sav', 'ari_ix_sav'],
+                                'value': [58., 21., 65., 32., 1.],
+                                'featureID': ['1623207', '1623207', '1520007', '1520007', '1623207']})
+        df_cat = fs_algo_train_eval._categorize_attr_df(df_attr.copy())
+        self.assertIsInstance(df_cat['featureID'].dtype, pd.CategoricalDtype)
+        self.assertIsInstance(df_cat['attribute'].dtype, pd.CategoricalDtype)
+        # Categories already present, e.g. in file order from a parquet dictionary, are sorted
+        df_recat = fs_algo_train_eval._categorize_attr_df(df_attr.astype({'attribute': pd.CategoricalDtype(
+            ['pet_mm_s01', 'cly_pc_sav', 'ari_ix_sav', 'unused'])}))
+        self.assertListEqual(df_recat['attribute'].cat.categories.tolist(), ['ari_ix_sav', 'cly_pc_sav', 'pet_mm_s01'])
+
+        df_wide = fs_algo_train_eval.fs_attr_pivot(df_cat)
+        pd.testing.assert_frame_equal(df_wide, df_attr.pivot(index='featureID', columns='attribute', values='value'))
+
+        with self.assertRaises(ValueError):
+            fs_algo_train_eval.fs_attr_pivot(pd.concat([df_attr, df_attr.iloc[[0]]]))
+
+class TestFsAttrManifest(unittest.TestCase):
+    def setUp(self):
+        self.dir_db_attrs = Path(tempfile.mkdtemp())/Path('attributes')
+        self.dir_db_attrs.mkdir()
+        for comid in ['1520007', '1623207']:
+            self._write_comid(comid)
+
+    def _write_comid(self, comid, attrs=['pet_mm_s01', 'cly_pc_sav']):
+        pd.DataFrame({'data_source': 'hydroatlas__v1',
+                      'dl_timestamp': '2024-07-26 08:59:36',
+                      'attribute': attrs,
+                      'value': range(len(attrs)),
+                      'featureID': comid,
+                      'featureSource': 'COMID'}
+                      ).to_parquet(self.dir_db_attrs/Path(f'comid_{comid}_attrs.parquet'))
+
+    def test_build_and_refresh(self):
+        manifest = fs_algo_train_eval.fs_attr_manifest(self.dir_db_attrs)
+        self.assertTrue(fs_algo_train_eval.std_attr_manifest_path(self.dir_db_attrs).exists())
+        self.assertEqual(set(manifest['featureID']), {'1520007', '1623207'})
+        self.assertListEqual(manifest['n_rows'].tolist(), [2, 2])
+        self.assertEqual(manifest['attributes'].iloc[0], 'cly_pc_sav|pet_mm_s01')
+
+        # Only new files are opened during a refresh
+        self._write_comid('1722317', attrs=['pet_mm_s01'])
+        with patch('fs_algo.fs_algo_train_eval._attr_manifest_entries',
+                   wraps=fs_algo_train_eval._attr_manifest_entries) as mock_read:
+            manifest = fs_algo_train_eval.fs_attr_manifest(self.dir_db_attrs)
+        self.assertEqual(mock_read.call_count, 1)
+        self.assertEqual(manifest.shape[0], 3)
+
+        # Removed files are dropped
+        Path(self.dir_db_attrs/Path('comid_1520007_attrs.parquet')).unlink()
+        manifest = fs_algo_train_eval.fs_attr_manifest(self.dir_db_attrs)
+        self.assertEqual(set(manifest['featureID']), {'1623207', '1722317'})
+
+    def test_read_attr_comid_manifest(self):
+        with patch('fs_algo.fs_algo_train_eval.dd.read_parquet', wraps=dd.read_parquet) as mock_read:
+            result = fs_algo_train_eval.fs_read_attr_comid(self.dir_db_attrs, ['1623207'], use_manifest=True)
+        self.assertIsInstance(result['attribute'].dtype, pd.CategoricalDtype)
+        # Decoded to categoricals by the parquet reader, rather than converted after computing
+        self.assertListEqual(mock_read.call_args[1]['categories'], ['featureID', 'attribute'])
+        self.assertEqual(len(mock_read.call_args[0][0]), 1)
+        self.assertIn('comid_1623207_attrs.parquet', mock_read.call_args[0][0][0])
+        self.assertListEqual(result['featureID'].unique().tolist(), ['1623207'])
+
+        with self.assertWarns(UserWarning):
+            result = fs_algo_train_eval.fs_read_attr_comid(self.dir_db_attrs, ['010101010'], use_manifest=True)
+        self.assertEqual(result.shape[0], 0)
+
+class TestFsCompactAttrs(unittest.TestCase):
+    def setUp(self):
+        self.dir_db_attrs = Path(tempfile.mkdtemp())/Path('attributes')
+        self.dir_db_attrs.mkdir()
+        for comid in ['1623207', '1520007', '1722317']:
+            self._write_comid(comid)
+
+    _write_comid = TestFsAttrManifest._write_comid
+
+    def _read_sorted(self, comids, **kwargs):
+        df = fs_algo_train_eval.fs_read_attr_comid(self.dir_db_attrs, comids, **kwargs)
+        return df.sort_values(['featureID', 'attribute']).reset_index(drop=True)
+
+    def test_compact(self):
+        df_orig = self._read_sorted(['1520007', '1623207'])
+        rslt = fs_algo_train_eval.fs_compact_attrs(self.dir_db_attrs, row_group_size=2)
+        self.assertEqual(len(rslt['paths_src']), 3)
+        # The per-comid files are kept for proc.attr.hydfab, & the compacted files live outside dir_db_attrs
+        self.assertEqual(len(list(self.dir_db_attrs.glob('comid_*_attrs.parquet'))), 3)
+        self.assertEqual(rslt['paths_compact'][0].parent, fs_algo_train_eval.std_attr_compact_dir(self.dir_db_attrs))
+        pq_file = pq.ParquetFile(rslt['paths_compact'][0])
+        self.assertEqual(pq_file.metadata.num_row_groups, 3)
+        self.assertListEqual(pq_file.read().column('featureID').to_pylist(),
+                             ['1520007', '1520007', '1623207', '1623207', '1722317', '1722317'])
+
+        # The manifest reader prefers the compacted file
+        manifest = fs_algo_train_eval.fs_attr_manifest(self.dir_db_attrs)
+        self.assertTrue(manifest['path_compact'].notna().all())
+        with patch('fs_algo.fs_algo_train_eval.dd.read_parquet', wraps=dd.read_parquet) as mock_read:
+            df_cmpt = self._read_sorted(['1520007', '1623207'], use_manifest=True)
+        self.assertListEqual(mock_read.call_args[0][0], [str(rslt['paths_compact'][0])])
+        for df in [df_cmpt, self._read_sorted(['1520007', '1623207'])]:
+            pd.testing.assert_frame_equal(df, df_orig, check_dtype=False, check_categorical=False)
+
+        # Idempotent
+        rslt = fs_algo_train_eval.fs_compact_attrs(self.dir_db_attrs)
+        self.assertEqual(len(rslt['paths_compact']), 0)
+
+    def test_compact_incremental(self):
+        fs_algo_train_eval.fs_compact_attrs(self.dir_db_attrs)
+        # A re-acquired comid is read from its per-comid file until compacted again
+        self._write_comid('1520007', attrs=['pet_mm_s01', 'cly_pc_sav', 'ari_ix_sav'])
+        self._write_comid('1900001')
+        df = self._read_sorted(['1520007', '1623207', '1900001'], use_manifest=True)
+        self.assertFalse(df.duplicated(['featureID', 'attribute']).any())
+        self.assertEqual((df['featureID'] == '1520007').sum(), 3)
+
+        rslt = fs_algo_train_eval.fs_compact_attrs(self.dir_db_attrs)
+        self.assertListEqual([p.name for p in rslt['paths_compact']], ['attrs_compact_00001.parquet'])
+        self.assertEqual(len(rslt['paths_src']), 2)
+        dir_cmpt = fs_algo_train_eval.std_attr_compact_dir(self.dir_db_attrs)
+        df_cmpt = pd.concat([pd.read_parquet(p) for p in dir_cmpt.glob('attrs_compact_*.parquet')])
+        self.assertFalse(df_cmpt.duplicated(['featureID', 'attribute']).any())
+        self.assertEqual(df_cmpt['featureID'].nunique(), 4)
+        pd.testing.assert_frame_equal(self._read_sorted(['1520007', '1623207', '1900001'], use_manifest=True), df,
+                                      check_dtype=False, check_categorical=False)
+
+    def test_compact_remove_src(self):
+        df_orig = self._read_sorted(['1520007', '1722317'])
+        rslt = fs_algo_train_eval.fs_compact_attrs(self.dir_db_attrs, remove_src=True)
+        self.assertFalse(any(p.exists() for p in rslt['paths_src']))
+        # Only the compacted copy remains, read through the manifest
+        pd.testing.assert_frame_equal(self._read_sorted(['1520007', '1722317'], use_manifest=True), df_orig,
+                                      check_dtype=False, check_categorical=False)
+        # The default arguments also find the compacted data
+        pd.testing.assert_frame_equal(self._read_sorted(['1520007', '1722317']), df_orig,
+                                      check_dtype=False, check_categorical=False)
+        df_wide = fs_algo_train_eval.fs_attr_wide(self.dir_db_attrs, ['1520007', '1722317'])
+        self.assertListEqual(sorted(df_wide.index.tolist()), ['1520007', '1722317'])
+
+class TestAttrMatrixStore(unittest.TestCase):
+    def setUp(self):
+        self.dir_db_attrs = Path(tempfile.mkdtemp())/Path('attributes')
+        self.dir_db_attrs.mkdir()
+        for comid in ['1520007', '1623207']:
+            self._write_comid(comid)
+        self.store = fs_algo_train_eval.AttrMatrixStore(self.dir_db_attrs)
+
+    _write_comid = TestFsAttrManifest._write_comid
+
+    def test_build_select(self):
+        summ = self.store.build()
+        self.assertEqual(summ['n_new'], 2)
+        self.assertIsInstance(self.store.values, np.memmap)
+        df_wide = self.store.select(['1623207', '1520007'], ['pet_mm_s01', 'cly_pc_sav'])
+        df_pvt = fs_algo_train_eval.fs_attr_pivot(fs_algo_train_eval.fs_read_attr_comid(
+            self.dir_db_attrs, ['1623207', '1520007'], ['pet_mm_s01', 'cly_pc_sav']))
+        pd.testing.assert_frame_equal(df_wide, df_pvt.loc[df_wide.index, df_wide.columns])
+        self.assertListEqual(df_wide.index.tolist(), ['1623207', '1520007'])
+
+        with self.assertWarns(UserWarning):
+            df_wide = self.store.select(['1520007', '010101010'])
+        self.assertEqual(df_wide.shape, (1, 2))
+
+    def test_incremental_build(self):
+        self.store.build()
+        self.assertEqual(self.store.build()['n_new'], 0)
+
+        # Only the new comid is read, and its new attribute becomes a column
+        self._write_comid('1722317', attrs=['pet_mm_s01', 'ari_ix_sav'])
+        Path(self.dir_db_attrs/Path('comid_1520007_attrs.parquet')).unlink()
+        summ = self.store.build()
+        self.assertDictEqual(summ, {'n_new': 1, 'n_kept': 1, 'n_removed': 1})
+        self.assertListEqual(self.store.attributes.tolist(), ['cly_pc_sav', 'pet_mm_s01', 'ari_ix_sav'])
+        with self.assertWarns(UserWarning): # NA values
+            df_wide = self.store.select(['1623207', '1722317'])
+        self.assertEqual(df_wide.loc['1722317', 'ari_ix_sav'], 1)
+        self.assertTrue(np.isnan(df_wide.loc['1722317', 'cly_pc_sav']))
+        self.assertEqual(df_wide.loc['1623207', 'pet_mm_s01'], 0)
+
+    def test_comid_across_files(self):
+        # Attributes of a comid split across two files are all kept, as when reading the parquet files
+        pd.DataFrame({'attribute': ['ari_ix_sav'], 'value': [5.], 'featureID': '1520007',
+                      'featureSource': 'COMID'}).to_parquet(self.dir_db_attrs/Path('comid_1520007_extra_attrs.parquet'))
+        self.store.build()
+        df_wide = self.store.select(['1520007'])
+        df_pvt = fs_algo_train_eval.fs_attr_pivot(fs_algo_train_eval.fs_read_attr_comid(self.dir_db_attrs, ['1520007']))
+        pd.testing.assert_frame_equal(df_wide, df_pvt.loc[df_wide.index, df_wide.columns])
+        self.assertSetEqual(set(df_wide.columns), {'ari_ix_sav', 'cly_pc_sav', 'pet_mm_s01'})
+        self.assertEqual(self.store.rows.set_index('featureID').loc['1520007', 'sources'].count('|'), 1)
+
+        # Modifying either file rereads the comid
+        self.assertEqual(self.store.build()['n_new'], 0)
+        pd.DataFrame({'attribute': ['ari_ix_sav'], 'value': [6.], 'featureID': '1520007',
+                      'featureSource': 'COMID'}).to_parquet(self.dir_db_attrs/Path('comid_1520007_extra_attrs.parquet'))
+        os.utime(self.dir_db_attrs/Path('comid_1520007_extra_attrs.parquet'), (1e9, 1e9))
+        self.assertDictEqual(self.store.build(), {'n_new': 1, 'n_kept': 1, 'n_removed': 1})
+        self.assertEqual(self.store.select(['1520007']).loc['1520007', 'ari_ix_sav'], 6.)
+
+class TestDesignMatrixCache(unittest.TestCase):
+    def setUp(self):
+        self.dir_db_attrs = Path(tempfile.mkdtemp())/Path('attributes')
+        self.dir_db_attrs.mkdir()
+        for comid in ['1520007', '1623207']:
+            self._write_comid(comid)
+        self.cache = fs_algo_train_eval.DesignMatrixCache(Path(tempfile.mkdtemp()))
+
+    _write_comid = TestFsAttrManifest._write_comid
+
+    def test_fs_attr_wide_cached(self):
+        df_wide = fs_algo_train_eval.fs_attr_wide(self.dir_db_attrs, ['1623207', '1520007'], cache=self.cache)
+        # The second request skips parquet reading entirely
+        with patch('fs_algo.fs_algo_train_eval.fs_read_attr_comid') as mock_read:
+            df_cached = fs_algo_train_eval.fs_attr_wide(self.dir_db_attrs, ['1520007', '1623207'], cache=self.cache)
+        mock_read.assert_not_called()
+        pd.testing.assert_frame_equal(df_cached, df_wide)
+        self.assertDictEqual({k: v for k, v in self.cache.stats().items() if k in ['hits', 'misses', 'size']},
+                             {'hits': 1, 'misses': 1, 'size': 1})
+
+        # Modified source data or different attributes are cache misses
+        self._write_comid('1520007', attrs=['pet_mm_s01', 'cly_pc_sav', 'ari_ix_sav'])
+        df_new = fs_algo_train_eval.fs_attr_wide(self.dir_db_attrs, ['1520007', '1623207'], cache=self.cache)
+        self.assertIn('ari_ix_sav', df_new.columns)
+        fs_algo_train_eval.fs_attr_wide(self.dir_db_attrs, ['1520007'], ['pet_mm_s01'], cache=self.cache)
+        self.assertEqual(self.cache.stats()['misses'], 3)
+
+    def test_fs_attr_wide_manifest(self):
+        # A manifest refreshed once is reused, rather than listing dir_db_attrs on every call
+        manifest = fs_algo_train_eval.fs_attr_manifest(self.dir_db_attrs)
+        with patch('fs_algo.fs_algo_train_eval.fs_attr_manifest') as mock_manifest:
+            for comids in [['1520007'], ['1623207']]:
+                df_wide = fs_algo_train_eval.fs_attr_wide(self.dir_db_attrs, comids, cache=self.cache,
+                                                          manifest=manifest)
+                self.assertListEqual(df_wide.index.tolist(), comids)
+        mock_manifest.assert_not_called()
+
+    def test_evict_lru(self):
+        df = pd.DataFrame(np.ones((10, 10)))
+        for key in ['a', 'b']:
+            self.cache.put(key, df)
+        os.utime(self.cache._path('a'), (1, 1))
+        self.cache.max_bytes = self.cache.stats()['bytes'] - 1
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('b'))
+
+    def test_std_design_cache_dir(self):
+        dir_base = Path(tempfile.mkdtemp())/Path('output')
+        dir_cache = fs_algo_train_eval.std_design_cache_dir(dir_base)
+        # The cache stays inside dir_base
+        self.assertTrue(dir_cache.is_dir())
+        self.assertEqual(dir_cache.relative_to(dir_base.absolute()), Path('cache')/Path('design_matrix'))
+
 class TestCheckAttributesExist(unittest.TestCase):
     print('Testing _check_attributes_exist')
     def test_check_attributes_exist(self):
@@ -155,6 +442,63 @@ class TestFsRetrNhdpComids(unittest.TestCase):
         # Assertions
         self.assertEqual(result, ['1722317', '1520007'])
 
+    @patch('fs_proc.proc_eval_metrics.retr_nldi_comids_batch')
+    def test_warm_cache_offline(self, mock_batch):
+        path_cache = Path(tempfile.mkdtemp())/Path('comid_cache.sqlite')
+        mock_batch.return_value = pd.DataFrame({'featureID': ['USGS-01031500', 'USGS-08070000'],
+                                                'comid': ['1722317', '1520007'],
+                                                'error': [None, None]})
+        gage_ids = ["01031500", "08070000"]
+        cold = fs_algo_train_eval.fs_retr_nhdp_comids('nwissite', 'USGS-{gage_id}', gage_ids, path_cache=path_cache)
+        self.assertEqual(cold, ['1722317', '1520007'])
+        mock_batch.assert_called_once()
+
+        # A warm cache should never touch the NLDI
+        mock_batch.reset_mock()
+        with patch('builtins.print') as mock_print:
+            warm = fs_algo_train_eval.fs_retr_nhdp_comids('nwissite', 'USGS-{gage_id}', gage_ids, path_cache=path_cache)
+        self.assertEqual(warm, cold)
+        mock_batch.assert_not_called()
+        # The cache stats are only printed when verbose
+        mock_print.assert_not_called()
+        with patch('builtins.print') as mock_print:
+            fs_algo_train_eval.fs_retr_nhdp_comids('nwissite', 'USGS-{gage_id}', gage_ids, path_cache=path_cache,
+                                                   verbose=True)
+        mock_print.assert_called_once()
+
+    @patch('fs_proc.proc_eval_metrics.retr_nldi_comids_batch')
+    def test_failed_gage_warns(self, mock_batch):
+        mock_batch.return_value = pd.DataFrame({'featureID': ['USGS-01031500', 'USGS-bad'],
+                                                'comid': ['1722317', None],
+                                                'error': [None, 'HTTP 404']})
+        with self.assertWarns(UserWarning):
+            rslt = fs_algo_train_eval.fs_retr_nhdp_comids('nwissite', 'USGS-{gage_id}', ['01031500', 'bad'])
+        self.assertEqual(rslt, ['1722317', None])
+
+class TestNldiComidCache(unittest.TestCase):
+    def setUp(self):
+        self.path_cache = Path(tempfile.mkdtemp())/Path('comid_cache.sqlite')
+
+    def test_hits_misses(self):
+        comid_cache = fs_algo_train_eval.NldiComidCache(self.path_cache)
+        comid_cache.put_many('nwissite', {'USGS-01031500': '1722317', 'USGS-bad': None})
+        rslt = comid_cache.get_many('nwissite', ['USGS-01031500', 'USGS-bad', 'USGS-08070000'])
+        self.assertEqual(rslt, {'USGS-01031500': '1722317'})
+        stats = comid_cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['size'], 1)
+        # featureSource is part of the key
+        self.assertEqual(comid_cache.get_many('comid', ['USGS-01031500']), {})
+
+    def test_expiry(self):
+        comid_cache = fs_algo_train_eval.NldiComidCache(self.path_cache)
+        comid_cache.put_many('nwissite', {'USGS-01031500': '1722317'})
+        expired_cache = fs_algo_train_eval.NldiComidCache(self.path_cache, max_age_days=-1)
+        self.assertEqual(expired_cache.get_many('nwissite', ['USGS-01031500']), {})
+        self.assertEqual(expired_cache.purge_expired(), 1)
+        self.assertEqual(comid_cache.stats()['size'], 0)
+
 class TestFindFeatSrceId(unittest.TestCase):
 
     def test_find_feat_srce_id(self):
@@ -435,6 +779,209 @@ class TestAlgoTrainEval(unittest.TestCase):
         self.assertIn('algo', self.train_eval.eval_df.columns)
         self.assertEqual(self.train_eval.eval_df['dataset'].iloc[0], self.dataset_id)
 
+class TestSplitDataShared(unittest.TestCase):
+    def test_split_matches_dropna(self):
+        rng = np.random.default_rng(32)
+        df = pd.DataFrame(rng.random((40, 4)), columns=['attr1', 'attr2', 'NSE', 'KGE'])
+        df.loc[[3, 7], 'NSE'] = np.nan
+        df.loc[[5], 'attr2'] = np.nan
+        for metr in ['NSE', 'KGE']:
+            train_eval = AlgoTrainEval(df=df, attrs=['attr1', 'attr2'], algo_config={},
+                                       dir_out_alg_ds=tempfile.gettempdir(), dataset_id='ds',
+                                       metr=metr, test_size=0.3, rs=32)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                train_eval.split_data()
+            # Identical to splitting a per-metric copy of the data
+            df_non_na = df[['attr1', 'attr2', metr]].dropna()
+            X_train, X_test, y_train, y_test = train_test_split(df_non_na[['attr1', 'attr2']], df_non_na[metr],
+                                                                test_size=0.3, random_state=32)
+            pd.testing.assert_frame_equal(train_eval.X_train, X_train)
+            pd.testing.assert_frame_equal(train_eval.X_test, X_test)
+            pd.testing.assert_series_equal(train_eval.y_train, y_train)
+            pd.testing.assert_series_equal(train_eval.y_test, y_test)
+            np.testing.assert_array_equal(df.index[train_eval.idx_test], X_test.index)
+        self.assertListEqual(df.columns.tolist(), ['attr1', 'attr2', 'NSE', 'KGE'])
+
+class TestAlgoTrainEvalMultiOutput(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(32)
+        self.df = pd.DataFrame({'attr1': rng.random(30), 'attr2': rng.random(30)})
+        self.df['NSE'] = self.df['attr1'] + rng.random(30)/10
+        self.df['KGE'] = self.df['attr2'] + rng.random(30)/10
+        self.dir_out_alg_ds = Path(tempfile.mkdtemp())
+        self.train_eval = AlgoTrainEval(df=self.df, attrs=['attr1', 'attr2'],
+                                        algo_config={'rf': [{'n_estimators': 10}]},
+                                        dir_out_alg_ds=self.dir_out_alg_ds, dataset_id='ds',
+                                        metr=['NSE', 'KGE'], test_size=0.3, rs=32)
+
+    def test_train_eval(self):
+        self.train_eval.train_eval()
+        self.assertEqual(self.train_eval.algs_dict['rf']['algo'].n_outputs_, 2)
+        eval_df = self.train_eval.eval_df
+        self.assertListEqual(eval_df['metric'].tolist(), ['NSE', 'KGE'])
+        self.assertListEqual(eval_df['algo'].tolist(), ['rf', 'rf'])
+        self.assertTrue(all(Path(p).exists() for p in eval_df['loc_pipe']))
+
+        # Per-metric prediction from the shared multi-output algorithm
+        X = self.df[['attr1', 'attr2']]
+        y_pred = self.train_eval.algs_dict['rf']['pipeline'].predict(X)
+        for i, path_algo in enumerate(eval_df['loc_pipe']):
+            algo_dict = fs_algo_train_eval.fs_load_algo(path_algo)
+            self.assertEqual(algo_dict['idx_output'], i)
+            resp_pred = algo_dict['model'].predict(X)[:, algo_dict['idx_output']]
+            np.testing.assert_array_equal(resp_pred, y_pred[:, i])
+
+            # The saved training samples reproduce the saved uncertainty of the test data
+            self.assertEqual(algo_dict['n_train'], len(self.train_eval.X_train))
+            self.assertEqual(algo_dict['inbag'].shape, (len(self.train_eval.X_train), 10))
+            _, resp_var = fs_algo_train_eval.fs_pipe_pred_var(algo_dict['model'], self.train_eval.X_test,
+                                                               inbag=algo_dict['inbag'], random_state=32)
+            np.testing.assert_allclose(resp_var, algo_dict['confidence_intervals'])
+
+class TestAlgoRegistry(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(32)
+        self.df = pd.DataFrame({'attr1': rng.random(30), 'attr2': rng.random(30)})
+        self.df['NSE'] = self.df['attr1'] + rng.random(30)/10
+        self.df['KGE'] = self.df['attr2'] + rng.random(30)/10
+        self.dir_out_alg_base = Path(tempfile.mkdtemp())
+        for ds, metr in [('ds_multi', ['NSE', 'KGE']), ('ds_sngl', 'NSE')]:
+            AlgoTrainEval(df=self.df, attrs=['attr1', 'attr2'], algo_config={'rf': [{'n_estimators': 10}]},
+                          dir_out_alg_ds=self.dir_out_alg_base/ds, dataset_id=ds,
+                          metr=metr, test_size=0.3, rs=32).train_eval()
+
+    def test_index(self):
+        registry = fs_algo_train_eval.AlgoRegistry(self.dir_out_alg_base)
+        self.assertListEqual(registry.index[['dataset', 'metric']].values.tolist(),
+                             [['ds_multi', 'KGE'], ['ds_multi', 'NSE'], ['ds_multi', 'multioutput'], ['ds_sngl', 'NSE']])
+        self.assertEqual(registry.path('ds_sngl', 'rf', 'NSE'),
+                         fs_algo_train_eval.std_algo_path(self.dir_out_alg_base/'ds_sngl', 'rf', 'NSE', 'ds_sngl'))
+        with self.assertRaises(FileNotFoundError):
+            registry.path('ds_sngl', 'mlp', 'NSE')
+
+    def test_get(self):
+        registry = fs_algo_train_eval.AlgoRegistry(self.dir_out_alg_base, max_models=1)
+        X = self.df[['attr1', 'attr2']]
+        for ds, metr in [('ds_multi', 'NSE'), ('ds_multi', 'KGE'), ('ds_sngl', 'NSE')]:
+            algo_dict = registry.get(ds, 'rf', metr)
+            algo_dict_ref = fs_algo_train_eval.fs_load_algo(registry.path(ds, 'rf', metr))
+            self.assertEqual(algo_dict['idx_output'], algo_dict_ref['idx_output'])
+            np.testing.assert_array_equal(algo_dict['model'].predict(X), algo_dict_ref['model'].predict(X))
+            self.assertIsInstance(algo_dict['inbag'], np.memmap)
+        # The multi-output metrics share one loaded algorithm, which is evicted by the next
+        self.assertDictEqual({k: registry.stats()[k] for k in ['hits', 'misses', 'size']},
+                             {'hits': 1, 'misses': 2, 'size': 1})
+        registry.get('ds_multi', 'rf', 'KGE')
+        self.assertEqual(registry.stats()['misses'], 3)
+
+class TestCompactForest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(32)
+        self.X = pd.DataFrame({'attr1': rng.random(100), 'attr2': rng.random(100), 'attr3': rng.random(100)})
+        self.y = self.X['attr1'] + rng.random(100)/5
+        self.X.iloc[::7, 1] = np.nan # Missing values follow each split's learned direction
+        self.rf = RandomForestRegressor(n_estimators=20, random_state=32).fit(self.X, self.y)
+        self.X_test = pd.DataFrame(rng.random((50, 3)), columns=['attr1', 'attr2', 'attr3'])
+        self.X_test.iloc[::5, 1] = np.nan
+        self.dir_out = Path(tempfile.mkdtemp())
+
+    def test_module(self):
+        # Predicting needs only numpy, while fs_algo_train_eval re-exports the class
+        self.assertIs(fs_algo_train_eval.CompactForest, compact_models.CompactForest)
+        self.assertIs(fs_algo_train_eval.CompactMLP, compact_models.CompactMLP)
+        self.assertFalse(any(line.startswith(('import pandas', 'import sklearn', 'from sklearn'))
+                             for line in Path(compact_models.__file__).read_text().splitlines()))
+
+    def test_save_load(self):
+        for dtype, mmap_mode in [('float64', 'r'), ('float32', None)]:
+            path = fs_algo_train_eval.CompactForest.from_forest(self.rf, dtype=dtype).save(self.dir_out/f'rf_{dtype}.fsforest')
+            forest = fs_algo_train_eval.CompactForest.load(path, mmap_mode=mmap_mode)
+            self.assertEqual(forest.n_estimators, 20)
+            self.assertListEqual(list(forest.feature_names_in_), ['attr1', 'attr2', 'attr3'])
+            self.assertEqual(isinstance(forest.arrays['threshold'], np.memmap), mmap_mode == 'r')
+            # float32 only rounds the predicted values, as every split is unchanged
+            np.testing.assert_allclose(forest.predict(self.X_test), self.rf.predict(self.X_test),
+                                       rtol=0 if dtype == 'float64' else 1e-6)
+            np.testing.assert_allclose(forest.predict_trees(self.X_test)[:, :, 0],
+                                       np.stack([tree.predict(self.X_test.to_numpy()) for tree in self.rf.estimators_]),
+                                       rtol=0 if dtype == 'float64' else 1e-6)
+        with self.assertRaises(ValueError):
+            fs_algo_train_eval.CompactForest.load(__file__)
+
+    def test_predict_blocks(self):
+        # Multi-output, traversed in several blocks of rows & threads
+        Y = np.column_stack([self.y, self.X['attr3']])
+        rf = RandomForestRegressor(n_estimators=20, random_state=32).fit(self.X, Y)
+        forest = fs_algo_train_eval.CompactForest.from_forest(rf)
+        forest.block_rows, forest.n_jobs = 7, 2
+        np.testing.assert_array_equal(forest.predict(self.X_test), rf.predict(self.X_test))
+        np.testing.assert_array_equal(forest.predict_trees(self.X_test),
+                                      np.stack([tree.predict(self.X_test.to_numpy()) for tree in rf.estimators_]))
+
+    def test_registry(self):
+        df = self.X.assign(NSE=self.y).fillna(0)
+        train_eval = AlgoTrainEval(df, ['attr1', 'attr2', 'attr3'], {'rf': [{'n_estimators': 10}]},
+                                   self.dir_out/'ds', 'ds', 'NSE', 0.3, 32, compact_forest='float64')
+        train_eval.train_eval()
+        self.assertTrue(Path(train_eval.algs_dict['rf']['loc_compact']).exists())
+        algo_dict = fs_algo_train_eval.AlgoRegistry(self.dir_out, use_compact_forest=True).get('ds', 'rf', 'NSE')
+        self.assertIsInstance(algo_dict['model'], fs_algo_train_eval.CompactForest)
+        np.testing.assert_array_equal(algo_dict['inbag'], train_eval.algs_dict['rf']['inbag'])
+        # The saved in-bag counts reproduce the saved uncertainty
+        y_pred, var = fs_algo_train_eval.fs_pipe_pred_var(algo_dict['model'], train_eval.X_test, random_state=32)
+        np.testing.assert_allclose(y_pred, train_eval.preds_dict['rf']['y_pred'])
+        np.testing.assert_allclose(var, train_eval.algs_dict['rf']['ci'])
+
+class TestCompactMLP(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(32)
+        self.X = pd.DataFrame(rng.random((100, 3))*50, columns=['attr1', 'attr2', 'attr3'])
+        self.y = np.sin(self.X['attr1']/10) + self.X['attr2']/50
+        self.X_test = pd.DataFrame(rng.random((30, 3))*50, columns=['attr1', 'attr2', 'attr3'])
+
+    def test_from_pipeline(self):
+        for activation in ['identity', 'logistic', 'tanh', 'relu']:
+            pipe = make_pipeline(StandardScaler(), MLPRegressor(hidden_layer_sizes=(8, 4), activation=activation,
+                                                                max_iter=50, random_state=32))
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                pipe.fit(self.X, self.y)
+            for dtype, rtol in [('float64', 1e-10), ('float32', 1e-4)]:
+                mlp = fs_algo_train_eval.CompactMLP.from_pipeline(pipe, dtype=dtype)
+                y_pred = mlp.predict(self.X_test)
+                np.testing.assert_allclose(y_pred, pipe.predict(self.X_test), rtol=rtol, atol=rtol)
+                # Columns are matched by name & the reused buffers do not alter earlier predictions
+                y_again = mlp.predict(self.X_test[['attr3', 'attr1', 'attr2']])
+                mlp.predict(self.X_test.iloc[:5])
+                np.testing.assert_array_equal(y_pred, y_again)
+
+    def test_multi_output(self):
+        Y = np.column_stack([self.y, self.X['attr3']/50])
+        pipe = make_pipeline(StandardScaler(with_mean=False), MLPRegressor(max_iter=50, random_state=32))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            pipe.fit(self.X.to_numpy(), Y)
+        mlp = fs_algo_train_eval.CompactMLP.from_pipeline(pipe)
+        self.assertEqual(mlp.predict(self.X_test.to_numpy()).shape, (30, 2))
+        np.testing.assert_allclose(mlp.predict(self.X_test.to_numpy()), pipe.predict(self.X_test.to_numpy()))
+        with self.assertRaises(ValueError):
+            mlp.predict(self.X_test.to_numpy()[:, :2])
+        with self.assertRaises(ValueError):
+            fs_algo_train_eval.CompactMLP.from_pipeline(make_pipeline(RandomForestRegressor(n_estimators=2)))
+
+    def test_registry(self):
+        dir_out = Path(tempfile.mkdtemp())
+        df = self.X.assign(NSE=self.y)
+        train_eval = AlgoTrainEval(df, ['attr1', 'attr2', 'attr3'], {'mlp': [{'hidden_layer_sizes': [(8,), (4,)], 'max_iter': [50]}]},
+                                   dir_out/'ds', 'ds', 'NSE', 0.3, 32)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            train_eval.train_eval()
+        algo_dict = fs_algo_train_eval.AlgoRegistry(dir_out, compile_mlp='float64').get('ds', 'mlp', 'NSE')
+        self.assertIsInstance(algo_dict['model'], fs_algo_train_eval.CompactMLP)
+        np.testing.assert_allclose(algo_dict['model'].predict(train_eval.X_test), train_eval.preds_dict['mlp']['y_pred'])
+
 class TestAlgoTrainEvalMlti(unittest.TestCase):
 
     def setUp(self):
@@ -515,6 +1062,186 @@ class TestAlgoTrainEvalMlti(unittest.TestCase):
         self.assertEqual(d, {'a': [1, 2], 'b': {'sub1': [3, 4]}})
 
 
+class TestSearchStrategies(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(32)
+        self.df = pd.DataFrame({'attr1': rng.random(60), 'attr2': rng.random(60)})
+        self.df['metric'] = self.df['attr1'] + rng.random(60)/10
+
+    def _train(self, search_config):
+        train_eval = AlgoTrainEval(self.df, ['attr1', 'attr2'], {'rf': [{'n_estimators': [5, 10, 15, 20]}]},
+                                   tempfile.gettempdir(), 'ds', 'metric', 0.3, 32, n_jobs=1,
+                                   search_config=search_config)
+        train_eval.split_data()
+        train_eval.select_algs_grid_search()
+        train_eval.train_algos_grid_search()
+        return train_eval.algs_dict['rf']
+
+    def test_strategies(self):
+        for strategy in ['grid', 'halving', 'random', 'budget']:
+            algs_rf = self._train({'strategy': strategy, 'n_iter': 2, 'cv': 3})
+            search = algs_rf['gridsearchcv']
+            self.assertIn(search.best_params_['randomforestregressor__n_estimators'], [5, 10, 15, 20])
+            self.assertIn('mean_test_score', search.cv_results_)
+            self.assertIs(algs_rf['pipeline'], search.best_estimator_)
+        self.assertEqual(len(self._train({'strategy': 'random', 'n_iter': 2})['gridsearchcv'].cv_results_['params']), 2)
+        with self.assertRaises(ValueError):
+            self._train({'strategy': 'bayes'})
+
+    def test_budget(self):
+        search = self._train({'strategy': 'budget', 'cv': 3, 'max_fits': 7})['gridsearchcv']
+        self.assertEqual(search.n_candidates_, 2)
+        # At least one candidate is evaluated
+        search = self._train({'strategy': 'budget', 'cv': 3, 'max_time': 0})['gridsearchcv']
+        self.assertEqual(search.n_candidates_, 1)
+        self.assertEqual(search.best_index_, 0)
+
+class TestForestSizeSweep(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(32)
+        self.X = pd.DataFrame({'attr1': rng.random(60), 'attr2': rng.random(60)})
+        self.y = self.X['attr1'] + rng.random(60)/10
+
+    def test_sweep_matches_forest(self):
+        for scoring in ['oob', 'cv']:
+            sweep = fs_algo_train_eval.ForestSizeSweep([5, 10, 20], scoring=scoring, cv=3, random_state=32)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                sweep.fit(self.X, self.y)
+                n_best = sweep.best_params_['randomforestregressor__n_estimators']
+                rf_ref = RandomForestRegressor(n_estimators=n_best, oob_score=True, random_state=32).fit(self.X, self.y)
+            self.assertEqual(len(sweep.cv_results_['mean_test_score']), 3)
+            rf = sweep.best_estimator_.named_steps['randomforestregressor']
+            self.assertEqual(len(rf.estimators_), n_best)
+            np.testing.assert_allclose(sweep.predict(self.X), rf_ref.predict(self.X))
+            self.assertAlmostEqual(rf.oob_score_, rf_ref.oob_score_)
+
+    def test_grid_search_uses_sweep(self):
+        train_eval = AlgoTrainEval(pd.concat([self.X, self.y.rename('metric')], axis=1), ['attr1', 'attr2'],
+                                   {'rf': [{'n_estimators': [5, 10]}]}, tempfile.gettempdir(), 'ds', 'metric',
+                                   0.3, 32, search_config={'rf_n_estimators_sweep': 'oob'})
+        train_eval.split_data()
+        train_eval.select_algs_grid_search()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            train_eval.train_algos_grid_search()
+        self.assertIsInstance(train_eval.algs_dict['rf']['gridsearchcv'], fs_algo_train_eval.ForestSizeSweep)
+        self.assertIsInstance(train_eval.algs_dict['rf']['algo'], RandomForestRegressor)
+
+class TestFsForestPredVar(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(32)
+        self.X = rng.random((100, 3))
+        self.y = self.X[:, 0] + rng.random(100)/5
+        self.X_test = rng.random((50, 3))
+        self.rf = RandomForestRegressor(n_estimators=20, random_state=32).fit(self.X, self.y)
+
+    def test_matches_forestci(self):
+        var_ref = fci.random_forest_error(self.rf, self.X.shape, self.X_test, calibrate=False)
+        y_pred, var = fs_algo_train_eval.fs_forest_pred_var(self.rf, self.X_test, n_train=100, 
+                                                             calibrate=False, chunk_size=7)
+        np.testing.assert_allclose(var, var_ref)
+        np.testing.assert_allclose(y_pred, self.rf.predict(self.X_test))
+        # The empirical Bayes calibration is sensitive to rounding, so only approximately equal
+        np.random.seed(32)
+        var_ref = fci.random_forest_error(self.rf, self.X.shape, self.X_test, calibrate=True)
+        _, var = fs_algo_train_eval.fs_forest_pred_var(self.rf, self.X_test, n_train=100, 
+                                                        memory_limit=0.01, random_state=32)
+        np.testing.assert_allclose(var, var_ref, rtol=0.1)
+
+    def test_stored_calibration(self):
+        # A calibration fit on all rows gives each row the same variance however the rows are split
+        calib = fs_algo_train_eval.fs_forest_calib_eb(self.rf, self.X_test, n_train=100, random_state=32)
+        _, var = fs_algo_train_eval.fs_forest_pred_var(self.rf, self.X_test, n_train=100, calibration=calib)
+        _, var_part = fs_algo_train_eval.fs_forest_pred_var(self.rf, self.X_test[:7], n_train=100, calibration=calib)
+        np.testing.assert_allclose(var_part, var[:7])
+        # Close to fitting the calibration on the same rows
+        _, var_fit = fs_algo_train_eval.fs_forest_pred_var(self.rf, self.X_test, n_train=100, random_state=32)
+        np.testing.assert_allclose(var, var_fit, rtol=0.05)
+        self.assertIsNone(fs_algo_train_eval.fs_forest_calib_eb(self.rf, self.X_test[:20], n_train=100))
+
+    def test_calc_inbag(self):
+        inbag = fs_algo_train_eval.fs_calc_inbag(self.rf, 100)
+        self.assertEqual(inbag.dtype, np.uint8)
+        np.testing.assert_array_equal(inbag, fci.calc_inbag(100, self.rf))
+        _, var = fs_algo_train_eval.fs_forest_pred_var(self.rf, self.X_test, inbag=inbag, calibrate=False)
+        np.testing.assert_allclose(var, fci.random_forest_error(self.rf, self.X.shape, self.X_test, calibrate=False))
+        with self.assertRaises(ValueError):
+            fs_algo_train_eval.fs_calc_inbag(RandomForestRegressor(n_estimators=5, bootstrap=False).fit(self.X, self.y), 100)
+
+    def test_pipe_pred_var(self):
+        pipe = make_pipeline(StandardScaler(), RandomForestRegressor(n_estimators=20, random_state=32)).fit(self.X, self.y)
+        y_pred, var = fs_algo_train_eval.fs_pipe_pred_var(pipe, self.X_test, n_train=100, calibrate=False)
+        np.testing.assert_allclose(y_pred, pipe.predict(self.X_test))
+        np.testing.assert_allclose(var, fci.random_forest_error(pipe[-1], self.X.shape, pipe[0].transform(self.X_test),
+                                                                calibrate=False))
+        with self.assertRaises(TypeError):
+            fs_algo_train_eval.fs_pipe_pred_var(make_pipeline(MLPRegressor()), self.X_test, n_train=100)
+
+    def test_multi_output(self):
+        rf = RandomForestRegressor(n_estimators=20, random_state=32).fit(self.X, np.column_stack([self.y, self.X[:, 1]]))
+        y_pred, var = fs_algo_train_eval.fs_forest_pred_var(rf, self.X_test, n_train=100, calibrate=False)
+        self.assertEqual(var.shape, (50, 2))
+        np.testing.assert_allclose(var[:, 1], fci.random_forest_error(rf, self.X.shape, self.X_test,
+                                                                      calibrate=False, y_output=1))
+        np.testing.assert_allclose(y_pred, rf.predict(self.X_test))
+
+    def test_uncertainty_skip(self):
+        df = pd.DataFrame(self.X, columns=['attr1', 'attr2', 'attr3']).assign(metric=self.y)
+        for enabled in [True, False]:
+            train_eval = AlgoTrainEval(df, ['attr1', 'attr2', 'attr3'], {'rf': {'n_estimators': 10}},
+                                       tempfile.gettempdir(), 'ds', 'metric', 0.3, 32,
+                                       uncertainty_config={'enabled': enabled})
+            train_eval.split_data()
+            train_eval.train_algos()
+            preds = train_eval.predict_algos()
+            np.testing.assert_allclose(preds['rf']['y_pred'], train_eval.algs_dict['rf']['pipeline'].predict(train_eval.X_test))
+            self.assertEqual('ci' in train_eval.algs_dict['rf'], enabled)
+
+class TestFsPredStream(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(32)
+        df = pd.DataFrame({'attr1': rng.random(40), 'attr2': rng.random(40)})
+        df['NSE'] = df['attr1'] + rng.random(40)/10
+        self.dir_out = Path(tempfile.mkdtemp())
+        train_eval = AlgoTrainEval(df, ['attr1', 'attr2'], {'rf': [{'n_estimators': 10}]},
+                                   self.dir_out, 'ds', 'NSE', 0.3, 32)
+        train_eval.train_eval()
+        self.path_algo = train_eval.algs_dict['rf']['loc_pipe']
+        self.df_attr_wide = pd.DataFrame({'attr1': rng.random(25), 'attr2': rng.random(25)},
+                                         index=pd.Index([str(x) for x in range(1000, 1025)], name='featureID'))
+
+    def test_stream_matches_in_memory(self):
+        algo_dict = fs_algo_train_eval.fs_load_algo(self.path_algo)
+        unc_cfg = {'enabled': True, 'calibrate': False}
+        comids = list(self.df_attr_wide.index) + ['999'] # A location lacking attribute data
+        read_attr_wide = lambda comids_chunk: self.df_attr_wide.loc[self.df_attr_wide.index.isin(comids_chunk)]
+        path_pred_out = self.dir_out/'pred_rf_NSE__ds.parquet'
+        models = {('rf', 'NSE'): {'algo_dict': algo_dict, 'path_algo': self.path_algo, 'path_pred_out': path_pred_out}}
+        n_rows = fs_algo_train_eval.fs_pred_stream(comids, read_attr_wide, models, 'ds', chunk_size=4,
+                                                   uncertainty_cfg=unc_cfg, verbose=False)
+        self.assertDictEqual(n_rows, {('rf', 'NSE'): 25})
+        self.assertEqual(pq.ParquetFile(path_pred_out).metadata.num_row_groups, 7)
+        df_pred = fs_algo_train_eval.fs_pred_algo_df(algo_dict, self.df_attr_wide, 'NSE', 'ds', 'rf',
+                                                      Path(self.path_algo).name, uncertainty_cfg=unc_cfg)
+        self.assertListEqual(list(df_pred.columns)[:3], ['comid', 'prediction', 'variance'])
+        pd.testing.assert_frame_equal(pd.read_parquet(path_pred_out), df_pred)
+
+    def test_stream_calibration(self):
+        # The calibrated variance does not depend on the chunk size
+        algo_dict = fs_algo_train_eval.fs_load_algo(self.path_algo)
+        unc_cfg = {'enabled': True, 'calibrate': True, 'seed': 32}
+        read_attr_wide = lambda comids_chunk: self.df_attr_wide.loc[self.df_attr_wide.index.isin(comids_chunk)]
+        df_preds = list()
+        for chunk_size in [4, 25]:
+            path_pred_out = self.dir_out/f'pred_rf_NSE__ds_{chunk_size}.parquet'
+            models = {('rf', 'NSE'): {'algo_dict': algo_dict, 'path_algo': self.path_algo, 'path_pred_out': path_pred_out}}
+            fs_algo_train_eval.fs_pred_stream(list(self.df_attr_wide.index), read_attr_wide, models, 'ds',
+                                              chunk_size=chunk_size, uncertainty_cfg=unc_cfg, verbose=False)
+            df_preds.append(pd.read_parquet(path_pred_out))
+        pd.testing.assert_frame_equal(df_preds[0], df_preds[1])
+        self.assertTrue((df_preds[0]['variance'] >= 0).all())
+
 class TestAlgoTrainEvalSngl(unittest.TestCase):
     # An algo_config with singular hyperparameter value
     def setUp(self):
@@ -635,6 +1362,176 @@ class TestAlgoTrainEvalBasic(unittest.TestCase):
         self.assertIsInstance(self.algo.eval_df, pd.DataFrame)
         self.assertFalse(self.algo.eval_df.empty)
 
+class TestFsTrainEvalUnits(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(32)
+        self.df = pd.DataFrame({'attr1': rng.random(40), 'attr2': rng.random(40)})
+        self.df['NSE'] = self.df['attr1'] + rng.random(40)/10
+        self.df['KGE'] = self.df['attr2'] + rng.random(40)/10
+        self.dir_out_alg_ds = Path(tempfile.mkdtemp())
+        self.units = {('ds', metr): dict(df=self.df, attrs=['attr1', 'attr2'],
+                                         algo_config={'rf': [{'n_estimators': [5, 10]}]},
+                                         dir_out_alg_ds=self.dir_out_alg_ds, dataset_id='ds',
+                                         metr=metr, test_size=0.3, rs=32)
+                      for metr in ['NSE', 'KGE']}
+
+    def test_cpu_budget(self):
+        self.assertDictEqual(fs_algo_train_eval._cpu_budget(6, n_cores=64),
+                             {'n_outer': 6, 'n_jobs_inner': 10, 'n_threads_blas': 1})
+        self.assertDictEqual(fs_algo_train_eval._cpu_budget(100, n_cores=8),
+                             {'n_outer': 8, 'n_jobs_inner': 1, 'n_threads_blas': 1})
+        self.assertDictEqual(fs_algo_train_eval._cpu_budget(4, n_cores=8, n_outer=1),
+                             {'n_outer': 1, 'n_jobs_inner': 8, 'n_threads_blas': 1})
+        # Cores beyond the cross-validation fits become BLAS threads
+        self.assertDictEqual(fs_algo_train_eval._cpu_budget(1, n_cores=64, n_fits=10),
+                             {'n_outer': 1, 'n_jobs_inner': 10, 'n_threads_blas': 6})
+        self.assertEqual(fs_algo_train_eval._unit_n_fits(self.units[('ds', 'NSE')]), 10)
+        self.assertEqual(fs_algo_train_eval._unit_n_fits({**self.units[('ds', 'NSE')],
+                                                          'search_config': {'strategy': 'budget', 'cv': 3}}), 3)
+        self.assertEqual(fs_algo_train_eval._unit_n_fits({**self.units[('ds', 'NSE')],
+                                                          'algo_config': {'rf': {'n_estimators': 10}}}), 1)
+
+    def test_parallel_matches_sequential(self):
+        rslt_par = fs_algo_train_eval.fs_train_eval_units(self.units, n_cores=2)
+        rslt_seq = fs_algo_train_eval.fs_train_eval_units(self.units, n_cores=2, n_outer=1)
+        self.assertListEqual(list(rslt_par.keys()), [('ds', 'NSE'), ('ds', 'KGE')])
+        for k in rslt_par.keys():
+            pd.testing.assert_frame_equal(rslt_par[k], rslt_seq[k])
+        # The caller's algo config is untouched
+        self.assertIn('rf', self.units[('ds', 'NSE')]['algo_config'])
+
+    def test_parallel_shared_df(self):
+        # The frame shared by both units is written once for the workers
+        with patch.object(pd.DataFrame, 'to_parquet', autospec=True,
+                          side_effect=pd.DataFrame.to_parquet) as mock_write:
+            rslt = fs_algo_train_eval.fs_train_eval_units(self.units, n_cores=2)
+        self.assertEqual(sum(call[0][0] is self.df for call in mock_write.call_args_list), 1)
+        self.assertListEqual(list(rslt.keys()), [('ds', 'NSE'), ('ds', 'KGE')])
+
+        self.assertDictEqual(fs_algo_train_eval.fs_train_eval_units(dict(), n_cores=2), dict())
+
+    def test_df_path(self):
+        # A unit's data may be spilled to parquet & read by path, with the same fingerprint & results
+        path_df = self.dir_out_alg_ds/Path('df_units.parquet')
+        self.df.to_parquet(path_df)
+        units_path = {k: {**v, 'df': path_df} for k, v in self.units.items()}
+        self.assertEqual(fs_algo_train_eval.fs_unit_fingerprint(units_path[('ds', 'NSE')]),
+                         fs_algo_train_eval.fs_unit_fingerprint(self.units[('ds', 'NSE')]))
+        rslt_path = fs_algo_train_eval.fs_train_eval_units(units_path, n_outer=1)
+        rslt = fs_algo_train_eval.fs_train_eval_units(self.units, n_outer=1)
+        for k in rslt.keys():
+            pd.testing.assert_frame_equal(rslt_path[k], rslt[k])
+
+    def test_resume(self):
+        rslt = fs_algo_train_eval.fs_train_eval_units(self.units, n_outer=1, resume=True)
+        path_eval = fs_algo_train_eval.std_unit_eval_path(self.dir_out_alg_ds, 'NSE', 'ds')
+        self.assertTrue(path_eval.exists())
+        # Unchanged units are skipped, reloading their evaluation summaries
+        with patch.object(fs_algo_train_eval, '_train_eval_unit') as mock_unit:
+            rslt_skip = fs_algo_train_eval.fs_train_eval_units(self.units, n_outer=1, resume=True)
+            mock_unit.assert_not_called()
+        for k in rslt.keys():
+            pd.testing.assert_frame_equal(rslt_skip[k], rslt[k])
+
+        # Changing the response data, the seed, or removing an algorithm retrains only that unit
+        units = {k: dict(v) for k, v in self.units.items()}
+        units[('ds', 'KGE')]['df'] = self.df.assign(KGE=self.df['KGE']*2)
+        self.assertNotEqual(fs_algo_train_eval.fs_unit_fingerprint(units[('ds', 'KGE')]),
+                            fs_algo_train_eval.fs_unit_fingerprint(self.units[('ds', 'KGE')]))
+        self.assertEqual(fs_algo_train_eval.fs_unit_fingerprint(units[('ds', 'NSE')]),
+                         fs_algo_train_eval.fs_unit_fingerprint({**self.units[('ds', 'NSE')], 'verbose': True}))
+        # As does reassigning the data to different comids
+        self.assertNotEqual(fs_algo_train_eval.fs_unit_fingerprint({**units[('ds', 'NSE')],
+                                                                    'df': self.df.set_axis(self.df.index[::-1])}),
+                            fs_algo_train_eval.fs_unit_fingerprint(units[('ds', 'NSE')]))
+        self.assertNotEqual(fs_algo_train_eval.fs_unit_fingerprint({**units[('ds', 'NSE')], 'rs': 1}),
+                            fs_algo_train_eval.fs_unit_fingerprint(units[('ds', 'NSE')]))
+        with patch.object(fs_algo_train_eval, '_train_eval_unit',
+                          side_effect=fs_algo_train_eval._train_eval_unit) as mock_unit:
+            fs_algo_train_eval.fs_train_eval_units(units, n_outer=1, resume=True)
+            self.assertEqual(mock_unit.call_count, 1)
+            Path(rslt[('ds', 'NSE')]['loc_pipe'].iloc[0]).unlink()
+            fs_algo_train_eval.fs_train_eval_units(units, n_outer=1, resume=True)
+            self.assertEqual(mock_unit.call_count, 2)
+
+    def test_resume_multioutput(self):
+        # A run without resume still records what a later resumed run needs
+        units = {('ds', 'multioutput'): {**self.units[('ds', 'NSE')], 'metr': ['NSE', 'KGE']}}
+        rslt = fs_algo_train_eval.fs_train_eval_units(units, n_outer=1)
+        with patch.object(fs_algo_train_eval, '_train_eval_unit') as mock_unit:
+            fs_algo_train_eval.fs_train_eval_units(units, n_outer=1, resume=True)
+            mock_unit.assert_not_called()
+        # Deleting the shared multi-output algorithm, rather than its per-metric references, retrains the unit
+        path_shared = fs_algo_train_eval.std_algo_path(self.dir_out_alg_ds, 'rf', 'multioutput', 'ds')
+        self.assertNotIn(str(path_shared), rslt[('ds', 'multioutput')]['loc_pipe'].tolist())
+        Path(path_shared).unlink()
+        with patch.object(fs_algo_train_eval, '_train_eval_unit',
+                          side_effect=fs_algo_train_eval._train_eval_unit) as mock_unit:
+            fs_algo_train_eval.fs_train_eval_units(units, n_outer=1, resume=True)
+            self.assertEqual(mock_unit.call_count, 1)
+        self.assertTrue(Path(path_shared).exists())
+
+    def test_writer(self):
+        with fs_algo_train_eval.ArtifactWriter(max_queue=1) as writer:
+            rslt = fs_algo_train_eval.fs_train_eval_units(self.units, n_outer=1, resume=True, writer=writer)
+        rslt_sync = fs_algo_train_eval.fs_train_eval_units(self.units, n_outer=1)
+        self.assertEqual(writer.n_written, 4) # an algorithm & an evaluation summary per unit
+        for k in rslt.keys():
+            pd.testing.assert_frame_equal(rslt[k], rslt_sync[k])
+            self.assertTrue(Path(rslt[k]['loc_pipe'].iloc[0]).exists())
+
+    def test_unit_writer(self):
+        # Without a shared writer, each unit writes in the background with a writer of its own, closed before returning
+        with patch.object(fs_algo_train_eval.ArtifactWriter, 'close', autospec=True,
+                          side_effect=fs_algo_train_eval.ArtifactWriter.close) as mock_close:
+            kwargs_ate = {**self.units[('ds', 'NSE')], 'algo_config': copy.deepcopy(self.units[('ds', 'NSE')]['algo_config'])}
+            eval_df = fs_algo_train_eval._train_eval_unit(kwargs_ate, n_jobs_inner=1, n_threads_blas=1,
+                                                          fingerprint='abc', write_queue_size=1)
+        self.assertEqual(mock_close.call_count, 1)
+        self.assertEqual(mock_close.call_args[0][0].n_written, 2) # the algorithm & the evaluation summary
+        self.assertTrue(Path(eval_df['loc_pipe'].iloc[0]).exists())
+        # As does each concurrent unit in its own process
+        rslt_par = fs_algo_train_eval.fs_train_eval_units(self.units, n_cores=2, resume=True, write_queue_size=1)
+        with patch.object(fs_algo_train_eval, '_train_eval_unit') as mock_unit:
+            rslt_skip = fs_algo_train_eval.fs_train_eval_units(self.units, n_outer=1, resume=True)
+            mock_unit.assert_not_called()
+        for k in rslt_par.keys():
+            pd.testing.assert_frame_equal(rslt_skip[k], rslt_par[k])
+
+class TestArtifactWriter(unittest.TestCase):
+    def test_order_and_flush(self):
+        written = list()
+        writer = fs_algo_train_eval.ArtifactWriter(max_queue=2)
+        for i in range(10):
+            writer.submit(written.append, i)
+        writer.flush()
+        self.assertListEqual(written, list(range(10)))
+        writer.close()
+        self.assertEqual(writer.n_written, 10)
+        with self.assertRaises(RuntimeError):
+            writer.submit(written.append, 10)
+
+    def test_errors(self):
+        dir_missing = Path(tempfile.mkdtemp())/'missing'
+        writer = fs_algo_train_eval.ArtifactWriter()
+        writer.submit(pd.DataFrame({'a': [1]}).to_parquet, dir_missing/'a.parquet')
+        with self.assertRaises(OSError):
+            writer.flush()
+        writer.flush() # Each error is raised once
+        # Errors are raised on leaving the context, unless another exception is raised
+        with self.assertRaises(OSError):
+            with fs_algo_train_eval.ArtifactWriter() as writer:
+                writer.submit(_fail_write)
+        with self.assertWarns(UserWarning):
+            with self.assertRaises(ValueError):
+                with fs_algo_train_eval.ArtifactWriter() as writer:
+                    writer.submit(_fail_write)
+                    writer._queue.join()
+                    raise ValueError("training failed")
+
+def _fail_write():
+    raise OSError("No space left on device")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,6 +4,8 @@ from setuptools import setup, find_packages
 # > cd /path/to/fs_algo/
 # > python setup.py sdist bdist_wheel
 # > pip install -e ./
+# Resolving COMIDs that are not in the COMID cache uses the local fs_proc package, 
+# installed first from pkg/fs_proc, or via the 'nldi' extra once fs_proc is resolvable
 setup(
     include_package_data=True,
     package_data={'' : ['./data/*.yaml']},
@@ -20,10 +22,14 @@ setup(
         'xarray',
         'zarr',
         'scikit-learn',
-        'pynhd',
+        'threadpoolctl',
         'dask',
-        'dask_expr'
+        'dask_expr',
+        'pyarrow'
     ],
+    extras_require={
+        'nldi': ['fs_proc']
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
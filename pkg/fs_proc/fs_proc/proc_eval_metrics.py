@@ -24,7 +24,13 @@ import shutil
 from importlib import resources as impresources
 from fs_proc import data
 from itertools import compress
-import pynhd as nhd
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import threading
+import time
+import requests
+from pygeoogc import ServiceURL
 
 
 def _proc_flatten_ls_of_dict_keys(config: dict, key: str) -> list:
@@ -457,10 +463,147 @@ def proc_col_schema(df: pd.DataFrame,
     return ds # Returning not intended use case, but it's an option
 
 
+class _RateLimiter:
+    """Thread-safe limiter spacing out calls to at most `max_rps` per second"""
+    def __init__(self, max_rps: float | None):
+        self.interval = 1/max_rps if max_rps else 0
+        self.lock = threading.Lock()
+        self.t_next = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            t_sched = max(now, self.t_next)
+            self.t_next = t_sched + self.interval
+        time.sleep(max(0, t_sched - now))
+
+def _retr_nldi_comid(session: requests.Session, url: str, limiter: _RateLimiter,
+                     max_retries: int, backoff: float, timeout: float) -> tuple:
+    """Query a single NLDI upstream mainstem flowline URL, retrying transient failures
+
+    :return: The COMID & None if successful, otherwise None & the error description
+    :rtype: tuple
+    """
+    err = None
+    for attempt in range(max_retries + 1):
+        limiter.wait()
+        try:
+            resp = session.get(url, params={'distance': 1}, timeout=timeout)
+        except requests.RequestException as e:
+            err = f"{type(e).__name__}: {e}"
+        else:
+            if resp.status_code == 200:
+                try:
+                    feats = resp.json().get('features', [])
+                except ValueError as e:
+                    return None, f"Invalid NLDI response: {e}"
+                if len(feats) == 0:
+                    return None, "No flowlines returned"
+                return str(feats[0]['properties']['nhdplus_comid']), None
+            err = f"HTTP {resp.status_code}"
+            if resp.status_code not in (429, 500, 502, 503, 504):
+                return None, err # Not transient, e.g. featureID not found
+        if attempt < max_retries:
+            time.sleep(backoff * 2**attempt)
+    return None, err
+
+def retr_nldi_comids_batch(featureIDs: Iterable[str], featureSource: str = 'nwissite',
+                           max_workers: int = 8, max_rps: float | None = 10,
+                           max_retries: int = 3, backoff: float = 1.0,
+                           timeout: float = 30, nldi_url: str | None = None) -> pd.DataFrame:
+    """Resolve the COMID of many NLDI features concurrently, querying the shortest distance in the upstream mainstem flowline
+
+    :param featureIDs: The formatted feature identifiers, e.g. `'USGS-01031500'`
+    :type featureIDs: Iterable[str]
+    :param featureSource: The :mod:`pynhd` / :language:R: :mod:`nhdplusTools` featureSource, defaults to 'nwissite'
+    :type featureSource: str, optional
+    :param max_workers: The total concurrent requests, defaults to 8
+    :type max_workers: int, optional
+    :param max_rps: The ceiling on requests per second across all workers, defaults to 10. None means unlimited.
+    :type max_rps: float | None, optional
+    :param max_retries: Retries for connection errors, timeouts, and HTTP 429/5xx responses, defaults to 3
+    :type max_retries: int, optional
+    :param backoff: Base seconds for exponential backoff between retries, defaults to 1.0
+    :type backoff: float, optional
+    :param timeout: Seconds before a single request times out, defaults to 30
+    :type timeout: float, optional
+    :param nldi_url: The NLDI service base URL, defaults to None, meaning the :mod:`pygeoogc` service URL used by :mod:`pynhd`
+    :type nldi_url: str | None, optional
+    :return: DataFrame with `featureID`, `comid` and `error` columns in the same order as `featureIDs`. `comid` is None wherever `error` describes a failure.
+    :rtype: pd.DataFrame
+    """
+    featureIDs = [str(x) for x in featureIDs]
+    if not nldi_url:
+        nldi_url = ServiceURL().restful.nldi
+    nldi_url = nldi_url.rstrip('/')
+    uniq_fids = list(dict.fromkeys(featureIDs))
+
+    limiter = _RateLimiter(max_rps)
+    dict_rslt = dict()
+    with requests.Session() as session:
+        # Reuse connections across all worker threads
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {fid: executor.submit(_retr_nldi_comid, session,
+                                            f"{nldi_url}/linked-data/{featureSource}/{quote(fid, safe='')}/navigation/UM/flowlines",
+                                            limiter, max_retries, backoff, timeout)
+                       for fid in uniq_fids}
+            for fid, future in futures.items():
+                dict_rslt[fid] = future.result()
+
+    return pd.DataFrame({'featureID': featureIDs,
+                         'comid': [dict_rslt[fid][0] for fid in featureIDs],
+                         'error': [dict_rslt[fid][1] for fid in featureIDs]})
+
+def _precheck_nwissite_gageids(gage_ids: pd.Series) -> pd.Series:
+    """Classify USGS gage IDs by their format alone, without any network requests
+
+    USGS surface water site numbers are all digits and are 8 (downstream order number),
+    10 (extended downstream order number) or 15 (latitude/longitude based) digits long.
+    Since no site number has fewer than 8 digits, a 7-digit ID is always an 8-digit ID
+    whose leading zero was dropped, e.g. when read in as an integer.
+
+    :param gage_ids: The gage ID values, as strings
+    :type gage_ids: pd.Series
+    :return: The classification, aligned with `gage_ids`, as one of `'ok'` for well-formed IDs, 
+        `'fix'` for IDs corrected by prepending '0', or `'ambiguous'` for IDs requiring a lookup
+    :rtype: pd.Series
+    """
+    is_digit = gage_ids.str.fullmatch(r'\d+').fillna(False).astype(bool)
+    n_char = gage_ids.str.len()
+    chk = pd.Series('ambiguous', index=gage_ids.index)
+    chk[is_digit & n_char.isin([8, 10, 15])] = 'ok'
+    chk[is_digit & (n_char == 7)] = 'fix'
+    return chk
+
+def _read_nwis_site_list(path_site_list: str | os.PathLike, site_col: str = 'site_no') -> set:
+    """Read a local list of known USGS nwissite site numbers
+
+    :param path_site_list: The path to a .csv or .parquet file of site numbers, e.g. from the USGS site inventory
+    :type path_site_list: str | os.PathLike
+    :param site_col: The column name containing site numbers, defaults to 'site_no'
+    :type site_col: str, optional
+    :raises ValueError: File extension not recognized
+    :return: The unique site numbers as strings
+    :rtype: set
+    """
+    if '.csv' in Path(path_site_list).suffix:
+        site_ids = pd.read_csv(path_site_list, dtype={site_col: str}, comment='#')[site_col]
+    elif '.parquet' in Path(path_site_list).suffix:
+        site_ids = pd.read_parquet(path_site_list, columns=[site_col])[site_col]
+    else:
+        raise ValueError(f"Unsupported site list file extension '{Path(path_site_list).suffix}'. Expected .csv or .parquet")
+    return set(site_ids.dropna().astype(str).str.strip())
+
 def check_fix_nwissite_gageids(df:pd.DataFrame, gage_id_col:str,
                                 featureSource:str = 'nwissite', 
                                 featureID:str='USGS-{gage_id}',
-                                replace_orig_gage_id_col:bool=True) -> pd.DataFrame:
+                                replace_orig_gage_id_col:bool=True,
+                                precheck:bool=True,
+                                path_site_list: str | os.PathLike | None = None,
+                                **kwargs_nldi) -> pd.DataFrame:
     """Checks whether USGS gage ID values corresponding to nwissite data follow expected format
 
     :param df: DataFrame containing a column with nwissite gage id column for format checking
@@ -473,41 +616,46 @@ def check_fix_nwissite_gageids(df:pd.DataFrame, gage_id_col:str,
     :type featureID: str, optional
     :param replace_orig_gage_id_col: Should the data inside `df[gage_id_col`] be replaced with the corrected values? If not, an added column named `'fix'` is added, defaults to True
     :type replace_orig_gage_id_col: bool, optional
+    :param precheck: Should gage ids be classified by format first? Well-formed ids are accepted and 7-digit ids are fixed without network requests. Only the remaining ambiguous ids are checked via the NLDI. Defaults to True
+    :type precheck: bool, optional
+    :param path_site_list: A local .csv or .parquet file with a `site_no` column of known nwissite site numbers. If provided, the gage ids not fixed by the precheck are checked against this file and the NLDI is never queried. Defaults to None
+    :type path_site_list: str | os.PathLike | None, optional
+    :param kwargs_nldi: Optional arguments passed to :func:`retr_nldi_comids_batch()`, e.g. `max_workers` or `max_rps`
     :return: The provided `df`, modified in cases when inappropriate `gage_id_col`'s data format found
     :rtype: pd.DataFrame
+    :seealso: :func:`_precheck_nwissite_gageids()`
 
     """
 
     ls_still_bad = list()
     if featureSource == 'nwissite':
         print(f"Checking {df.shape[0]} total USGS gage station IDs for appropriate nwissite format.")
-        print(f"This may take {round(df.shape[0]/60/3.2,2)} minutes for the first check")
-        nldi = nhd.NLDI()
-        ls_bad_ids = list()
-        for ix, row  in df.iterrows():
-            gid = row[gage_id_col]
-            try:
-                comid = nldi.navigate_byid(fsource=featureSource,fid= featureID.format(gage_id=gid),
-                                        navigation='upstreamMain',
-                                        source='flowlines',
-                                        distance=1 # the shortest distance
-                                        ).loc[0]['nhdplus_comid'] 
-            except: # Could not process this particular gid
-                ls_bad_ids.append(gid)                                                     
-        ls_prezero = ['0'+x for x in ls_bad_ids]
-
-        print(f"Checking whether prepending '0' fixes {len(ls_prezero)} total gage_ids that were not recognized during the first check")
-        print(f"This may take {round(len(ls_prezero)/60/3.2,2)} minutes for the second check.")
-        for prezero in ls_prezero:
-            try:
-                nldi.navigate_byid(fsource=featureSource,fid= featureID.format(gage_id=prezero),
-                                                navigation='upstreamMain',
-                                                source='flowlines',
-                                                distance=1 # the shortest distance
-                                                ).loc[0]['nhdplus_comid']
-            except:
-                ls_still_bad.append(prezero)
-                pass
+        gids = pd.Series(df[gage_id_col].unique()).astype(str)
+        ls_fixed = list()
+        if precheck:
+            chk = _precheck_nwissite_gageids(gids)
+            ls_fixed = gids[chk == 'fix'].tolist()
+            # A local site list cheaply checks the well-formed ids too
+            gids = gids[chk != 'fix'] if path_site_list else gids[chk == 'ambiguous']
+            print(f"Format precheck fixed {len(ls_fixed)} total gage_ids, {len(gids)} gage_ids remain to be checked.")
+        if path_site_list:
+            site_ids = _read_nwis_site_list(path_site_list)
+            ls_bad_list = gids[~gids.isin(site_ids)].tolist()
+            ls_still_bad = ['0'+x for x in ls_bad_list if '0'+x not in site_ids]
+            ls_bad_ids = ls_fixed + ls_bad_list
+            ls_prezero = ['0'+x for x in ls_bad_ids]
+        else:
+            df_rslt = retr_nldi_comids_batch([featureID.format(gage_id=gid) for gid in gids],
+                                             featureSource=featureSource, **kwargs_nldi)
+            ls_bad_net = [gid for gid, bad in zip(gids, df_rslt['comid'].isna()) if bad]
+            ls_prezero_net = ['0'+x for x in ls_bad_net]
+
+            print(f"Checking whether prepending '0' fixes {len(ls_prezero_net)} total gage_ids that were not recognized during the first check")
+            df_rslt_prezero = retr_nldi_comids_batch([featureID.format(gage_id=prezero) for prezero in ls_prezero_net],
+                                                     featureSource=featureSource, **kwargs_nldi)
+            ls_still_bad = [prezero for prezero, bad in zip(ls_prezero_net, df_rslt_prezero['comid'].isna()) if bad]
+            ls_bad_ids = ls_fixed + ls_bad_net
+            ls_prezero = ['0'+x for x in ls_bad_ids]
 
         
         if len(ls_bad_ids) > 0:
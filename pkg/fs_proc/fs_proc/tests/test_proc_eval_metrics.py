@@ -24,12 +24,17 @@ import yaml
 import xarray as xr
 from fs_proc.proc_eval_metrics import read_schm_ls_of_dict, proc_col_schema,\
       _proc_check_input_config, _proc_flatten_ls_of_dict_keys, \
-      _proc_check_input_df, _proc_check_std_fs_ids, check_fix_nwissite_gageids
+      _proc_check_input_df, _proc_check_std_fs_ids, check_fix_nwissite_gageids, \
+      retr_nldi_comids_batch, _precheck_nwissite_gageids
 import numpy as np
 from unittest.mock import patch, MagicMock
-import pynhd as nhd
 import warnings
 import tempfile
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
 
 # Define the unit test directory for fs_proc
 parent_dir_test = Path(__file__).parent #TODO should change this 
@@ -242,49 +247,119 @@ class TestProcColSchemaNwisCheck(unittest.TestCase):
         
 
 
-class TestCheckFixNwissiteGageIds(unittest.TestCase):
-
-    @patch('pynhd.NLDI.navigate_byid')
-    def test_valid_gage_ids(self, mock_navigate_byid):
-        # Mock the API call returning a valid comid
-        mock_navigate_byid.return_value = pd.DataFrame({'nhdplus_comid': [12345]})
-        
+class _StubNldiHandler(BaseHTTPRequestHandler):
+    # Serves /linked-data/{featureSource}/{featureID}/navigation/UM/flowlines
+    # from the class-level dict of featureID: comid. A list of HTTP status codes
+    # in `flaky` is returned first, before the real response.
+    comids = dict()
+    flaky = dict()
+    requests_seen = list()
+    def do_GET(self):
+        fid = unquote(self.path.split('?')[0].split('/')[3])
+        self.requests_seen.append(fid)
+        if self.flaky.get(fid):
+            self.send_response(self.flaky[fid].pop(0))
+            self.end_headers()
+            return
+        if fid not in self.comids:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps({'type': 'FeatureCollection',
+                           'features': [{'type': 'Feature',
+                                         'properties': {'nhdplus_comid': self.comids[fid]}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, *args):
+        pass
+
+class _StubNldiTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubNldiHandler)
+        cls.nldi_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    def setUp(self):
+        _StubNldiHandler.comids = {'USGS-12345678': '12345', 'USGS-87654321': '54321',
+                                   'USGS-01234567': '11111'}
+        _StubNldiHandler.flaky = dict()
+        _StubNldiHandler.requests_seen = list()
+
+class TestRetrNldiComidsBatch(_StubNldiTestCase):
+    def test_batch_order_and_errors(self):
+        fids = ['USGS-87654321', 'USGS-nope', 'USGS-12345678', 'USGS-87654321']
+        rslt = retr_nldi_comids_batch(fids, nldi_url=self.nldi_url, max_workers=4, max_rps=None)
+        self.assertListEqual(rslt['featureID'].tolist(), fids)
+        self.assertListEqual(rslt['comid'].tolist(), ['54321', None, '12345', '54321'])
+        self.assertEqual(rslt['error'].iloc[1], 'HTTP 404')
+        self.assertTrue(rslt['error'].iloc[[0, 2, 3]].isna().all())
+        # Duplicates are only requested once
+        self.assertEqual(len(_StubNldiHandler.requests_seen), 3)
+
+    def test_retry_transient(self):
+        _StubNldiHandler.flaky = {'USGS-12345678': [503, 429]}
+        rslt = retr_nldi_comids_batch(['USGS-12345678'], nldi_url=self.nldi_url, backoff=0.01)
+        self.assertEqual(rslt['comid'].iloc[0], '12345')
+        self.assertEqual(len(_StubNldiHandler.requests_seen), 3)
+
+        _StubNldiHandler.flaky = {'USGS-87654321': [503, 503, 503]}
+        rslt = retr_nldi_comids_batch(['USGS-87654321'], nldi_url=self.nldi_url, max_retries=2, backoff=0.01)
+        self.assertIsNone(rslt['comid'].iloc[0])
+        self.assertEqual(rslt['error'].iloc[0], 'HTTP 503')
+
+    def test_rate_limit(self):
+        fids = [f'USGS-{x}' for x in range(10)]
+        t_start = time.monotonic()
+        retr_nldi_comids_batch(fids, nldi_url=self.nldi_url, max_workers=5, max_rps=50)
+        # 10 requests spaced at 1/50 s requires at least 9 intervals
+        self.assertGreaterEqual(time.monotonic() - t_start, 9/50)
+
+class TestCheckFixNwissiteGageIds(_StubNldiTestCase):
+
+    def test_valid_gage_ids(self):
         # Test data
         df = pd.DataFrame({'basin_id': ['12345678', '87654321']})
         
         # Run function
-        result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id')
+        result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id', nldi_url=self.nldi_url)
         
         # Assertions
         self.assertEqual(result_df.shape[0], 2)  # Ensure no rows are dropped
         self.assertNotIn('fix', result_df.columns)  # 'fix' column should not exist when replace is True
         self.assertListEqual(result_df['basin_id'].tolist(), ['12345678', '87654321'])  # IDs should remain the same
 
-    @patch('pynhd.NLDI.navigate_byid')
-    def test_invalid_gage_ids_prepended_zero(self, mock_navigate_byid):
-        # First call returns no result (indicating bad ID), second call with '0' prepended returns a valid comid
-        mock_navigate_byid.side_effect = [pd.DataFrame(), pd.DataFrame({'nhdplus_comid': [12345]})]
+    def test_invalid_gage_ids_prepended_zero(self):
+        # The first check finds no result (indicating bad ID), the check with '0' prepended returns a valid comid
+        _StubNldiHandler.comids = {'USGS-012345678': '12345'}
         
         # Test data
         df = pd.DataFrame({'basin_id': ['12345678']})
         
         # Run function
-        result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id', replace_orig_gage_id_col=True)
+        result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id', replace_orig_gage_id_col=True,
+                                               precheck=False, nldi_url=self.nldi_url)
         
         # Assertions
         self.assertEqual(result_df.shape[0], 1)
         self.assertEqual(result_df['basin_id'].iloc[0], '012345678')  # Ensure the '0' has been prepended
 
-    @patch('pynhd.NLDI.navigate_byid')
-    def test_invalid_gage_ids_still_bad(self, mock_navigate_byid):
-        # Both calls return no result (indicating permanently bad ID)
-        mock_navigate_byid.side_effect = [pd.DataFrame(), pd.DataFrame()]
+    def test_invalid_gage_ids_still_bad(self):
+        # Both checks return no result (indicating permanently bad ID)
+        _StubNldiHandler.comids = dict()
         
         # Test data
         df = pd.DataFrame({'basin_id': ['12345678']})
         
         # Run function
-        result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id', replace_orig_gage_id_col=False)
+        result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id', replace_orig_gage_id_col=False,
+                                               precheck=False, nldi_url=self.nldi_url)
         
         # Assertions
         self.assertEqual(result_df.shape[0], 1)
@@ -292,15 +367,60 @@ class TestCheckFixNwissiteGageIds(unittest.TestCase):
         print(result_df['fix'].iloc[0])
         self.assertTrue(result_df['fix'].iloc[0]=='012345678')  # Ensure still bad ID results prepended 0 in 'fix' column
 
-    @patch('pynhd.NLDI.navigate_byid')
-    def test_empty_dataframe(self, mock_navigate_byid):
+    def test_empty_dataframe(self):
         # Empty DataFrame test
         df = pd.DataFrame({'basin_id': []})
         
         # Run function
-        result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id')
+        result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id', nldi_url=self.nldi_url)
         
         # Assertions
         self.assertTrue(result_df.empty)  # Should return an empty DataFrame
+
+    def test_precheck_no_network(self):
+        # Well-formed ids are accepted & 7-digit ids fixed without any NLDI requests
+        df = pd.DataFrame({'basin_id': ['1234567', '12345678', '1234567890', '123456789012345']})
+        result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id', nldi_url=self.nldi_url)
+        self.assertListEqual(result_df['basin_id'].tolist(),
+                             ['01234567', '12345678', '1234567890', '123456789012345'])
+        self.assertEqual(len(_StubNldiHandler.requests_seen), 0)
+
+    def test_precheck_ambiguous_network(self):
+        # Only the 9-digit id is ambiguous, and prepending '0' is confirmed by the NLDI
+        _StubNldiHandler.comids = {'USGS-0123456789': '12345'}
+        df = pd.DataFrame({'basin_id': ['123456789', '12345678']})
+        result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id', nldi_url=self.nldi_url)
+        self.assertListEqual(result_df['basin_id'].tolist(), ['0123456789', '12345678'])
+        self.assertListEqual(_StubNldiHandler.requests_seen, ['USGS-123456789', 'USGS-0123456789'])
+
+    def test_site_list(self):
+        path_site_list = Path(tempfile.mkdtemp())/Path('site_list.csv')
+        pd.DataFrame({'site_no': ['01234567', '87654321']}).to_csv(path_site_list, index=False)
+        df = pd.DataFrame({'basin_id': ['1234567', '87654321', '99999999']})
+        with self.assertWarns(UserWarning):
+            result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id', replace_orig_gage_id_col=False,
+                                                   path_site_list=path_site_list, nldi_url=self.nldi_url)
+        self.assertListEqual(result_df['fix'].tolist()[0:2], ['01234567', '87654321'])
+        self.assertEqual(len(_StubNldiHandler.requests_seen), 0)
+
+    def test_site_list_precheck(self):
+        # 7-digit ids are fixed by the precheck, even when missing from an incomplete site list
+        path_site_list = Path(tempfile.mkdtemp())/Path('site_list.csv')
+        pd.DataFrame({'site_no': ['87654321']}).to_csv(path_site_list, index=False)
+        df = pd.DataFrame({'basin_id': ['1234567', '87654321']})
+        result_df = check_fix_nwissite_gageids(df, gage_id_col='basin_id', replace_orig_gage_id_col=False,
+                                               path_site_list=path_site_list, nldi_url=self.nldi_url)
+        self.assertListEqual(result_df['fix'].tolist(), ['01234567', '87654321'])
+        self.assertEqual(len(_StubNldiHandler.requests_seen), 0)
+        with self.assertRaisesRegex(ValueError, r'\.csv or \.parquet'):
+            check_fix_nwissite_gageids(df, gage_id_col='basin_id', path_site_list=path_site_list.with_suffix('.txt'))
+
+class TestPrecheckNwissiteGageIds(unittest.TestCase):
+    def test_classify(self):
+        gids = pd.Series(['1234567', '12345678', '123456789', '1234567890',
+                          '123456789012345', '12345', 'USGS123', '12345678901234'])
+        rslt = _precheck_nwissite_gageids(gids)
+        self.assertListEqual(rslt.tolist(), ['fix', 'ok', 'ambiguous', 'ok',
+                                             'ok', 'ambiguous', 'ambiguous', 'ambiguous'])
 if __name__ == '__main__':
     unittest.main()
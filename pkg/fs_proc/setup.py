@@ -18,7 +18,9 @@ setup(
         'pyyaml',
         'wheel',
         'xarray',
-        'zarr'
+        'zarr',
+        'pynhd',
+        'requests'
     ],
     classifiers=[
         "Programming Language :: Python :: 3",
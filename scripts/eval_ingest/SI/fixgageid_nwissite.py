@@ -15,13 +15,17 @@ dict_datasets = {'CFE': {'sub_path_data': 'CFE/CFE.csv',
                           'gage_id_col':'basin'},
                  'lm': {'sub_path_data': 'linear_model/linear.csv',
                         'gage_id_col':'site_id'}}
+# Optional local .csv/.parquet of known USGS site numbers (column 'site_no').
+# When provided, gage ids are checked against this file instead of the NLDI.
+path_site_list = None
 
 for k, v in dict_datasets.items():
     path_data = Path(dir_base/Path(v['sub_path_data']))
     gage_id_col = v['gage_id_col']
     print(path_data)
     df = pd.read_csv(path_data,dtype={gage_id_col :str})
-    cmbo_df = check_fix_nwissite_gageids(df, gage_id_col = gage_id_col)
+    cmbo_df = check_fix_nwissite_gageids(df, gage_id_col = gage_id_col,
+                                         path_site_list = path_site_list)
     df_diff = pd.concat([df,cmbo_df]).drop_duplicates(keep=False)
     if df_diff.shape[0] > 0:
     